@@ -86,16 +86,25 @@ module kb_Metrics {
         bool narrative_is_deleted;
     } JobState;
 
+    /*
+        continuation_token - the continuation_token of the previous page of
+            a query sorted the same way, by created, updated or user, as an
+            alternative to offset: the next page is found directly, however
+            deep it is. The result has the continuation_token of the page
+            after it, when there may be one.
+    */
     typedef structure {
         list<user_id> user_ids;
         epoch_range epoch_range;
         int offset;
         int limit;
+        string continuation_token;
     } GetJobsParams;
 
     typedef structure {
         list<JobState> job_states;
         int total_count;
+        string continuation_token;
     } GetJobsResult;
 
     funcdef get_jobs(GetJobsParams params)
@@ -145,6 +154,12 @@ module kb_Metrics {
         list<string> app; 
     } FilterSpec;
 
+    /*
+        continuation_token - as for get_jobs, for queries sorted by
+            created, updated or user.
+        skip_counts - if true, the found_count and total_count of the
+            result are null; the query then costs only its page.
+    */
     typedef structure {
         list<FilterSpec> filter;
         epoch_range epoch_range;
@@ -152,16 +167,25 @@ module kb_Metrics {
         list<SearchSpec> search;
         int offset;
         int limit;
+        string continuation_token;
+        bool skip_counts;
     } QueryJobsParams;
 
     typedef structure {
         list<JobStateMinimal> job_states;
         int total_count;
+        string continuation_token;
     } QueryJobsResult;
 
     funcdef query_jobs(QueryJobsParams params)
         returns (QueryJobsResult result) authentication required;
 
+    /*
+        continuation_token - as for get_jobs, for queries sorted by
+            created, updated or user.
+        skip_counts - if true, the found_count and total_count of the
+            result are null; the query then costs only its page.
+    */
     typedef structure {
         list<FilterSpec> filter;
         epoch_range epoch_range;
@@ -169,16 +193,37 @@ module kb_Metrics {
         list<SearchSpec> search;
         int offset;
         int limit;
+        string continuation_token;
+        bool skip_counts;
     } QueryJobsAdminParams;
 
     typedef structure {
         list<JobStateMinimal> job_states;
         int total_count;
+        string continuation_token;
     } QueryJobsAdminResult;
 
     funcdef query_jobs_admin(QueryJobsAdminParams params)
         returns (QueryJobsAdminResult result) authentication required;
 
+    /*
+        The number of jobs of each of the given users (user_counts) and
+        the total number of jobs, as of a few seconds ago; a user who is
+        not an admin can only count their own jobs, and their total is the
+        number of their jobs.
+    */
+    typedef structure {
+        list<user_id> user_ids;
+    } GetJobCountsParams;
+
+    typedef structure {
+        mapping<user_id, int> user_counts;
+        int total_count;
+    } GetJobCountsResult;
+
+    funcdef get_job_counts(GetJobCountsParams params)
+        returns (GetJobCountsResult result) authentication required;
+
     /* Get an individual job by id */
 
     typedef structure {
@@ -205,9 +250,57 @@ module kb_Metrics {
     typedef structure {
         UnspecifiedObject metrics_result;
     } MetricsOutput;
+
+    /*
+        Parameters for the cached reporting methods.
+        Reports are cached for a few minutes, keyed by the method, the
+        user_ids and the days on which epoch_range starts and ends.
+        bypass_cache - if true, the report is run and the cache not used.
+        refresh_cache - if true, the report is run and its cached result
+            replaced.
+    */
+    typedef structure {
+        list<user_id> user_ids;
+        epoch_range epoch_range;
+        bool bypass_cache;
+        bool refresh_cache;
+    } MetricsReportParams;
+
+    /*
+        The result of a cached reporting method.
+        stats - the cache statistics: status (hit, miss, bypass or
+            refresh), age (milliseconds since the result was computed),
+            and the hits, misses and entries of the cache.
+    */
+    typedef structure {
+        UnspecifiedObject metrics_result;
+        UnspecifiedObject stats;
+    } MetricsReportOutput;
    
+    /*
+        Parameters for update_metrics.
+        incremental - if true, each update stage processes only the changes
+            since the end of its last run (or since the start of epoch_range
+            on the first run) up to the end of epoch_range (by default, now),
+            saving its progress as it goes; user_ids may not be given.
+        parallel - if true, the user, activity and narrative updates run
+            concurrently, and a failed update does not stop the others.
+        backfill_chunk_days - if given, epoch_range is processed in chunks
+            of this many days (e.g. 1 or 7), several chunks at a time if
+            parallel is true; for rebuilding the metrics over long ranges.
+        Unless backfilling, every run also brings the workspace rollups of
+        the reporting methods up to date.
+    */
+    typedef structure {
+        list<user_id> user_ids;
+        epoch_range epoch_range;
+        bool incremental;
+        bool parallel;
+        int backfill_chunk_days;
+    } UpdateMetricsParams;
+
     /** For writing to mongodb metrics **/ 
-    funcdef update_metrics(MetricsInputParams params)
+    funcdef update_metrics(UpdateMetricsParams params)
         returns (MetricsOutput return_records) authentication required;
 
     /** For retrieving from mongodb metrics **/ 
@@ -217,14 +310,14 @@ module kb_Metrics {
     funcdef get_nonkbuser_details(MetricsInputParams params)
         returns (MetricsOutput return_records) authentication required;
 
-    funcdef get_signup_returning_users(MetricsInputParams params)
-        returns (MetricsOutput return_records) authentication required;
+    funcdef get_signup_returning_users(MetricsReportParams params)
+        returns (MetricsReportOutput return_records) authentication required;
 
-    funcdef get_signup_returning_nonkbusers(MetricsInputParams params)
-        returns (MetricsOutput return_records) authentication required;
+    funcdef get_signup_returning_nonkbusers(MetricsReportParams params)
+        returns (MetricsReportOutput return_records) authentication required;
     
-    funcdef get_user_counts_per_day(MetricsInputParams params)
-        returns (MetricsOutput return_records) authentication required;
+    funcdef get_user_counts_per_day(MetricsReportParams params)
+        returns (MetricsReportOutput return_records) authentication required;
 
     funcdef get_total_logins(MetricsInputParams params)
         returns (MetricsOutput return_records) authentication required;
@@ -238,15 +331,24 @@ module kb_Metrics {
     funcdef get_user_numObjs(MetricsInputParams params)
         returns (MetricsOutput return_records) authentication required;
 
-    funcdef get_narrative_stats(MetricsInputParams params)
-        returns (MetricsOutput return_records) authentication required;
+    funcdef get_narrative_stats(MetricsReportParams params)
+        returns (MetricsReportOutput return_records) authentication required;
 
-    funcdef get_all_narrative_stats(MetricsInputParams params)
-        returns (MetricsOutput return_records) authentication required;
+    funcdef get_all_narrative_stats(MetricsReportParams params)
+        returns (MetricsReportOutput return_records) authentication required;
 
     funcdef get_user_ws_stats(MetricsInputParams params)
         returns (MetricsOutput return_records) authentication required;
 
+    /*
+        The per user, year and month workspace metrics of get_user_logins,
+        get_user_numObjs and get_user_ws_stats together, computed in a
+        single pass: each record has the fields year_mon_user_logins,
+        count_user_numObjs and count_user_ws.
+    */
+    funcdef get_user_ws_metrics(MetricsInputParams params)
+        returns (MetricsOutput return_records) authentication required;
+
     typedef structure {
         string username;
     } IsAdminParams;
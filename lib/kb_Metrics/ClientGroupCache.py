@@ -0,0 +1,150 @@
+from collections import namedtuple
+import json
+import os
+import threading
+import time
+
+from kb_Metrics.Util import get_config_number
+
+# Seconds the Catalog client groups are served before they are refreshed
+CLIENT_GROUPS_TTL = 300
+
+# An immutable, published state of the client groups; like the narrative
+# map, it is read without a lock and replaced as a whole.
+ClientGroupSnapshot = namedtuple('ClientGroupSnapshot',
+                                 ['client_groups', 'fetched_at'])
+
+
+def save_client_groups(snapshot, cache_file):
+    """
+    save_client_groups--write the client groups to a json file, replaced
+    atomically so that a concurrent reader never sees a partial file
+    """
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(snapshot.client_groups, f)
+    os.replace(tmp_file, cache_file)
+
+
+def load_client_groups(cache_file):
+    """
+    load_client_groups--read the client groups written by
+    save_client_groups, as of the time the file was written; returns None
+    if there is no usable file
+    """
+    if not cache_file or not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file) as f:
+            client_groups = json.load(f)
+        return ClientGroupSnapshot(client_groups,
+                                   os.path.getmtime(cache_file))
+    except (OSError, ValueError):
+        return None
+
+
+class ClientGroupCache:
+    """
+    ClientGroupCache--the Catalog client groups, shared by all requests of
+    the process. They are fetched by the first request, and refreshed in
+    the background by the first request that finds them older than ttl
+    seconds, which is served the stale ones meanwhile. If a refresh fails
+    the stale client groups are kept until the next attempt, ttl seconds
+    later. Each fetch is saved to cache_file, the fallback of a process
+    that cannot reach the Catalog when it starts.
+    """
+    # Process level state, shared by all instances.
+    snapshot = None
+    attempted_at = 0
+    refresh_error = None
+    refresher = None
+    refresher_lock = threading.Lock()
+    fetch_lock = threading.Lock()
+
+    def __init__(self, config, fetch):
+        # fetch(token) returns the client groups from the Catalog
+        self.fetch = fetch
+        self.ttl = get_config_number(config, 'client-groups-ttl',
+                                     CLIENT_GROUPS_TTL)
+        self.cache_file = config.get('client-groups-file')
+        if self.cache_file is None and config.get('scratch'):
+            self.cache_file = os.path.join(config['scratch'],
+                                           'client_groups.json')
+
+    def _refresh(self, token):
+        cls = ClientGroupCache
+        cls.attempted_at = time.time()
+        client_groups = self.fetch(token)
+        cls.snapshot = ClientGroupSnapshot(client_groups, time.time())
+        cls.refresh_error = None
+        if self.cache_file:
+            try:
+                save_client_groups(cls.snapshot, self.cache_file)
+            except OSError as ex:
+                # the file is only a fallback for the next start
+                print('Error saving client groups: ' + str(ex))
+
+    def _refresh_loop(self, token):
+        try:
+            self._refresh(token)
+        except Exception as ex:
+            # keep serving the stale client groups
+            ClientGroupCache.refresh_error = ex
+            print('Error refreshing client groups: ' + str(ex))
+
+    def _start_refresher(self, token):
+        cls = ClientGroupCache
+        with cls.refresher_lock:
+            if cls.refresher is not None and cls.refresher.is_alive():
+                return
+            cls.refresher = threading.Thread(
+                target=self._refresh_loop, args=(token,),
+                name='ClientGroupCacheRefresher', daemon=True)
+            cls.refresher.start()
+
+    def get(self, token):
+        """
+        get--the client groups, fetched with the token if this process
+        has none yet, or from the cache_file if the Catalog cannot be
+        reached then
+        """
+        cls = ClientGroupCache
+        snapshot = cls.snapshot
+        if snapshot is None:
+            with cls.fetch_lock:
+                if cls.snapshot is None:
+                    try:
+                        self._refresh(token)
+                    except Exception as ex:
+                        fallback = load_client_groups(self.cache_file)
+                        if fallback is None:
+                            raise
+                        print('Error fetching client groups, using ' +
+                              self.cache_file + ': ' + str(ex))
+                        cls.refresh_error = ex
+                        cls.snapshot = fallback
+                snapshot = cls.snapshot
+        elif time.time() - max(snapshot.fetched_at,
+                               cls.attempted_at) >= self.ttl:
+            self._start_refresher(token)
+        return snapshot.client_groups
+
+    def age(self):
+        """
+        age--milliseconds since the client groups were fetched from the
+        Catalog, or None if there are none yet
+        """
+        snapshot = ClientGroupCache.snapshot
+        if snapshot is None:
+            return None
+        return round((time.time() - snapshot.fetched_at) * 1000)
+
+    @staticmethod
+    def clear():
+        """
+        clear--drop the client groups of this process
+        """
+        with ClientGroupCache.fetch_lock:
+            ClientGroupCache.snapshot = None
+            ClientGroupCache.attempted_at = 0
+            ClientGroupCache.refresh_error = None
@@ -1,8 +1,22 @@
-from kb_Metrics.metrics_dbi import MongoMetricsDBI
+from kb_Metrics.metrics_dbi import MongoMetricsDBI, get_pool_config
+from kb_Metrics.Util import get_config_number
+from kb_Metrics.PackedNarrativeMap import (PackedNarrativeMap,
+                                           pack_narratives,
+                                           write_packed_narratives)
+from collections import namedtuple
+import fcntl
+import gzip
+import os
+import struct
 import threading
 import time
 
-LOCK_TIMEOUT = 5
+# Seconds a request will wait for the initial narrative map to be built
+BUILD_TIMEOUT = 60
+# Seconds between incremental refreshes of the narrative map
+REFRESH_INTERVAL = 30
+# Minimum seconds between writes of the on-disk narrative map snapshot
+SAVE_INTERVAL = 300
 
 
 def get_config_list(config, config_key):
@@ -14,85 +28,278 @@ def get_config_list(config, config_key):
     return [x.strip() for x in list_str.split(',') if x.strip()]
 
 
+def get_config_bool(config, config_key):
+    value = config.get(config_key)
+    return str(value).strip().lower() in ('true', 'yes', '1')
+
+
+# An immutable, published state of the narrative map. Readers grab the
+# current snapshot with a single attribute read and never need a lock; the
+# refresher builds a new snapshot and swaps the reference.
+NarrativeSnapshot = namedtuple('NarrativeSnapshot',
+                               ['narrative_map', 'max_time', 'refreshed_at'])
+
+
+def save_snapshot(snapshot, cache_file):
+    """
+    save_snapshot--write the packed narrative map, which carries its own
+    high-water mark, to a gzipped file; the file is replaced atomically so
+    a concurrent reader (or a crash) never sees a partial snapshot
+    """
+    tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+    with gzip.open(tmp_file, 'wb') as f:
+        f.write(snapshot.narrative_map.buffer)
+    os.replace(tmp_file, cache_file)
+
+
+def load_snapshot(cache_file):
+    """
+    load_snapshot--read a snapshot written by save_snapshot; returns None
+    if there is no usable snapshot file
+    """
+    if not cache_file or not os.path.isfile(cache_file):
+        return None
+    try:
+        with gzip.open(cache_file, 'rb') as f:
+            narrative_map = PackedNarrativeMap(f.read())
+        return NarrativeSnapshot(narrative_map, narrative_map.max_time,
+                                 os.path.getmtime(cache_file))
+    except (OSError, EOFError, ValueError, struct.error):
+        # a corrupt or foreign file just means a full rebuild
+        return None
+
+
+def acquire_writer_lock(lock_path):
+    """
+    acquire_writer_lock--try to take the exclusive lock that makes this
+    process the single writer of a shared narrative map; returns the open
+    lock file (which must stay open to hold the lock) or None
+    """
+    lock_file = open(lock_path, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def add_narratives(narrative_map, ws_narratives, max_time):
+    """
+    add_narratives--add the workspace narratives to the given map of
+    {key=ws_id, value=(ws_nm, narr_nm, narr_ver, deleted)} and return the
+    new high-water mark of their last_saved_at times (in milliseconds)
+    """
+    for wsnarr in ws_narratives:
+        ws_nm = wsnarr.get('name', '')  # workspace_name or ''
+        narr_nm = None
+        last_saved_at = int(
+            round(wsnarr['last_saved_at'].timestamp() * 1000))
+        max_time = max([max_time or 0, last_saved_at])
+        # narr_nm = ws_nm  # default narrative_name
+        # TODO: this is suspect, because the narrative metadata field
+        # should ALWAYS be available.
+        # And we actually no longer need
+        # the narrative version; so we can skip this eventually
+        # and certainly shouldn't use it since a default object
+        # number doesn't make any sense.
+        narr_ver = '1'  # default narrative_objNo
+        n_keys = wsnarr['narr_keys']
+        n_vals = wsnarr['narr_values']
+        for i in range(0, len(n_keys)):
+            if n_keys[i] == 'narrative_nice_name':
+                narr_nm = n_vals[i]
+            if n_keys[i] == 'narrative':
+                narr_ver = n_vals[i]
+
+        # If the narrative nice name is not present, a temporary
+        # narrative, which by convention has the title 'Untitled'
+        # in the Narrative UI.
+        if narr_nm is None:
+            narr_nm = 'Untitled'
+
+        narrative_map[wsnarr['workspace_id']] = (
+            ws_nm, narr_nm, narr_ver, wsnarr['deleted'])
+    return max_time
+
+
 class NarrativeCache:
-    narrative_map = None
-    narrative_map_max_time = None
-    id = 0
-
-    def __init__(self, config):
-        self.narrative_map_cache = None
-        self.metrics_dbi = MongoMetricsDBI(config.get('mongodb-host'),
-                                           get_config_list(
-                                               config, 'mongodb-databases'),
-                                           config.get('mongodb-user', ''),
-                                           config.get('mongodb-pwd', ''))
-        self.lock = threading.Lock()
-
-    def _get(self):
-        # Instance version of the cache does not change once set.
-        # The lifetime of this cache is an individual request.
-        if self.narrative_map_cache is not None:
-            return self.narrative_map_cache
+    # Process level state, shared by all instances.
+    snapshot = None
+    refresher = None
+    refresher_lock = threading.Lock()
+    ready = threading.Event()
+    refresh_error = None
+    saved_at = None
+    shared_writer = None
+    shared_file_id = None
 
+    def __init__(self, config, metrics_dbi=None):
+        if metrics_dbi is None:
+            metrics_dbi = MongoMetricsDBI(config.get('mongodb-host'),
+                                          get_config_list(
+                                              config, 'mongodb-databases'),
+                                          config.get('mongodb-user', ''),
+                                          config.get('mongodb-pwd', ''),
+                                          **get_pool_config(config))
+        self.metrics_dbi = metrics_dbi
+        self.refresh_interval = get_config_number(
+            config, 'narrative-cache-refresh-interval', REFRESH_INTERVAL)
+        self.build_timeout = get_config_number(
+            config, 'narrative-cache-build-timeout', BUILD_TIMEOUT)
+        self.cache_file = config.get('narrative-cache-file')
+        if self.cache_file is None and config.get('scratch'):
+            self.cache_file = os.path.join(config['scratch'],
+                                           'narrative_cache.packed.gz')
+        self.shared_file = None
+        if get_config_bool(config, 'narrative-cache-shared'):
+            self.shared_file = config.get('narrative-cache-shared-file')
+            if self.shared_file is None:
+                if not config.get('scratch'):
+                    raise ValueError(
+                        'narrative-cache-shared requires either '
+                        '"narrative-cache-shared-file" or "scratch" in config')
+                self.shared_file = os.path.join(config['scratch'],
+                                                'narrative_cache.map')
+
+    @staticmethod
+    def refresh(metrics_dbi, cache_file=None):
+        """
+        refresh--build the narrative map, or bring the current one up to
+        date with the narratives saved since its high-water mark, and
+        publish the result as a new snapshot. A cold process starts from
+        the snapshot saved in cache_file, if any, and so only fetches the
+        narratives saved since that snapshot was written.
+        """
         cls = NarrativeCache
+        snapshot = cls.snapshot
+        if snapshot is None:
+            snapshot = load_snapshot(cache_file)
+            if snapshot is not None:
+                cls.snapshot = snapshot
+                cls.saved_at = time.time()
 
-        # So we cache the narrative map in this controller instance.
-        if cls.narrative_map is None:
-            cls.narrative_map = dict()
-            ws_narratives = self.metrics_dbi.list_ws_narratives(
-                include_del=True)
-            if len(ws_narratives) == 0:
-                return cls.narrative_map
+        if snapshot is None or snapshot.max_time is None:
+            # This also handles the case in which there were NO narratives
+            # initially, and thus the max time was not set.
+            ws_narratives = metrics_dbi.list_ws_narratives(include_del=True)
+            narrative_map = dict()
+            max_time = add_narratives(narrative_map, ws_narratives, None)
+            packed = pack_narratives(sorted(narrative_map.items()), max_time)
         else:
-            if cls.narrative_map_max_time is None:
-                # This handles the case in which there were NO narratives
-                # initially, and thus the max time was not set.
-                ws_narratives = self.metrics_dbi.list_ws_narratives(
+            ws_narratives = metrics_dbi.list_more_ws_narratives(
+                include_del=True, from_time=snapshot.max_time)
+            if len(ws_narratives) == 0:
+                cls.snapshot = snapshot._replace(refreshed_at=time.time())
+                return
+            # a published map is never changed; merge the updates into a
+            # new one instead
+            updates = dict()
+            max_time = add_narratives(updates, ws_narratives,
+                                      snapshot.max_time)
+            packed = snapshot.narrative_map.merged(updates, max_time)
+
+        cls.snapshot = NarrativeSnapshot(PackedNarrativeMap(packed),
+                                         max_time, time.time())
+
+        if cache_file and (cls.saved_at is None or
+                           time.time() - cls.saved_at >= SAVE_INTERVAL):
+            try:
+                save_snapshot(cls.snapshot, cache_file)
+                cls.saved_at = time.time()
+            except OSError as ex:
+                # the on-disk copy is only an optimization for the next start
+                print('Error saving Narrative Cache snapshot: ' + str(ex))
+
+    @staticmethod
+    def refresh_shared(metrics_dbi, shared_file):
+        """
+        refresh_shared--keep the narrative map in a packed file shared by
+        all worker processes on this host. The one process holding the
+        writer lock brings the file up to date; every process (the writer
+        included) publishes a read-only memory map of the current file as
+        its snapshot, so the map is built once and held in memory once.
+        """
+        cls = NarrativeCache
+        if cls.shared_writer is None:
+            # also taken over here if the previous writer process exited
+            cls.shared_writer = acquire_writer_lock(shared_file + '.lock')
+
+        if cls.shared_writer is not None:
+            current = PackedNarrativeMap.from_file(shared_file)
+            if current is None or current.max_time is None:
+                ws_narratives = metrics_dbi.list_ws_narratives(
                     include_del=True)
+                narrative_map = dict()
+                max_time = add_narratives(narrative_map, ws_narratives, None)
+                write_packed_narratives(shared_file, pack_narratives(
+                    sorted(narrative_map.items()), max_time))
             else:
-                ws_narratives = self.metrics_dbi.list_more_ws_narratives(
-                    include_del=True, from_time=cls.narrative_map_max_time)
+                ws_narratives = metrics_dbi.list_more_ws_narratives(
+                    include_del=True, from_time=current.max_time)
+                if len(ws_narratives) == 0:
+                    # the file modification time tells readers how current
+                    # the shared map is
+                    os.utime(shared_file)
+                else:
+                    updates = dict()
+                    max_time = add_narratives(updates, ws_narratives,
+                                              current.max_time)
+                    write_packed_narratives(
+                        shared_file, current.merged(updates, max_time))
 
-            if len(ws_narratives) == 0:
-                self.narrative_map_cache = cls.narrative_map
-                return cls.narrative_map
-
-        max_time = cls.narrative_map_max_time or 0
-        for wsnarr in ws_narratives:
-            ws_nm = wsnarr.get('name', '')  # workspace_name or ''
-            narr_nm = None
-            last_saved_at = int(
-                round(wsnarr['last_saved_at'].timestamp() * 1000))
-            max_time = max([max_time, last_saved_at])
-            # narr_nm = ws_nm  # default narrative_name
-            # TODO: this is suspect, because the narrative metadata field
-            # should ALWAYS be available.
-            # And we actually no longer need
-            # the narrative version; so we can skip this eventually
-            # and certainly shouldn't use it since a default object
-            # number doesn't make any sense.
-            narr_ver = '1'  # default narrative_objNo
-            n_keys = wsnarr['narr_keys']
-            n_vals = wsnarr['narr_values']
-            for i in range(0, len(n_keys)):
-                if n_keys[i] == 'narrative_nice_name':
-                    narr_nm = n_vals[i]
-                if n_keys[i] == 'narrative':
-                    narr_ver = n_vals[i]
-
-            # If the narrative nice name is not present, a temporary
-            # narrative, which by convention has the title 'Untitled'
-            # in the Narrative UI.
-            if narr_nm is None:
-                narr_nm = 'Untitled'
-
-            cls.narrative_map[wsnarr['workspace_id']] = (
-                ws_nm, narr_nm, narr_ver, wsnarr['deleted'])
-
-        cls.narrative_map_max_time = max_time
-        self.narrative_map_cache = cls.narrative_map
-
-        return cls.narrative_map
+        cls._publish_shared(shared_file)
+
+    @staticmethod
+    def _publish_shared(shared_file):
+        cls = NarrativeCache
+        try:
+            stat = os.stat(shared_file)
+        except FileNotFoundError:
+            # the writer has not finished its first build yet
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        snapshot = cls.snapshot
+        if snapshot is not None and file_id == cls.shared_file_id:
+            cls.snapshot = snapshot._replace(refreshed_at=stat.st_mtime)
+            return
+        # the writer replaced the file; map the new one
+        narrative_map = PackedNarrativeMap.from_file(shared_file)
+        if narrative_map is None:
+            return
+        cls.shared_file_id = file_id
+        cls.snapshot = NarrativeSnapshot(narrative_map,
+                                         narrative_map.max_time,
+                                         stat.st_mtime)
+
+    @staticmethod
+    def _refresh_loop(cache):
+        cls = NarrativeCache
+        while True:
+            try:
+                if cache.shared_file:
+                    cls.refresh_shared(cache.metrics_dbi, cache.shared_file)
+                else:
+                    cls.refresh(cache.metrics_dbi, cache.cache_file)
+                cls.refresh_error = None
+            except Exception as ex:
+                # keep serving the last snapshot; try again next interval
+                cls.refresh_error = ex
+            finally:
+                if cls.snapshot is not None or cls.refresh_error is not None:
+                    cls.ready.set()
+            time.sleep(cache.refresh_interval)
+
+    def _start_refresher(self):
+        cls = NarrativeCache
+        with cls.refresher_lock:
+            if cls.refresher is not None and cls.refresher.is_alive():
+                return
+            cls.refresher = threading.Thread(
+                target=cls._refresh_loop,
+                args=(self,),
+                name='NarrativeCacheRefresher', daemon=True)
+            cls.refresher.start()
 
     def get(self):
         """
@@ -100,17 +307,32 @@ class NarrativeCache:
         (or narrative_nice_name if it exists) into a dictionary
         of {key=ws_id, value=(ws_nm, narr_nm, narr_ver)}
         """
+        # The current snapshot is read on every call: an instance may live
+        # as long as the process (e.g. that of the Impl's controller), and
+        # must not keep serving the map it first saw.
+        cls = NarrativeCache
+        self._start_refresher()
 
-        start = time.time()
-        self.id = self.id + 1
-        if self.lock.acquire(blocking=True, timeout=LOCK_TIMEOUT):
-            try:
-                return self._get()
-            finally:
-                self.lock.release()
-        else:
-            elapsed = time.time() - start
-            raise Exception(
-                'LOCK  [' + str(self.id) +
-                '] Timeout acquiring lock on Narrative Cache after ' +
-                str(elapsed))
+        snapshot = cls.snapshot
+        if snapshot is None:
+            # Only a cold process has to wait, and only for the first build.
+            start = time.time()
+            cls.ready.wait(timeout=self.build_timeout)
+            snapshot = cls.snapshot
+            if snapshot is None:
+                elapsed = time.time() - start
+                raise Exception(
+                    'Timeout waiting for Narrative Cache after ' +
+                    str(elapsed) + ': ' + str(cls.refresh_error))
+
+        return snapshot.narrative_map
+
+    def age(self):
+        """
+        age--milliseconds since the current snapshot of the narrative map
+        was last brought up to date, or None if there is no snapshot yet
+        """
+        snapshot = NarrativeCache.snapshot
+        if snapshot is None:
+            return None
+        return round((time.time() - snapshot.refreshed_at) * 1000)
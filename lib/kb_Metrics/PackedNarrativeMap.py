@@ -0,0 +1,170 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+import mmap
+import os
+import struct
+
+# Layout of a packed narrative map (native byte order):
+#   header   magic, entry count, max_time (-1 if unset), string table size
+#   ids      count x int64 workspace ids, sorted ascending
+#   records  count x (offset, length) of ws_nm, narr_nm and narr_ver in the
+#            string table, plus a deleted flag byte
+#   strings  utf-8 string table; equal strings are stored only once
+MAGIC = b'KBMNARR1'
+HEADER = struct.Struct('=8sqqq')
+RECORD = struct.Struct('=IIIIIIB')
+ID_SIZE = array('q').itemsize
+
+DELETED_FLAGS = {False: 0, True: 1, None: 2}
+FLAG_DELETED = (False, True, None)
+
+
+def pack_narratives(items, max_time):
+    """
+    pack_narratives--pack an iterable of
+    (ws_id, (ws_nm, narr_nm, narr_ver, deleted)) pairs, sorted by ws_id,
+    into the bytes of a packed narrative map
+    """
+    ids = array('q')
+    records = bytearray()
+    strings = bytearray()
+    offsets = dict()
+
+    def intern(value):
+        if value is None:
+            value = ''
+        found = offsets.get(value)
+        if found is None:
+            encoded = str(value).encode('utf-8')
+            found = (len(strings), len(encoded))
+            strings.extend(encoded)
+            offsets[value] = found
+        return found
+
+    for ws_id, (ws_nm, narr_nm, narr_ver, deleted) in items:
+        ids.append(ws_id)
+        records.extend(RECORD.pack(*intern(ws_nm), *intern(narr_nm),
+                                   *intern(narr_ver),
+                                   DELETED_FLAGS[deleted]))
+
+    header = HEADER.pack(MAGIC, len(ids),
+                         -1 if max_time is None else max_time, len(strings))
+    return b''.join([header, ids.tobytes(), records, strings])
+
+
+def write_packed_narratives(path, packed):
+    """
+    write_packed_narratives--atomically replace the file at path with the
+    given packed narrative map; processes that have the previous file
+    mapped keep a valid view of it
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(packed)
+    os.replace(tmp_path, path)
+
+
+class PackedNarrativeMap(Mapping):
+    """
+    PackedNarrativeMap--read-only mapping of
+    {key=ws_id, value=(ws_nm, narr_nm, narr_ver, deleted)} backed by a
+    single buffer, looked up by binary search over the sorted id column.
+    The buffer may be a bytes object or a read-only mmap of a file written
+    by write_packed_narratives, in which case all processes mapping the
+    same file share one copy of it.
+
+    An entry costs 33 bytes plus its share of the deduplicated string
+    table, against roughly 270 bytes as a dict of tuples of str; lookups
+    are a few microseconds. See test/benchmarks/narrative_map_memory.py.
+    """
+
+    def __init__(self, buffer):
+        magic, count, max_time, strings_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a packed narrative map')
+        self.buffer = buffer
+        self._count = count
+        self.max_time = None if max_time < 0 else max_time
+
+        ids_start = HEADER.size
+        records_start = ids_start + count * ID_SIZE
+        self._strings_start = records_start + count * RECORD.size
+        view = memoryview(buffer)
+        self._ids = view[ids_start:records_start].cast('q')
+        self._records = view[records_start:self._strings_start]
+        self._strings = view[self._strings_start:
+                             self._strings_start + strings_size]
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        from_file--map the packed narrative map file read-only; returns
+        None if the file does not exist
+        """
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+        return cls(buffer)
+
+    def _index(self, ws_id):
+        if not isinstance(ws_id, int):
+            return None
+        i = bisect_left(self._ids, ws_id)
+        if i < self._count and self._ids[i] == ws_id:
+            return i
+        return None
+
+    def _string(self, offset, length):
+        return str(self._strings[offset:offset + length], 'utf-8')
+
+    def _entry(self, i):
+        (ws_off, ws_len, nm_off, nm_len,
+         ver_off, ver_len, deleted) = RECORD.unpack_from(
+            self._records, i * RECORD.size)
+        return (self._string(ws_off, ws_len), self._string(nm_off, nm_len),
+                self._string(ver_off, ver_len), FLAG_DELETED[deleted])
+
+    def __getitem__(self, ws_id):
+        i = self._index(ws_id)
+        if i is None:
+            raise KeyError(ws_id)
+        return self._entry(i)
+
+    def __contains__(self, ws_id):
+        return self._index(ws_id) is not None
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return self._count
+
+    def iter_entries(self):
+        for i in range(self._count):
+            yield self._ids[i], self._entry(i)
+
+    def merged(self, updates, max_time):
+        """
+        merged--pack a new map holding these entries overridden by the
+        given {ws_id: narrative info} updates
+        """
+        upd_ids = sorted(updates)
+
+        def merge():
+            u = 0
+            for ws_id, narr_info in self.iter_entries():
+                while u < len(upd_ids) and upd_ids[u] < ws_id:
+                    yield upd_ids[u], updates[upd_ids[u]]
+                    u += 1
+                if u < len(upd_ids) and upd_ids[u] == ws_id:
+                    yield ws_id, updates[ws_id]
+                    u += 1
+                else:
+                    yield ws_id, narr_info
+            for ws_id in upd_ids[u:]:
+                yield ws_id, updates[ws_id]
+
+        return pack_narratives(merge(), max_time)
@@ -0,0 +1,254 @@
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+# Default seconds a cached result is served for
+CACHE_TTL = 300
+# Default number of cached results kept before the least recently used
+# one is evicted
+CACHE_MAX_ENTRIES = 256
+# Default seconds the job counts are served for before the jobs created
+# since are added to them
+JOB_COUNT_TTL = 10
+# Default seconds between full recounts of the job counts
+JOB_COUNT_RECOUNT_INTERVAL = 3600
+
+
+class ResultCache:
+    """
+    ResultCache--a TTL and LRU cache of the results of the reporting
+    methods, keyed by the method and its normalized parameters. The
+    cached results are shared by all instances in the process, and so by
+    all requests; they must be treated as read-only. A ttl or max_entries
+    of 0 turns the cache off.
+    """
+    # Process level state, shared by all instances.
+    entries = OrderedDict()
+    lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key):
+        """
+        get--the cached (result, age in milliseconds) for the key, or None
+        if there is no unexpired result for it
+        """
+        cls = ResultCache
+        now = time.time()
+        with cls.lock:
+            entry = cls.entries.get(key)
+            if entry is not None:
+                result, cached_at = entry
+                if now - cached_at < self.ttl:
+                    cls.entries.move_to_end(key)
+                    cls.hits += 1
+                    return result, round((now - cached_at) * 1000)
+                del cls.entries[key]
+            cls.misses += 1
+        return None
+
+    def put(self, key, result):
+        """
+        put--cache the result for the key, evicting the least recently
+        used results beyond max_entries
+        """
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        cls = ResultCache
+        with cls.lock:
+            cls.entries[key] = (result, time.time())
+            cls.entries.move_to_end(key)
+            while len(cls.entries) > self.max_entries:
+                cls.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        stats--the hit and miss counts of the cache since the process
+        started, and the number of results it holds
+        """
+        cls = ResultCache
+        with cls.lock:
+            return {'hits': cls.hits, 'misses': cls.misses,
+                    'entries': len(cls.entries)}
+
+    @staticmethod
+    def clear():
+        """
+        clear--drop all cached results, e.g. after the metrics db has
+        been updated
+        """
+        with ResultCache.lock:
+            ResultCache.entries.clear()
+
+
+class ClosedBucketCache:
+    """
+    ClosedBucketCache--the members of the closed (past) month buckets of
+    the reporting queries, e.g. the users who signed up in a month, which
+    do not change once the month is over. A bucket is built once, then
+    kept in memory for the life of the process and in the metrics db
+    across restarts. A bucket that does change (e.g. when update_metrics
+    sees a later login of a user who signed up in it) is dropped with
+    drop(), which bumps the generation of its report in the metrics db so
+    that every process discards its in-memory copies.
+    """
+    # Process level state, shared by all instances.
+    buckets = dict()
+    generations = dict()
+    lock = threading.Lock()
+
+    def __init__(self, metrics_dbi):
+        self.metrics_dbi = metrics_dbi
+
+    def get(self, report, bucket_ids, build, refresh=False):
+        """
+        get--{(year, month): members} of the report for the given buckets;
+        those neither in memory nor in the metrics db (or all of them,
+        with refresh) are built with build(bucket_ids), which returns
+        {(year, month): members}, and saved
+        """
+        cls = ClosedBucketCache
+        generation = self.metrics_dbi.get_report_generation(report)
+        found = dict()
+        with cls.lock:
+            if cls.generations.get(report) != generation:
+                cls.buckets[report] = dict()
+                cls.generations[report] = generation
+            mem_buckets = cls.buckets[report]
+            if not refresh:
+                found = {b: mem_buckets[b] for b in bucket_ids
+                         if b in mem_buckets}
+
+        missing = [b for b in bucket_ids if b not in found]
+        if missing and not refresh:
+            saved = self.metrics_dbi.get_report_buckets(report, missing)
+            found.update(saved)
+            self._remember(report, generation, saved)
+            missing = [b for b in missing if b not in found]
+
+        if missing:
+            built = build(missing)
+            # an empty month is a bucket too
+            built = {b: built.get(b, []) for b in missing}
+            found.update(built)
+            # buckets dropped while they were being built may be stale
+            if self.metrics_dbi.get_report_generation(report) == generation:
+                self.metrics_dbi.save_report_buckets(report, built)
+                self._remember(report, generation, built)
+        return found
+
+    def _remember(self, report, generation, buckets):
+        cls = ClosedBucketCache
+        with cls.lock:
+            if cls.generations.get(report) == generation:
+                cls.buckets[report].update(buckets)
+
+    def drop(self, report, bucket_ids):
+        """
+        drop--discard the given buckets of the report, in this process
+        and in the metrics db
+        """
+        cls = ClosedBucketCache
+        self.metrics_dbi.drop_report_buckets(report, bucket_ids)
+        with cls.lock:
+            mem_buckets = cls.buckets.get(report, dict())
+            for b in bucket_ids:
+                mem_buckets.pop(b, None)
+
+    @staticmethod
+    def clear():
+        """
+        clear--drop the in-memory buckets of this process
+        """
+        with ClosedBucketCache.lock:
+            ClosedBucketCache.buckets.clear()
+            ClosedBucketCache.generations.clear()
+
+
+# An immutable, published state of the job counts; like the narrative
+# map, it is read without a lock and replaced as a whole.
+JobCounts = namedtuple('JobCounts', ['user_counts', 'total_count', 'last_id',
+                                     'updated_at', 'recounted_at'])
+
+
+class JobCountCache:
+    """
+    JobCountCache--the number of jobs of each user, and of all users, in
+    userjobstate. The counts are kept current to within ttl seconds by
+    adding the jobs created since (those with a larger _id) to them, and
+    recounted every recount_interval seconds, which also corrects them for
+    deleted jobs. Only one request of the process counts at a time, with
+    no lock held that the others wait on: they are served the previous
+    counts meanwhile, and wait only if there are none yet. A ttl of 0
+    turns the cache off.
+    """
+    # Process level state, shared by all instances.
+    counts = None
+    count_lock = threading.Lock()
+
+    def __init__(self, metrics_dbi, ttl=JOB_COUNT_TTL,
+                 recount_interval=JOB_COUNT_RECOUNT_INTERVAL):
+        self.metrics_dbi = metrics_dbi
+        self.ttl = ttl
+        self.recount_interval = recount_interval
+
+    def enabled(self):
+        return self.ttl > 0
+
+    def _stale(self, counts, now):
+        return (counts is None or
+                now - counts.recounted_at >= self.recount_interval or
+                now - counts.updated_at >= self.ttl)
+
+    def _count(self, counts, now):
+        """
+        _count--the counts brought up to date: recounted, or with the jobs
+        created since added to them
+        """
+        if (counts is None or
+                now - counts.recounted_at >= self.recount_interval):
+            user_counts, last_id = self.metrics_dbi.aggr_ujs_user_counts()
+            return JobCounts(user_counts, sum(user_counts.values()),
+                             last_id, now, now)
+        new_counts, last_id = self.metrics_dbi.aggr_ujs_user_counts(
+            counts.last_id)
+        user_counts = dict(counts.user_counts)
+        for user, count in new_counts.items():
+            user_counts[user] = user_counts.get(user, 0) + count
+        return JobCounts(user_counts,
+                         counts.total_count + sum(new_counts.values()),
+                         counts.last_id if last_id is None else last_id,
+                         now, counts.recounted_at)
+
+    def get(self, user_ids=None):
+        """
+        get--{user: job count} of the given users and the total job count
+        of all users
+        """
+        cls = JobCountCache
+        counts = cls.counts
+        # with no counts yet, wait for the request counting them
+        if (self._stale(counts, time.time()) and
+                cls.count_lock.acquire(blocking=counts is None)):
+            try:
+                counts = cls.counts
+                now = time.time()
+                if self._stale(counts, now):
+                    counts = self._count(counts, now)
+                    cls.counts = counts
+            finally:
+                cls.count_lock.release()
+        return ({user: counts.user_counts.get(user, 0)
+                 for user in user_ids or []}, counts.total_count)
+
+    @staticmethod
+    def clear():
+        """
+        clear--drop the job counts, which are recounted on the next get
+        """
+        with JobCountCache.count_lock:
+            JobCountCache.counts = None
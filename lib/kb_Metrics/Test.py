@@ -15,6 +15,7 @@ from kb_Metrics.kb_MetricsImpl import kb_Metrics
 from kb_Metrics.kb_MetricsServer import MethodContext
 from kb_Metrics.metricsdb_controller import MetricsMongoDBController
 from kb_Metrics.NarrativeCache import NarrativeCache
+from kb_Metrics.ResultCache import ResultCache, JobCountCache
 
 DEBUG = False
 
@@ -80,6 +81,11 @@ class Test(unittest.TestCase):
         test_cfg_dict = dict(config.items("test"))
         cls.test_cfg = test_cfg_dict
 
+    def setUp(self):
+        # every test starts without cached reports or job counts
+        ResultCache.clear()
+        JobCountCache.clear()
+
     @classmethod
     def tearDownClass(cls):
         if hasattr(cls, 'wsName'):
@@ -27,6 +27,17 @@ def _unix_time_millis_from_datetime_trusted(dt):
     return int((dt.replace(tzinfo=None) - epoch).total_seconds() * 1000)
 
 
+def get_config_number(config, config_key, default, number_type=float):
+    """
+    get_config_number--the config value of config_key as a number_type, or
+    default if it is missing or blank
+    """
+    value = config.get(config_key)
+    if value is None or str(value).strip() == '':
+        return default
+    return number_type(value)
+
+
 def _convert_to_datetime(dt):
     if type(dt) in [datetime.date, datetime.datetime]:
         return dt
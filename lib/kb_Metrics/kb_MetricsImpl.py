@@ -37,6 +37,7 @@ This KBase SDK module implements methods for generating various KBase metrics.
         # Any configuration parameters that are important should be parsed and
         # saved in the constructor.
         self.config = config
+        # shared by all requests; it keeps no per-request state
         self.mdb_controller = MetricsMongoDBController(config)
         #END_CONSTRUCTOR
         pass
@@ -53,15 +54,14 @@ This KBase SDK module implements methods for generating various KBase metrics.
            since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter "offset"
            of Long, parameter "limit" of Long
         :returns: instance of type "AppMetricsResult" -> structure: parameter
-           "job_states" of unspecified object, parameter "total_count" of Long
+           "job_states" of unspecified object, parameter "total_count" of
+           Long
         """
         # ctx is the context object
         # return variables are: return_records
         #BEGIN get_app_metrics
-        controller = MetricsMongoDBController(self.config)
-        return_records = controller.get_user_job_states(ctx['user_id'],
-                                                        params,
-                                                        ctx['token'])
+        return_records = self.mdb_controller.get_user_job_states(
+            ctx['user_id'], params, ctx['token'])
         #END get_app_metrics
 
         # At some point might do deeper type checking...
@@ -74,14 +74,19 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_jobs(self, ctx, params):
         """
-        :param params: instance of type "GetJobsParams" -> structure:
-           parameter "user_ids" of list of type "user_id" (A string for the
-           user id), parameter "epoch_range" of type "epoch_range" -> tuple
-           of size 2: parameter "e_lowerbound" of type "epoch" (A Unix epoch
-           (the time since 00:00:00 1/1/1970 UTC) in milliseconds.),
-           parameter "e_upperbound" of type "epoch" (A Unix epoch (the time
-           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter "offset"
-           of Long, parameter "limit" of Long
+        :param params: instance of type "GetJobsParams" (continuation_token -
+           the continuation_token of the previous page of a query sorted the
+           same way, by created, updated or user, as an alternative to
+           offset: the next page is found directly, however deep it is. The
+           result has the continuation_token of the page after it, when there
+           may be one.) -> structure: parameter "user_ids" of list of type
+           "user_id" (A string for the user id), parameter "epoch_range" of
+           type "epoch_range" -> tuple of size 2: parameter "e_lowerbound" of
+           type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970 UTC)
+           in milliseconds.), parameter "e_upperbound" of type "epoch" (A
+           Unix epoch (the time since 00:00:00 1/1/1970 UTC) in
+           milliseconds.), parameter "offset" of Long, parameter "limit" of
+           Long, parameter "continuation_token" of String
         :returns: instance of type "GetJobsResult" -> structure: parameter
            "job_states" of list of type "JobState" (This method was added in
            order to provide an improved job browsing experience, prior to EE2
@@ -99,15 +104,14 @@ This KBase SDK module implements methods for generating various KBase metrics.
            parameter "wsid" of String, parameter "narrative_objNo" of Long,
            parameter "narrative_name" of String, parameter "workspace_name"
            of String, parameter "narrative_is_deleted" of type "bool",
-           parameter "total_count" of Long
+           parameter "total_count" of Long, parameter "continuation_token" of
+           String
         """
         # ctx is the context object
         # return variables are: result
         #BEGIN get_jobs
-        controller = MetricsMongoDBController(self.config)
-        result = controller.get_user_job_states(ctx['user_id'],
-                                                params,
-                                                ctx['token'])
+        result = self.mdb_controller.get_user_job_states(
+            ctx['user_id'], params, ctx['token'])
         #END get_jobs
 
         # At some point might do deeper type checking...
@@ -120,21 +124,26 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def query_jobs(self, ctx, params):
         """
-        :param params: instance of type "QueryJobsParams" -> structure:
-           parameter "filter" of list of type "FilterSpec" -> structure:
-           parameter "job_id" of list of String, parameter "user_id" of list
-           of type "user_id" (A string for the user id), parameter "status"
-           of list of String, parameter "workspace" of list of Long,
-           parameter "app" of list of String, parameter "epoch_range" of type
-           "epoch_range" -> tuple of size 2: parameter "e_lowerbound" of type
-           "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970 UTC) in
-           milliseconds.), parameter "e_upperbound" of type "epoch" (A Unix
-           epoch (the time since 00:00:00 1/1/1970 UTC) in milliseconds.),
-           parameter "sort" of list of type "SortSpec" -> structure:
-           parameter "field" of String, parameter "direction" of String,
-           parameter "search" of list of type "SearchSpec" -> structure:
-           parameter "term" of String, parameter "type" of String, parameter
-           "offset" of Long, parameter "limit" of Long
+        :param params: instance of type "QueryJobsParams" (continuation_token
+           - as for get_jobs, for queries sorted by created, updated or user.
+           skip_counts - if true, the found_count and total_count of the
+           result are null; the query then costs only its page.) ->
+           structure: parameter "filter" of list of type "FilterSpec" ->
+           structure: parameter "job_id" of list of String, parameter
+           "user_id" of list of type "user_id" (A string for the user id),
+           parameter "status" of list of String, parameter "workspace" of
+           list of Long, parameter "app" of list of String, parameter
+           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
+           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
+           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
+           UTC) in milliseconds.), parameter "sort" of list of type
+           "SortSpec" -> structure: parameter "field" of String, parameter
+           "direction" of String, parameter "search" of list of type
+           "SearchSpec" -> structure: parameter "term" of String, parameter
+           "type" of String, parameter "offset" of Long, parameter "limit" of
+           Long, parameter "continuation_token" of String, parameter
+           "skip_counts" of type "bool"
         :returns: instance of type "QueryJobsResult" -> structure: parameter
            "job_states" of list of type "JobStateMinimal" (Query jobs) ->
            structure: parameter "job_id" of type "JobID", parameter "app_id"
@@ -146,15 +155,13 @@ This KBase SDK module implements methods for generating various KBase metrics.
            "creation_time" of Long, parameter "exec_start_time" of Long,
            parameter "finish_time" of Long, parameter "modification_time" of
            Long, parameter "client_groups" of list of String, parameter
-           "total_count" of Long
+           "total_count" of Long, parameter "continuation_token" of String
         """
         # ctx is the context object
         # return variables are: result
         #BEGIN query_jobs
-        controller = MetricsMongoDBController(self.config)
-        result = controller.query_jobs_user(ctx['user_id'],
-                                            params,
-                                            ctx['token'])
+        result = self.mdb_controller.query_jobs_user(
+            ctx['user_id'], params, ctx['token'])
         #END query_jobs
 
         # At some point might do deeper type checking...
@@ -167,21 +174,26 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def query_jobs_admin(self, ctx, params):
         """
-        :param params: instance of type "QueryJobsAdminParams" -> structure:
-           parameter "filter" of list of type "FilterSpec" -> structure:
-           parameter "job_id" of list of String, parameter "user_id" of list
-           of type "user_id" (A string for the user id), parameter "status"
-           of list of String, parameter "workspace" of list of Long,
-           parameter "app" of list of String, parameter "epoch_range" of type
-           "epoch_range" -> tuple of size 2: parameter "e_lowerbound" of type
-           "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970 UTC) in
-           milliseconds.), parameter "e_upperbound" of type "epoch" (A Unix
-           epoch (the time since 00:00:00 1/1/1970 UTC) in milliseconds.),
-           parameter "sort" of list of type "SortSpec" -> structure:
-           parameter "field" of String, parameter "direction" of String,
-           parameter "search" of list of type "SearchSpec" -> structure:
-           parameter "term" of String, parameter "type" of String, parameter
-           "offset" of Long, parameter "limit" of Long
+        :param params: instance of type "QueryJobsAdminParams"
+           (continuation_token - as for get_jobs, for queries sorted by
+           created, updated or user. skip_counts - if true, the found_count
+           and total_count of the result are null; the query then costs only
+           its page.) -> structure: parameter "filter" of list of type
+           "FilterSpec" -> structure: parameter "job_id" of list of String,
+           parameter "user_id" of list of type "user_id" (A string for the
+           user id), parameter "status" of list of String, parameter
+           "workspace" of list of Long, parameter "app" of list of String,
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "sort" of list
+           of type "SortSpec" -> structure: parameter "field" of String,
+           parameter "direction" of String, parameter "search" of list of
+           type "SearchSpec" -> structure: parameter "term" of String,
+           parameter "type" of String, parameter "offset" of Long, parameter
+           "limit" of Long, parameter "continuation_token" of String,
+           parameter "skip_counts" of type "bool"
         :returns: instance of type "QueryJobsAdminResult" -> structure:
            parameter "job_states" of list of type "JobStateMinimal" (Query
            jobs) -> structure: parameter "job_id" of type "JobID", parameter
@@ -193,13 +205,13 @@ This KBase SDK module implements methods for generating various KBase metrics.
            parameter "creation_time" of Long, parameter "exec_start_time" of
            Long, parameter "finish_time" of Long, parameter
            "modification_time" of Long, parameter "client_groups" of list of
-           String, parameter "total_count" of Long
+           String, parameter "total_count" of Long, parameter
+           "continuation_token" of String
         """
         # ctx is the context object
         # return variables are: result
         #BEGIN query_jobs_admin
-        controller = MetricsMongoDBController(self.config)
-        result = controller.query_jobs_admin(
+        result = self.mdb_controller.query_jobs_admin(
             ctx['user_id'], params, ctx['token'])
         #END query_jobs_admin
 
@@ -211,6 +223,33 @@ This KBase SDK module implements methods for generating various KBase metrics.
         # return the results
         return [result]
 
+    def get_job_counts(self, ctx, params):
+        """
+        :param params: instance of type "GetJobCountsParams" (The number of
+           jobs of each of the given users (user_counts) and the total number
+           of jobs, as of a few seconds ago; a user who is not an admin can
+           only count their own jobs, and their total is the number of their
+           jobs.) -> structure: parameter "user_ids" of list of type
+           "user_id" (A string for the user id)
+        :returns: instance of type "GetJobCountsResult" -> structure:
+           parameter "user_counts" of mapping from type "user_id" (A string
+           for the user id) to Long, parameter "total_count" of Long
+        """
+        # ctx is the context object
+        # return variables are: result
+        #BEGIN get_job_counts
+        result = self.mdb_controller.get_job_counts(
+            ctx['user_id'], params, ctx['token'])
+        #END get_job_counts
+
+        # At some point might do deeper type checking...
+        if not isinstance(result, dict):
+            raise ValueError('Method get_job_counts ' +
+                             'return value result ' +
+                             'is not type dict as required.')
+        # return the results
+        return [result]
+
     def get_job(self, ctx, params):
         """
         :param params: instance of type "GetJobParams" (Get an individual job
@@ -237,10 +276,8 @@ This KBase SDK module implements methods for generating various KBase metrics.
         # ctx is the context object
         # return variables are: result
         #BEGIN get_job
-        controller = MetricsMongoDBController(self.config)
-        result = controller.get_user_job_state(ctx['user_id'],
-                                               params,
-                                               ctx['token'])
+        result = self.mdb_controller.get_user_job_state(
+            ctx['user_id'], params, ctx['token'])
         #END get_job
 
         # At some point might do deeper type checking...
@@ -279,14 +316,26 @@ This KBase SDK module implements methods for generating various KBase metrics.
     def update_metrics(self, ctx, params):
         """
         For writing to mongodb metrics *
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
+        :param params: instance of type "UpdateMetricsParams" (Parameters for
+           update_metrics. incremental - if true, each update stage processes
+           only the changes since the end of its last run (or since the start
+           of epoch_range on the first run) up to the end of epoch_range (by
+           default, now), saving its progress as it goes; user_ids may not be
+           given. parallel - if true, the user, activity and narrative
+           updates run concurrently, and a failed update does not stop the
+           others. backfill_chunk_days - if given, epoch_range is processed
+           in chunks of this many days (e.g. 1 or 7), several chunks at a
+           time if parallel is true; for rebuilding the metrics over long
+           ranges. Unless backfilling, every run also brings the workspace
+           rollups of the reporting methods up to date.) -> structure:
+           parameter "user_ids" of list of type "user_id" (A string for the
+           user id), parameter "epoch_range" of type "epoch_range" -> tuple
+           of size 2: parameter "e_lowerbound" of type "epoch" (A Unix epoch
+           (the time since 00:00:00 1/1/1970 UTC) in milliseconds.),
+           parameter "e_upperbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "incremental" of type "bool", parameter "parallel" of type "bool",
+           parameter "backfill_chunk_days" of Long
         :returns: instance of type "MetricsOutput" -> structure: parameter
            "metrics_result" of unspecified object
         """
@@ -365,16 +414,25 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_signup_returning_users(self, ctx, params):
         """
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
-        :returns: instance of type "MetricsOutput" -> structure: parameter
-           "metrics_result" of unspecified object
+        :param params: instance of type "MetricsReportParams" (Parameters for
+           the cached reporting methods. Reports are cached for a few
+           minutes, keyed by the method, the user_ids and the days on which
+           epoch_range starts and ends. bypass_cache - if true, the report is
+           run and the cache not used. refresh_cache - if true, the report is
+           run and its cached result replaced.) -> structure: parameter
+           "user_ids" of list of type "user_id" (A string for the user id),
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "bypass_cache"
+           of type "bool", parameter "refresh_cache" of type "bool"
+        :returns: instance of type "MetricsReportOutput" (The result of a
+           cached reporting method. stats - the cache statistics: status
+           (hit, miss, bypass or refresh), age (milliseconds since the result
+           was computed), and the hits, misses and entries of the cache.) ->
+           structure: parameter "metrics_result" of unspecified object,
+           parameter "stats" of unspecified object
         """
         # ctx is the context object
         # return variables are: return_records
@@ -393,16 +451,25 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_signup_returning_nonkbusers(self, ctx, params):
         """
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
-        :returns: instance of type "MetricsOutput" -> structure: parameter
-           "metrics_result" of unspecified object
+        :param params: instance of type "MetricsReportParams" (Parameters for
+           the cached reporting methods. Reports are cached for a few
+           minutes, keyed by the method, the user_ids and the days on which
+           epoch_range starts and ends. bypass_cache - if true, the report is
+           run and the cache not used. refresh_cache - if true, the report is
+           run and its cached result replaced.) -> structure: parameter
+           "user_ids" of list of type "user_id" (A string for the user id),
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "bypass_cache"
+           of type "bool", parameter "refresh_cache" of type "bool"
+        :returns: instance of type "MetricsReportOutput" (The result of a
+           cached reporting method. stats - the cache statistics: status
+           (hit, miss, bypass or refresh), age (milliseconds since the result
+           was computed), and the hits, misses and entries of the cache.) ->
+           structure: parameter "metrics_result" of unspecified object,
+           parameter "stats" of unspecified object
         """
         # ctx is the context object
         # return variables are: return_records
@@ -421,16 +488,25 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_user_counts_per_day(self, ctx, params):
         """
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
-        :returns: instance of type "MetricsOutput" -> structure: parameter
-           "metrics_result" of unspecified object
+        :param params: instance of type "MetricsReportParams" (Parameters for
+           the cached reporting methods. Reports are cached for a few
+           minutes, keyed by the method, the user_ids and the days on which
+           epoch_range starts and ends. bypass_cache - if true, the report is
+           run and the cache not used. refresh_cache - if true, the report is
+           run and its cached result replaced.) -> structure: parameter
+           "user_ids" of list of type "user_id" (A string for the user id),
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "bypass_cache"
+           of type "bool", parameter "refresh_cache" of type "bool"
+        :returns: instance of type "MetricsReportOutput" (The result of a
+           cached reporting method. stats - the cache statistics: status
+           (hit, miss, bypass or refresh), age (milliseconds since the result
+           was computed), and the hits, misses and entries of the cache.) ->
+           structure: parameter "metrics_result" of unspecified object,
+           parameter "stats" of unspecified object
         """
         # ctx is the context object
         # return variables are: return_records
@@ -561,16 +637,25 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_narrative_stats(self, ctx, params):
         """
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
-        :returns: instance of type "MetricsOutput" -> structure: parameter
-           "metrics_result" of unspecified object
+        :param params: instance of type "MetricsReportParams" (Parameters for
+           the cached reporting methods. Reports are cached for a few
+           minutes, keyed by the method, the user_ids and the days on which
+           epoch_range starts and ends. bypass_cache - if true, the report is
+           run and the cache not used. refresh_cache - if true, the report is
+           run and its cached result replaced.) -> structure: parameter
+           "user_ids" of list of type "user_id" (A string for the user id),
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "bypass_cache"
+           of type "bool", parameter "refresh_cache" of type "bool"
+        :returns: instance of type "MetricsReportOutput" (The result of a
+           cached reporting method. stats - the cache statistics: status
+           (hit, miss, bypass or refresh), age (milliseconds since the result
+           was computed), and the hits, misses and entries of the cache.) ->
+           structure: parameter "metrics_result" of unspecified object,
+           parameter "stats" of unspecified object
         """
         # ctx is the context object
         # return variables are: return_records
@@ -589,16 +674,25 @@ This KBase SDK module implements methods for generating various KBase metrics.
 
     def get_all_narrative_stats(self, ctx, params):
         """
-        :param params: instance of type "MetricsInputParams" (unified
-           input/output parameters) -> structure: parameter "user_ids" of
-           list of type "user_id" (A string for the user id), parameter
-           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
-           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
-           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
-           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
-           UTC) in milliseconds.)
-        :returns: instance of type "MetricsOutput" -> structure: parameter
-           "metrics_result" of unspecified object
+        :param params: instance of type "MetricsReportParams" (Parameters for
+           the cached reporting methods. Reports are cached for a few
+           minutes, keyed by the method, the user_ids and the days on which
+           epoch_range starts and ends. bypass_cache - if true, the report is
+           run and the cache not used. refresh_cache - if true, the report is
+           run and its cached result replaced.) -> structure: parameter
+           "user_ids" of list of type "user_id" (A string for the user id),
+           parameter "epoch_range" of type "epoch_range" -> tuple of size 2:
+           parameter "e_lowerbound" of type "epoch" (A Unix epoch (the time
+           since 00:00:00 1/1/1970 UTC) in milliseconds.), parameter
+           "e_upperbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "bypass_cache"
+           of type "bool", parameter "refresh_cache" of type "bool"
+        :returns: instance of type "MetricsReportOutput" (The result of a
+           cached reporting method. stats - the cache statistics: status
+           (hit, miss, bypass or refresh), age (milliseconds since the result
+           was computed), and the hits, misses and entries of the cache.) ->
+           structure: parameter "metrics_result" of unspecified object,
+           parameter "stats" of unspecified object
         """
         # ctx is the context object
         # return variables are: return_records
@@ -643,6 +737,38 @@ This KBase SDK module implements methods for generating various KBase metrics.
         # return the results
         return [return_records]
 
+    def get_user_ws_metrics(self, ctx, params):
+        """
+        The per user, year and month workspace metrics of get_user_logins,
+        get_user_numObjs and get_user_ws_stats together, computed in a
+        single pass: each record has the fields year_mon_user_logins,
+        count_user_numObjs and count_user_ws.
+        :param params: instance of type "MetricsInputParams" (unified
+           input/output parameters) -> structure: parameter "user_ids" of
+           list of type "user_id" (A string for the user id), parameter
+           "epoch_range" of type "epoch_range" -> tuple of size 2: parameter
+           "e_lowerbound" of type "epoch" (A Unix epoch (the time since
+           00:00:00 1/1/1970 UTC) in milliseconds.), parameter "e_upperbound"
+           of type "epoch" (A Unix epoch (the time since 00:00:00 1/1/1970
+           UTC) in milliseconds.)
+        :returns: instance of type "MetricsOutput" -> structure: parameter
+           "metrics_result" of unspecified object
+        """
+        # ctx is the context object
+        # return variables are: return_records
+        #BEGIN get_user_ws_metrics
+        return_records = self.mdb_controller.get_user_ws_metrics(
+            ctx['user_id'], params, ctx['token'])
+        #END get_user_ws_metrics
+
+        # At some point might do deeper type checking...
+        if not isinstance(return_records, dict):
+            raise ValueError('Method get_user_ws_metrics ' +
+                             'return value return_records ' +
+                             'is not type dict as required.')
+        # return the results
+        return [return_records]
+
     def is_admin(self, ctx, params):
         """
         :param params: instance of type "IsAdminParams" -> structure:
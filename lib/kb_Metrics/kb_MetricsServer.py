@@ -354,6 +354,10 @@ class Application(object):
                              name='kb_Metrics.query_jobs_admin',
                              types=[dict])
         self.method_authentication['kb_Metrics.query_jobs_admin'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_Metrics.get_job_counts,
+                             name='kb_Metrics.get_job_counts',
+                             types=[dict])
+        self.method_authentication['kb_Metrics.get_job_counts'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_Metrics.get_job,
                              name='kb_Metrics.get_job',
                              types=[dict])
@@ -414,6 +418,10 @@ class Application(object):
                              name='kb_Metrics.get_user_ws_stats',
                              types=[dict])
         self.method_authentication['kb_Metrics.get_user_ws_stats'] = 'required'  # noqa
+        self.rpc_service.add(impl_kb_Metrics.get_user_ws_metrics,
+                             name='kb_Metrics.get_user_ws_metrics',
+                             types=[dict])
+        self.method_authentication['kb_Metrics.get_user_ws_metrics'] = 'required'  # noqa
         self.rpc_service.add(impl_kb_Metrics.is_admin,
                              name='kb_Metrics.is_admin',
                              types=[dict])
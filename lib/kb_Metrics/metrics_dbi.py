@@ -1,15 +1,222 @@
+import base64
+import binascii
 import datetime
-from pymongo import MongoClient, DESCENDING, ASCENDING
+import os
+import threading
+from pymongo import (MongoClient, DESCENDING, ASCENDING, UpdateOne,
+                     ReplaceOne)
 from pymongo.errors import BulkWriteError
 from bson.objectid import ObjectId
+from bson.son import SON
 from bson import json_util
 import json
 import re
 
-from kb_Metrics.Util import _convert_to_datetime
+from kb_Metrics.Util import (_convert_to_datetime,
+                             _unix_time_millis_from_datetime,
+                             get_config_number)
 from operator import itemgetter
 
 
+# Process-wide registry of MongoClient instances. A MongoClient is
+# thread-safe and maintains its own connection pool, so one instance per
+# (host, credentials, auth db, pool options) is shared by every request
+# served by this worker process. The process id is part of the key because
+# a MongoClient must not be used across a fork (e.g. uwsgi workers).
+_mongo_clients = dict()
+_mongo_clients_lock = threading.Lock()
+
+# Default number of update operations sent to mongo in one bulk_write
+UPDATE_CHUNK_SIZE = 1000
+
+
+def get_mongo_client(mongo_host, mongo_user, mongo_psswd, auth_db,
+                     **pool_options):
+    """
+    get_mongo_client--return the shared MongoClient for the given
+    connection parameters, creating it on first use.
+    """
+    pool_options = {k: v for k, v in pool_options.items() if v is not None}
+    key = (os.getpid(), mongo_host, mongo_user, mongo_psswd, auth_db,
+           tuple(sorted(pool_options.items())))
+    with _mongo_clients_lock:
+        client = _mongo_clients.get(key)
+        if client is None:
+            client = MongoClient(
+                "mongodb://" + mongo_user + ":" + mongo_psswd +
+                "@" + mongo_host + "/" + auth_db, **pool_options)
+            _mongo_clients[key] = client
+    return client
+
+
+def get_pool_config(config):
+    """
+    get_pool_config--extract the optional connection pool settings from
+    the service config as keyword arguments for MongoMetricsDBI
+    """
+    return {'auth_db': config.get('mongodb-auth-db') or None,
+            'max_pool_size': get_config_number(
+                config, 'mongodb-max-pool-size', None, int),
+            'min_pool_size': get_config_number(
+                config, 'mongodb-min-pool-size', None, int)}
+
+
+def bulk_upsert(collection, upd_ops, chunk_size=UPDATE_CHUNK_SIZE):
+    """
+    bulk_upsert--send the iterable of UpdateOne operations to the given
+    collection with one ordered bulk_write per chunk_size operations;
+    returns the counts of matched, modified and upserted documents
+    """
+    counts = {'matched': 0, 'modified': 0, 'upserted': 0}
+    chunk = []
+
+    def flush():
+        # return an instance of BulkWriteResult
+        bulk_ret = collection.bulk_write(chunk, ordered=True)
+        counts['matched'] += bulk_ret.matched_count
+        counts['modified'] += bulk_ret.modified_count
+        counts['upserted'] += bulk_ret.upserted_count
+        del chunk[:]
+
+    for upd_op in upd_ops:
+        chunk.append(upd_op)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return counts
+
+
+def keyset_sorter(sorter):
+    """
+    keyset_sorter--the sort keys with _id appended as the final tie-break,
+    so that the order, and with it a continuation token, is exact
+    """
+    if not sorter:
+        return sorter
+    return list(sorter) + [('_id', sorter[-1][1])]
+
+
+def next_continuation_token(sorter, docs, limit):
+    """
+    next_continuation_token--the opaque token continuing a query sorted by
+    sorter after its last page docs; None if the page is the last one
+    """
+    if not sorter or not limit or len(docs) < limit:
+        return None
+    last_doc = docs[-1]
+    state = {'sort': [[field, direction] for field, direction in sorter],
+             'after': [last_doc.get(field)
+                       for field, _ in keyset_sorter(sorter)]}
+    return base64.urlsafe_b64encode(
+        json_util.dumps(state).encode('utf-8')).decode('ascii')
+
+
+def keyset_condition(sorter, token):
+    """
+    keyset_condition--the condition selecting the documents that follow,
+    in the order of sorter, the last document of the page the
+    continuation token was made for
+    """
+    try:
+        state = json_util.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        token_sorter = [(field, direction)
+                        for field, direction in state['sort']]
+        after = state['after']
+    except (AttributeError, KeyError, TypeError, ValueError,
+            binascii.Error):
+        raise ValueError('Invalid continuation token.')
+    if not sorter or token_sorter != list(sorter):
+        raise ValueError('The continuation token does not match the sort.')
+
+    keys = keyset_sorter(sorter)
+    if len(after) != len(keys):
+        raise ValueError('Invalid continuation token.')
+    conditions = []
+    for i, (field, direction) in enumerate(keys):
+        condition = {prev_field: after[j]
+                     for j, (prev_field, _) in enumerate(keys[:i])}
+        condition[field] = {
+            '$gt' if direction == ASCENDING else '$lt': after[i]}
+        conditions.append(condition)
+    return {'$or': conditions}
+
+
+def query_page(collection, find_filter, total_filter, sorter, projection,
+               offset=None, limit=None, continuation_token=None,
+               counts=True, total_count=None, page_stages=None):
+    """
+    query_page--a page of the documents of collection matching the
+    find_filter conditions (to be combined with $and), with the number of
+    them and the number matching the total_filter conditions (unless
+    given as total_count); the counts are None unless counts is set. A
+    limited page and its found count are taken in one aggregation
+    ($facet), and an empty total_filter is counted from the collection
+    metadata. page_stages are aggregation stages (e.g. a $lookup) run on
+    the page after its projection.
+    """
+    found_count = None
+    if not counts:
+        total_count = None
+    elif total_count is None:
+        if total_filter:
+            total_count = collection.count_documents({'$and': total_filter})
+        else:
+            total_count = collection.estimated_document_count()
+    if counts and find_filter == total_filter:
+        found_count = total_count
+    match_cond = {'$and': find_filter} if find_filter else {}
+
+    page_filter = list(find_filter)
+    if continuation_token is not None:
+        page_filter.append(keyset_condition(sorter, continuation_token))
+
+    def page_pipeline(page_match):
+        pipeline = [{'$match': page_match}] if page_match else []
+        if sorter:
+            pipeline.append({'$sort': SON(keyset_sorter(sorter))})
+        if offset:
+            pipeline.append({'$skip': offset})
+        if limit is not None:
+            pipeline.append({'$limit': limit})
+        pipeline.append({'$project': projection})
+        return pipeline + (page_stages or [])
+
+    if limit is None or not counts or found_count is not None:
+        # an unlimited page could overflow the single $facet result document
+        if page_stages:
+            docs = list(collection.aggregate(
+                page_pipeline({'$and': page_filter} if page_filter else {}),
+                allowDiskUse=True))
+        else:
+            cursor = collection.find(
+                {'$and': page_filter} if page_filter else {}, projection)
+            if sorter:
+                cursor.sort(keyset_sorter(sorter))
+            if offset is not None:
+                cursor.skip(offset)
+            if limit is not None:
+                cursor.limit(limit)
+            docs = list(cursor)
+        if counts and found_count is None:
+            found_count = collection.count_documents(match_cond)
+        return docs, found_count, total_count
+
+    # the sort is inside the page facet, where it coalesces with the
+    # skip and limit into a top-k sort
+    pipeline = []
+    if match_cond:
+        pipeline.append({'$match': match_cond})
+    pipeline.append({'$facet': {
+        'page': page_pipeline(page_filter[-1] if continuation_token
+                              is not None else None),
+        'found': [{'$count': 'count'}]}})
+    result = next(collection.aggregate(pipeline, allowDiskUse=True))
+    found = result['found']
+    return result['page'], found[0]['count'] if found else 0, total_count
+
+
 def unwrap_date(obj, prop):
     if prop not in obj:
         return None
@@ -37,6 +244,32 @@ class MongoMetricsDBI:
     _MT_USERS = 'users'  # 'test_users'#metrics.users
     _MT_DAILY_ACTIVITIES = 'daily_activities'
     _MT_NARRATIVES = 'narratives'  # metrics.narratives
+    _MT_WATERMARKS = 'update_watermarks'  # metrics.update_watermarks
+    # metrics.workspace_daily_rollups
+    _MT_WS_ROLLUPS = 'workspace_daily_rollups'
+    # metrics.workspace_rollup_members, the rollup each workspace is in
+    _MT_WS_ROLLUP_MEMBERS = 'workspace_rollup_members'
+    # metrics.closed_report_buckets
+    _MT_REPORT_BUCKETS = 'closed_report_buckets'
+    _MT_JOB_STATES = 'job_states'  # metrics.job_states
+
+    # The jobstate fields a continuation token of list_ujs_results may
+    # follow: those every jobstate has, so that no job is skipped
+    _UJS_RESULTS_TOKEN_FIELDS = ('created', 'updated', 'user')
+
+    # The jobstate fields read by query_ujs
+    _UJS_PROJECTION = {
+        'user': 1,
+        'created': 1,  # datetime.datetime(2015, 1, 9, 19, 36, 8, 561000)
+        'started': 1,
+        'updated': 1,
+        'status': 1,
+        'authparam': 1,  # "DEFAULT" or workspace_id
+        'authstrat': 1,  # "DEFAULT" or "kbaseworkspace"
+        'complete': 1,
+        'desc': 1,
+        'error': 1
+    }
 
     _USERPROFILES = 'profiles'  # user_profile_db.profiles
 
@@ -45,57 +278,67 @@ class MongoMetricsDBI:
     _EXEC_TASKS = 'exec_tasks'  # exec_engine.exec_tasks
     _TASK_QUEUE = 'task_queue'  # exec_engine.task_queue
 
+    # The fields of the exec_tasks the job assembly reads; of the params of
+    # the job input, which can be large, only the first is used
+    _EXEC_TASK_PROJECTION = {
+        '_id': 0,
+        'app_job_id': 1,
+        'ujs_job_id': 1,
+        'creation_time': 1,
+        'job_input.app_id': 1,
+        'job_input.method': 1,
+        'job_input.meta.tag': 1,
+        'job_input.wsid': 1,
+        'job_input.params': {'$slice': 1}
+    }
+
+    # _EXEC_TASK_PROJECTION in the $project of an aggregation, where $slice
+    # is the expression taking the array
+    _EXEC_TASK_LOOKUP_PROJECTION = {
+        **_EXEC_TASK_PROJECTION,
+        'job_input.params': {'$cond': [
+            {'$isArray': '$job_input.params'},
+            {'$slice': ['$job_input.params', 1]},
+            '$job_input.params']}
+    }
+
+    # Joins to each jobstate job the list of its exec_tasks, projected as
+    # list_exec_tasks projects them, so that a page of jobs stays well
+    # within the size of a $facet result. (The $expr match uses the
+    # ujs_job_id index from MongoDB 5.0.)
+    _EXEC_TASKS_LOOKUP = [
+        {'$lookup': {'from': _EXEC_TASKS,
+                     'let': {'ujs_job_id': {'$toString': '$_id'}},
+                     'pipeline': [
+                         {'$match': {'$expr': {
+                             '$eq': ['$ujs_job_id', '$$ujs_job_id']}}},
+                         {'$project': _EXEC_TASK_LOOKUP_PROJECTION}],
+                     'as': 'exec_tasks'}}]
+
+    # Process level state: {(mongo hosts, userjobstate database name):
+    # whether the exec_tasks can be joined to its jobs with a $lookup}
+    _exec_tasks_lookup = dict()
+
     _WS_WORKSPACES = 'workspaces'  # workspace.workspaces
     _WS_WSOBJECTS = 'workspaceObjects'  # workspace.workspaceObjects
 
-    def __init__(self, mongo_host, mongo_dbs, mongo_user, mongo_psswd):
+    def __init__(self, mongo_host, mongo_dbs, mongo_user, mongo_psswd,
+                 auth_db=None, max_pool_size=None, min_pool_size=None):
+        self.mongo_hosts = tuple(host.strip()
+                                 for host in mongo_host.split(','))
         self.mongo_clients = dict()
         self.metricsDBs = dict()
         for m_db in mongo_dbs:
-            # create the client and authenticate
-            self.mongo_clients[m_db] = MongoClient(
-                "mongodb://" + mongo_user + ":" + mongo_psswd +
-                "@" + mongo_host + "/" + m_db)
+            # grab the shared (pooled) client; if no common authentication
+            # database is configured, each database authenticates against
+            # itself and so gets its own client.
+            self.mongo_clients[m_db] = get_mongo_client(
+                mongo_host, mongo_user, mongo_psswd, auth_db or m_db,
+                maxPoolSize=max_pool_size, minPoolSize=min_pool_size)
             # grab a handle to the database
             self.metricsDBs[m_db] = self.mongo_clients[m_db][m_db]
 
     # Begin functions to write to the metrics database...
-    def update_user_records(self, upd_filter, upd_data, kbstaff):
-        """
-        update_user_records--update the user info in metrics.users
-        """
-        upd_op = {'$currentDate': {'recordLastUpdated': True},
-                  '$set': upd_data,
-                  '$setOnInsert': {'kbase_staff': kbstaff}}
-
-        # grab handle(s) to the database collection(s) targeted
-        mt_users = self.metricsDBs['metrics'][MongoMetricsDBI._MT_USERS]
-        update_ret = None
-
-        # return an instance of UpdateResult(raw_result, acknowledged)
-        update_ret = mt_users.update_one(upd_filter,
-                                         upd_op, upsert=True)
-
-        return update_ret
-
-    def update_activity_records(self, upd_filter, upd_data):
-        """
-        update_activity_records--
-        """
-        upd_op = {'$currentDate': {'recordLastUpdated': True},
-                  "$set": upd_data}
-
-        # grab handle(s) to the database collection(s) targeted
-        mt_coll = self.metricsDBs['metrics'][
-            MongoMetricsDBI._MT_DAILY_ACTIVITIES]
-        update_ret = None
-
-        # return an instance of UpdateResult(raw_result, acknowledged)
-        update_ret = mt_coll.update_one(upd_filter,
-                                        upd_op, upsert=True)
-
-        return update_ret
-
     def insert_activity_records(self, mt_docs):
         """
         Insert an iterable of user activity documents
@@ -122,30 +365,140 @@ class MongoMetricsDBI:
                 return bwe.details['nInserted']
         return len(insert_ret.inserted_ids)
 
-    def update_narrative_records(self, upd_filter, upd_data):
+    def bulk_update_user_records(self, user_records,
+                                 chunk_size=UPDATE_CHUNK_SIZE):
         """
-        update_narrative_records--
+        bulk_update_user_records--upsert the iterable of
+        (upd_filter, upd_data, kbstaff) user records into metrics.users,
+        chunk_size records per round trip
+        """
+        mt_users = self.metricsDBs['metrics'][MongoMetricsDBI._MT_USERS]
+        upd_ops = (UpdateOne(upd_filter,
+                             {'$currentDate': {'recordLastUpdated': True},
+                              '$set': upd_data,
+                              '$setOnInsert': {'kbase_staff': kbstaff}},
+                             upsert=True)
+                   for upd_filter, upd_data, kbstaff in user_records)
+        return bulk_upsert(mt_users, upd_ops, chunk_size)
+
+    def bulk_update_activity_records(self, activity_records,
+                                     chunk_size=UPDATE_CHUNK_SIZE):
+        """
+        bulk_update_activity_records--upsert the iterable of
+        (upd_filter, upd_data) activity records into metrics.daily_activities,
+        chunk_size records per round trip
+        """
+        mt_coll = self.metricsDBs['metrics'][
+            MongoMetricsDBI._MT_DAILY_ACTIVITIES]
+        upd_ops = (UpdateOne(upd_filter,
+                             {'$currentDate': {'recordLastUpdated': True},
+                              '$set': upd_data},
+                             upsert=True)
+                   for upd_filter, upd_data in activity_records)
+        return bulk_upsert(mt_coll, upd_ops, chunk_size)
+
+    def bulk_update_narrative_records(self, narrative_records,
+                                      chunk_size=UPDATE_CHUNK_SIZE):
+        """
+        bulk_update_narrative_records--upsert the iterable of
+        (upd_filter, upd_data) narrative records into metrics.narratives,
+        chunk_size records per round trip, then set the access_count of
+        any record still lacking one in a single pass
         """
-        upd_op = {'$currentDate': {'recordLastUpdated': True},
-                  '$setOnInsert': {'first_access': upd_data['last_saved_at']},
-                  '$set': upd_data,
-                  '$inc': {'access_count': 1}}
-
-        # grab handle(s) to the database collection(s) targeted
         mt_narrs = self.metricsDBs['metrics'][
             MongoMetricsDBI._MT_NARRATIVES]
-        update_ret = None
-
-        # return an instance of UpdateResult(raw_result, acknowledged)
-        update_ret = mt_narrs.update_one(upd_filter,
-                                         upd_op, upsert=True)
-
-        # re-touch the newly inserted records
-        mt_narrs.update({'access_count': {'$exists': False}},
-                        {'$set': {'access_count': 1}},
-                        upsert=True, multi=True)
+        upd_ops = (UpdateOne(upd_filter,
+                             {'$currentDate': {'recordLastUpdated': True},
+                              '$setOnInsert': {
+                                  'first_access': upd_data['last_saved_at']},
+                              '$set': upd_data,
+                              '$inc': {'access_count': 1}},
+                             upsert=True)
+                   for upd_filter, upd_data in narrative_records)
+        counts = bulk_upsert(mt_narrs, upd_ops, chunk_size)
+
+        # re-touch the records written before access_count was kept
+        mt_narrs.update_many({'access_count': {'$exists': False}},
+                             {'$set': {'access_count': 1}})
+        return counts
+
+    def get_watermark(self, stage):
+        """
+        get_watermark--the end (in milliseconds) of the last time window
+        processed by the given update_metrics stage, or None
+        """
+        mt_marks = self.metricsDBs['metrics'][MongoMetricsDBI._MT_WATERMARKS]
+        mark = mt_marks.find_one({'_id': stage})
+        if mark is None:
+            return None
+        return _unix_time_millis_from_datetime(mark['watermark'])
 
-        return update_ret
+    def set_watermark(self, stage, watermark):
+        """
+        set_watermark--record the end (in milliseconds) of the last time
+        window processed by the given update_metrics stage
+        """
+        mt_marks = self.metricsDBs['metrics'][MongoMetricsDBI._MT_WATERMARKS]
+        return mt_marks.update_one(
+            {'_id': stage},
+            {'$currentDate': {'recordLastUpdated': True},
+             '$set': {'watermark': _convert_to_datetime(watermark)}},
+            upsert=True)
+
+    def get_report_generation(self, report):
+        """
+        get_report_generation--the number of times the closed buckets of
+        the given report have been dropped
+        """
+        mt_buckets = (self.metricsDBs['metrics']
+                      [MongoMetricsDBI._MT_REPORT_BUCKETS])
+        gen = mt_buckets.find_one({'_id': report})
+        if gen is None:
+            return 0
+        return gen['generation']
+
+    def get_report_buckets(self, report, buckets):
+        """
+        get_report_buckets--the saved members of the given (year, month)
+        buckets of the report, as {(year, month): members}
+        """
+        mt_buckets = (self.metricsDBs['metrics']
+                      [MongoMetricsDBI._MT_REPORT_BUCKETS])
+        bucket_ids = ['{}:{}-{}'.format(report, year, month)
+                      for year, month in buckets]
+        return {(b['year'], b['month']): b['members']
+                for b in mt_buckets.find({'_id': {'$in': bucket_ids}})}
+
+    def save_report_buckets(self, report, buckets):
+        """
+        save_report_buckets--save the {(year, month): members} buckets of
+        the report
+        """
+        if not buckets:
+            return
+        mt_buckets = (self.metricsDBs['metrics']
+                      [MongoMetricsDBI._MT_REPORT_BUCKETS])
+        mt_buckets.bulk_write([
+            UpdateOne({'_id': '{}:{}-{}'.format(report, year, month)},
+                      {'$currentDate': {'recordLastUpdated': True},
+                       '$set': {'report': report, 'year': year,
+                                'month': month, 'members': members}},
+                      upsert=True)
+            for (year, month), members in buckets.items()])
+
+    def drop_report_buckets(self, report, buckets):
+        """
+        drop_report_buckets--delete the given (year, month) buckets of the
+        report and bump its generation, so that every process discards
+        its in-memory copies of them
+        """
+        mt_buckets = (self.metricsDBs['metrics']
+                      [MongoMetricsDBI._MT_REPORT_BUCKETS])
+        bucket_ids = ['{}:{}-{}'.format(report, year, month)
+                      for year, month in buckets]
+        mt_buckets.delete_many({'_id': {'$in': bucket_ids}})
+        mt_buckets.update_one({'_id': report},
+                              {'$inc': {'generation': 1}}, upsert=True)
     # End functions to write to the metrics database
 
     # Begin functions to query the metrics dbs...
@@ -254,9 +607,15 @@ class MongoMetricsDBI:
                                      [MongoMetricsDBI._WS_WSOBJECTS])
         return list(activities.aggregate(pipeline))
 
-    def list_ws_owners(self):
+    def list_ws_owners(self, ws_ids=None):
+        """
+        list_ws_owners--retrieve the owner/ws_id/name of the given
+        workspaces, or of all workspaces if ws_ids is None
+        """
         # Define the pipeline operations
         match_filter = {"cloning": {"$exists": False}}
+        if ws_ids is not None:
+            match_filter["ws"] = {"$in": list(ws_ids)}
         pipeline = [
             {"$match": match_filter},
             {"$project": {"username": "$owner",
@@ -487,6 +846,27 @@ class MongoMetricsDBI:
         m_cursor = kbwsobjs.aggregate(pipeline)
         return list(m_cursor)
 
+    def aggr_ws_firstAccess_monthly(self, minTime, maxTime):
+        """
+        aggr_ws_firstAccess_monthly--the ids of all the workspaces by the
+        year and month of their first access (as in list_ws_firstAccess)
+        between minTime and maxTime
+        [{'_id': {'year': 2016, 'month': 7}, 'ws_ids': [8768, ...]}]
+        """
+        pipeline = [
+            {"$match": {"del": False, "numver": 1}},
+            {"$group": {"_id": "$ws", "first_access": {"$min": "$moddate"}}},
+            {"$match": {"first_access": {
+                "$gte": _convert_to_datetime(minTime),
+                "$lte": _convert_to_datetime(maxTime)}}},
+            {"$group": {"_id": {"year": {"$year": "$first_access"},
+                                "month": {"$month": "$first_access"}},
+                        "ws_ids": {"$push": "$_id"}}}
+        ]
+        kbwsobjs = self.metricsDBs['workspace'][
+            MongoMetricsDBI._WS_WSOBJECTS]
+        return list(kbwsobjs.aggregate(pipeline))
+
     def list_ws_lastAccess(self, minTime, maxTime, ws_list=None):
         """
         list_ws_lastAccess--retrieve the ws_ids and last access month (yyyy-mm)
@@ -546,28 +926,31 @@ class MongoMetricsDBI:
             'ujs_job_id': {'$in': jobIDs}
         }
 
-        projection = {
-            '_id': 0,
-            'app_job_id': 1,
-            'ujs_job_id': 1,
-            'creation_time': 1,
-            'job_input': 1
-        }
-
         exec_engine_db = (self.metricsDBs['exec_engine']
                                          [MongoMetricsDBI._EXEC_TASKS])
-        cursor = exec_engine_db.find(match_cond, projection)
+        cursor = exec_engine_db.find(match_cond,
+                                     MongoMetricsDBI._EXEC_TASK_PROJECTION)
         return list(cursor)
 
     def aggr_user_details(self, userIds, minTime, maxTime,
-                          excluded_users=None):
+                          excluded_users=None, include_logins=False):
+        """
+        aggr_user_details--the auth2 details of the users created in the
+        time period or, with include_logins, also of those who logged in
+        during it
+        """
         # excluded_users has to be an array for '$nin'
         if excluded_users is None:
             excluded_users = []
 
         # Define the pipeline operations
-        match_cond = {"create": {"$gte": _convert_to_datetime(minTime),
-                                 "$lte": _convert_to_datetime(maxTime)}}
+        time_range = {"$gte": _convert_to_datetime(minTime),
+                      "$lte": _convert_to_datetime(maxTime)}
+        if include_logins:
+            match_cond = {"$or": [{"create": time_range},
+                                  {"login": time_range}]}
+        else:
+            match_cond = {"create": time_range}
         if not userIds:
             match_cond["user"] = {"$nin": excluded_users}
         else:
@@ -636,8 +1019,75 @@ class MongoMetricsDBI:
                       [MongoMetricsDBI._MT_USERS])
                      .aggregate(pipeline)))
 
+    def list_user_signups(self, usernames):
+        """
+        list_user_signups--the username, email, signup_at and
+        last_signin_at of the metrics.users records of the given users
+        """
+        mt_users = self.metricsDBs['metrics'][MongoMetricsDBI._MT_USERS]
+        return list(mt_users.find(
+            {'username': {'$in': usernames}},
+            {'_id': 0, 'username': 1, 'email': 1, 'signup_at': 1,
+             'last_signin_at': 1}))
+
+    def aggr_signup_users_monthly(self, minTime, maxTime):
+        """
+        aggr_signup_users_monthly--the users counted by
+        aggr_signup_retn_users (of all users), by the year and month of
+        their signup, each as [username, 1 if returning else 0]
+        [{'_id': {'year': 2018, 'month': 1}, 'users': [['qzhang', 1], ...]}]
+        """
+        rtn_milis = 86400000  # 1 day
+        match_cond = {"signup_at": {"$gte": _convert_to_datetime(minTime),
+                                    "$lte": _convert_to_datetime(maxTime)},
+                      "last_signin_at": {"$ne": None}}
+        pipeline = [
+            {"$match": match_cond},
+            {"$group": {
+                "_id": {"year": {"$year": "$signup_at"},
+                        "month": {"$month": "$signup_at"}},
+                "users": {"$push": [
+                    "$username",
+                    {"$cond": [{"$gte": [
+                        {"$subtract": ["$last_signin_at", "$signup_at"]},
+                        rtn_milis]}, 1, 0]}]}
+            }}
+        ]
+        return list(((self.metricsDBs['metrics']
+                      [MongoMetricsDBI._MT_USERS])
+                     .aggregate(pipeline)))
+
+    @staticmethod
+    def _ujs_results_sorter(sort):
+        """
+        _ujs_results_sorter--the (field, direction) sort key of
+        list_ujs_results: the first of the sort specs
+        """
+        if sort is None or len(sort) == 0:
+            return []
+        first_sort = sort[0]
+        if (first_sort.get('direction', None) and
+                first_sort['direction'].startswith('desc')):
+            sort_direction = DESCENDING
+        else:
+            sort_direction = ASCENDING
+        return [(first_sort['field'], sort_direction)]
+
+    def ujs_results_continuation_token(self, sort, ujs_jobs, limit):
+        """
+        ujs_results_continuation_token--the continuation token of the page
+        after the given page of list_ujs_results, or None; there is none
+        for the sorts it cannot page
+        """
+        sorter = self._ujs_results_sorter(sort)
+        if (not sorter or sorter[0][0] not in
+                MongoMetricsDBI._UJS_RESULTS_TOKEN_FIELDS):
+            return None
+        return next_continuation_token(sorter, ujs_jobs, limit)
+
     def list_ujs_results(self, user_ids=None, start_time=None, end_time=None,
-                         job_ids=None, offset=None, limit=None, sort=None):
+                         job_ids=None, offset=None, limit=None, sort=None,
+                         continuation_token=None):
         filter = {}
 
         if user_ids:
@@ -676,36 +1126,36 @@ class MongoMetricsDBI:
 
         # grab handle(s) to the database collections needed
         jobstate = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
+        total_count = jobstate.count_documents(filter)
+
+        sorter = self._ujs_results_sorter(sort)
+        if continuation_token is not None:
+            if (sorter and sorter[0][0] not in
+                    MongoMetricsDBI._UJS_RESULTS_TOKEN_FIELDS):
+                raise ValueError(
+                    'A continuation_token can only be given for a sort by '
+                    'created, updated or user, not by ' + sorter[0][0] + '.')
+            filter = {'$and': [filter,
+                               keyset_condition(sorter, continuation_token)]}
         cursor = jobstate.find(filter, projection)
         if offset is not None:
             cursor.skip(offset)
         if limit is not None:
             cursor.limit(limit)
 
-        if sort is not None and len(sort) > 0:
-            first_sort = sort[0]
-            if (first_sort.get('direction', None) and
-                    first_sort['direction'].startswith('desc')):
-                sort_direction = DESCENDING
-            else:
-                sort_direction = ASCENDING
-            cursor.sort(first_sort['field'], sort_direction)
-        total_count = cursor.count()
+        if sorter:
+            cursor.sort(keyset_sorter(sorter))
 
         return list(cursor), total_count
 
-    def query_ujs_total(self, users):
-        find_filter = {}
-        if users:
-            find_filter['user'] = {'$in': users}
-
-        ujs_db = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
-        cursor = ujs_db.find(find_filter)
-        return cursor.count()
-
-    def query_ujs(self, restrict_user=None, start_time=None, end_time=None,
-                  filter=None, offset=None, limit=None,
-                  sort=None, search=None):
+    @staticmethod
+    def _ujs_find_filter(restrict_user=None, start_time=None, end_time=None,
+                         filter=None, search=None):
+        """
+        _ujs_find_filter--the list of conditions (to be combined with
+        $and) selecting the jobs of query_ujs; they apply equally to
+        userjobstate.jobstate and to metrics.job_states
+        """
         # Searching and filtering
         find_filter = []
 
@@ -832,28 +1282,15 @@ class MongoMetricsDBI:
                     if len(status_filter):
                         find_filter.append({'$or': status_filter})
 
-        projection = {
-            'user': 1,
-            'created': 1,  # datetime.datetime(2015, 1, 9, 19, 36, 8, 561000)
-            'started': 1,
-            'updated': 1,
-            'status': 1,
-            'authparam': 1,  # "DEFAULT" or workspace_id
-            'authstrat': 1,  # "DEFAULT" or "kbaseworkspace"
-            'complete': 1,
-            'desc': 1,
-            'error': 1
-        }
-
-        ujs_db = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
-        if len(find_filter):
-            cursor = ujs_db.find({'$and': find_filter}, projection)
-        else:
-            cursor = ujs_db.find({}, projection)
+        return find_filter
 
-        # Sorting.
+    @staticmethod
+    def _ujs_sorter(sort):
+        """
+        _ujs_sorter--the (field, direction) sort keys of query_ujs
+        """
+        sorter = []
         if sort is not None and len(sort) > 0:
-            sorter = []
             for sort_spec in sort:
                 if (sort_spec.get('direction', None) and
                         sort_spec['direction'].startswith('desc')):
@@ -873,23 +1310,158 @@ class MongoMetricsDBI:
                     raise ValueError('Unsupported sort field: ' +
                                      sort_spec.get('field', 'n/a'))
                 sorter.append((field, sort_direction))
-            cursor.sort(sorter)
+        return sorter
 
-        found_count = cursor.count()
+    def query_ujs(self, restrict_user=None, start_time=None, end_time=None,
+                  filter=None, offset=None, limit=None,
+                  sort=None, search=None, continuation_token=None,
+                  counts=True, total_count=None, lookup_exec_tasks=False):
+        """
+        query_ujs--a page of the jobs of userjobstate.jobstate; returns
+        the jobs, the found and total counts (None unless counts is set;
+        the total is counted unless given), and the continuation token of
+        the next page (for sorted queries, if there may be one). A
+        continuation token from a previous page of the same query is an
+        alternative to offset which does not walk the skipped jobs. With
+        lookup_exec_tasks, each job has the list of its exec_tasks, joined
+        in the same aggregation (see exec_tasks_lookup_available).
+        """
+        find_filter = self._ujs_find_filter(restrict_user, start_time,
+                                            end_time, filter, search)
+        total_filter = self._ujs_find_filter(restrict_user)
+        sorter = self._ujs_sorter(sort)
 
-        # Offset and limit implemented simply on the cursor.
-        if offset is not None:
-            cursor.skip(offset)
-        if limit is not None:
-            cursor.limit(limit)
+        ujs_db = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
+        ujs_jobs, found_count, total_count = query_page(
+            ujs_db, find_filter, total_filter, sorter,
+            MongoMetricsDBI._UJS_PROJECTION, offset=offset, limit=limit,
+            continuation_token=continuation_token, counts=counts,
+            total_count=total_count,
+            page_stages=(MongoMetricsDBI._EXEC_TASKS_LOOKUP
+                         if lookup_exec_tasks else None))
+        return ujs_jobs, found_count, total_count, \
+            next_continuation_token(sorter, ujs_jobs, limit)
+
+    def exec_tasks_lookup_available(self):
+        """
+        exec_tasks_lookup_available--whether query_ujs can join the exec
+        tasks to the jobs with a $lookup, which mongo only does within a
+        database: true if the userjobstate database also has an
+        exec_tasks collection (or view); checked once per process
+        """
+        ujs_database = self.metricsDBs['userjobstate']
+        lookup_key = self._exec_tasks_lookup_key()
+        available = MongoMetricsDBI._exec_tasks_lookup.get(lookup_key)
+        if available is None:
+            available = bool(ujs_database.list_collection_names(
+                filter={'name': MongoMetricsDBI._EXEC_TASKS}))
+            MongoMetricsDBI._exec_tasks_lookup[lookup_key] = available
+        return available
+
+    def _exec_tasks_lookup_key(self):
+        # from the configuration, not the client: the address of a client
+        # is only known once it has selected a server
+        return (self.mongo_hosts, self.metricsDBs['userjobstate'].name)
+
+    def disable_exec_tasks_lookup(self):
+        """
+        disable_exec_tasks_lookup--stop joining the exec tasks with a
+        $lookup in this process, e.g. after the server rejected it
+        """
+        MongoMetricsDBI._exec_tasks_lookup[
+            self._exec_tasks_lookup_key()] = False
 
-        # Total count.
-        if restrict_user:
-            total_count = self.query_ujs_total([restrict_user])
+    def aggr_ujs_user_counts(self, after_id=None):
+        """
+        aggr_ujs_user_counts--the number of jobs of each user in
+        userjobstate.jobstate ({user: count}) and the largest job _id
+        counted; after_id counts only the jobs created after that job
+        """
+        match_cond = {'_id': {'$gt': after_id}} if after_id else {}
+        pipeline = [{'$match': match_cond},
+                    {'$group': {'_id': '$user', 'count': {'$sum': 1},
+                                'last_id': {'$max': '$_id'}}}]
+        ujs_db = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
+        user_counts = dict()
+        last_id = None
+        for user_count in ujs_db.aggregate(pipeline, allowDiskUse=True):
+            user_counts[user_count['_id']] = user_count['count']
+            if last_id is None or user_count['last_id'] > last_id:
+                last_id = user_count['last_id']
+        return user_counts, last_id
+
+    def list_ujs_updated(self, from_time, after=None, limit=None):
+        """
+        list_ujs_updated--the jobstate documents (with the fields of
+        query_ujs) updated at or after from_time (in milliseconds), in
+        order of (updated, _id); after, the (updated, _id) of the last job
+        of the previous page, continues from that job
+        """
+        if after is None:
+            match_cond = {'updated': {'$gte': _convert_to_datetime(from_time)}}
         else:
-            total_count = self.query_ujs_total(None)
+            last_updated, last_id = after
+            match_cond = {'$or': [{'updated': {'$gt': last_updated}},
+                                  {'updated': last_updated,
+                                   '_id': {'$gt': last_id}}]}
+        ujs_db = self.metricsDBs['userjobstate'][MongoMetricsDBI._JOBSTATE]
+        cursor = ujs_db.find(match_cond, MongoMetricsDBI._UJS_PROJECTION)
+        cursor.sort([('updated', ASCENDING), ('_id', ASCENDING)])
+        if limit is not None:
+            cursor.limit(limit)
+        return list(cursor)
 
-        return list(cursor), found_count, total_count
+    def bulk_update_job_states(self, job_state_records,
+                               chunk_size=UPDATE_CHUNK_SIZE):
+        """
+        bulk_update_job_states--upsert the iterable of (ujs_fields, job)
+        records into metrics.job_states, chunk_size records per round trip.
+        ujs_fields are the jobstate fields (including _id) that query_ujs
+        filters and sorts on, and job is the assembled job of query_jobs.
+        """
+        mt_jobs = self.metricsDBs['metrics'][MongoMetricsDBI._MT_JOB_STATES]
+        upd_ops = (UpdateOne({'_id': ujs_fields['_id']},
+                             {'$currentDate': {'recordLastUpdated': True},
+                              '$set': dict(ujs_fields, job=job)},
+                             upsert=True)
+                   for ujs_fields, job in job_state_records)
+        return bulk_upsert(mt_jobs, upd_ops, chunk_size)
+
+    def create_job_states_indexes(self):
+        """
+        create_job_states_indexes--the indexes of metrics.job_states used
+        by query_job_states (a no-op when they exist)
+        """
+        mt_jobs = self.metricsDBs['metrics'][MongoMetricsDBI._MT_JOB_STATES]
+        mt_jobs.create_index([('created', DESCENDING)])
+        mt_jobs.create_index([('updated', DESCENDING)])
+        mt_jobs.create_index([('user', ASCENDING), ('created', DESCENDING)])
+
+    def query_job_states(self, restrict_user=None, start_time=None,
+                         end_time=None, filter=None, offset=None, limit=None,
+                         sort=None, search=None, continuation_token=None,
+                         counts=True, total_count=None):
+        """
+        query_job_states--query_ujs over metrics.job_states; returns the
+        already assembled jobs, the found and total counts and the
+        continuation token of the next page
+        """
+        find_filter = self._ujs_find_filter(restrict_user, start_time,
+                                            end_time, filter, search)
+        total_filter = self._ujs_find_filter(restrict_user)
+        sorter = self._ujs_sorter(sort)
+
+        # the sort fields make the continuation token
+        projection = {'job': 1}
+        projection.update({field: 1 for field, _ in sorter})
+        mt_jobs = self.metricsDBs['metrics'][MongoMetricsDBI._MT_JOB_STATES]
+        job_states, found_count, total_count = query_page(
+            mt_jobs, find_filter, total_filter, sorter, projection,
+            offset=offset, limit=limit,
+            continuation_token=continuation_token, counts=counts,
+            total_count=total_count)
+        return [job_state['job'] for job_state in job_states], found_count, \
+            total_count, next_continuation_token(sorter, job_states, limit)
 
     def get_ujs_result(self, job_id, user_id=None):
         qry_filter = {}
@@ -929,34 +1501,12 @@ class MongoMetricsDBI:
             return results[0]
 
     # BEGIN putting the deleted functions back for reporting
-    def aggr_user_logins_from_ws(self, userIds, minTime, maxTime):
-
-        match_filter = {"moddate": {"$gte": minTime, "$lte": maxTime}}
-        match_filter["cloning"] = {"$exists": False}
-
-        if userIds:
-            match_filter["owner"] = {"$in": userIds}
-
-        # Define the pipeline operations
-        pipeline = [
-            {"$match": match_filter},
-            {"$project": {"year": {"$year": "$moddate"},
-                          "month": {"$month": "$moddate"},
-                          "date": {"$dayOfMonth": "$moddate"},
-                          "owner": 1, "ws_id": "$ws", "_id": 0}},
-            {"$group": {"_id": {"username": "$owner",
-                                "year": "$year",
-                                "month": "$month"},
-                        "year_mon_user_logins": {"$sum": 1}}}
-        ]
-
-        # grab handle(s) to the database collection
-        kbworkspaces = (self.metricsDBs['workspace']
-                                       [MongoMetricsDBI._WS_WORKSPACES])
-        return list(kbworkspaces.aggregate(pipeline))
-
-    def aggr_total_logins(self, userIds, minTime, maxTime,
-                          excluded_users=None):
+    def aggr_user_ws_monthly(self, userIds, minTime, maxTime,
+                             excluded_users=None):
+        """
+        aggr_user_ws_monthly--count the workspaces, and sum their objects,
+        of each owner by the year and month of their last modification
+        """
         # excluded_users has to be an array for '$nin'
         if excluded_users is None:
             excluded_users = []
@@ -972,75 +1522,183 @@ class MongoMetricsDBI:
         # Define the pipeline operations
         pipeline = [
             {"$match": match_cond},
-            {"$project": {"year": {"$year": "$moddate"},
-                          "month": {"$month": "$moddate"},
-                          "date": {"$dayOfMonth": "$moddate"},
-                          "owner": 1, "ws_id": "$ws", "_id": 0}},
             {"$group": {"_id": {"username": "$owner",
-                                "year": "$year",
-                                "month": "$month"},
-                        "count_user_ws_logins": {"$sum": 1}}},
-            {"$group": {"_id": {"year": "$_id.year",
-                                "month": "$_id.month"},
-                        "year_mon_total_logins": {
-                            "$sum": "$count_user_ws_logins"}}}
+                                "year": {"$year": "$moddate"},
+                                "month": {"$month": "$moddate"}},
+                        "ws_count": {"$sum": 1},
+                        "numObj": {"$sum": "$numObj"}}}
         ]
+
         # grab handle(s) to the database collection
         kbworkspaces = (self.metricsDBs['workspace']
                                        [MongoMetricsDBI._WS_WORKSPACES])
         return list(kbworkspaces.aggregate(pipeline))
 
-    def aggr_user_numObjs(self, userIds, minTime, maxTime):
+    def update_workspace_rollups(self, since=None,
+                                 chunk_size=UPDATE_CHUNK_SIZE):
+        """
+        update_workspace_rollups--bring the counts of the workspaces, and
+        the sums of their objects, of each owner by the day of their last
+        modification in metrics.workspace_daily_rollups up to date with
+        the workspaces modified since the given datetime: each is moved
+        from the rollup it was counted in, as recorded in
+        metrics.workspace_rollup_members, to that of its owner and
+        moddate. With no since, the rollups are rebuilt from all the
+        workspaces. Returns the number of workspaces moved.
+        """
+        metrics_db = self.metricsDBs['metrics']
+        mt_rollups = metrics_db[MongoMetricsDBI._MT_WS_ROLLUPS]
+        mt_members = metrics_db[MongoMetricsDBI._MT_WS_ROLLUP_MEMBERS]
+        match_cond = {"cloning": {"$exists": False},
+                      "moddate": {"$type": "date"}}
+        if since is None:
+            mt_rollups.drop()
+            mt_members.drop()
+            mt_rollups.create_index([('date', ASCENDING),
+                                     ('username', ASCENDING)], unique=True)
+        else:
+            match_cond["moddate"] = {"$gte": since}
 
-        match_filter = {"moddate": {"$gte": minTime, "$lte": maxTime}}
-        match_filter["cloning"] = {"$exists": False}
+        kbworkspaces = (self.metricsDBs['workspace']
+                                       [MongoMetricsDBI._WS_WORKSPACES])
+        workspaces = kbworkspaces.find(
+            match_cond, {'_id': 0, 'ws': 1, 'owner': 1, 'moddate': 1,
+                         'numObj': 1}, batch_size=chunk_size)
+
+        moved = 0
+        chunk = []
+        for ws in workspaces:
+            chunk.append(ws)
+            if len(chunk) >= chunk_size:
+                moved += self._move_workspace_rollups(chunk)
+                chunk = []
+        if chunk:
+            moved += self._move_workspace_rollups(chunk)
+        return moved
+
+    def _move_workspace_rollups(self, workspaces):
+        """
+        _move_workspace_rollups--move each of the workspaces to the rollup
+        of its owner and moddate, with one bulk_write of the changed
+        rollups and one of the changed members; returns the number of
+        workspaces moved
+        """
+        metrics_db = self.metricsDBs['metrics']
+        mt_rollups = metrics_db[MongoMetricsDBI._MT_WS_ROLLUPS]
+        mt_members = metrics_db[MongoMetricsDBI._MT_WS_ROLLUP_MEMBERS]
+        members = {m['_id']: m for m in mt_members.find(
+            {'_id': {'$in': [ws['ws'] for ws in workspaces]}})}
+
+        # {(username, date): [ws_count, numObj]} of the changes
+        deltas = dict()
+        member_ops = []
+        for ws in workspaces:
+            moddate = ws['moddate']
+            member = {'username': ws.get('owner'),
+                      'date': datetime.datetime(moddate.year, moddate.month,
+                                                moddate.day),
+                      'numObj': ws.get('numObj') or 0}
+            old = members.get(ws['ws'])
+            if old is not None:
+                if all(old.get(x) == member[x] for x in member):
+                    continue
+                delta = deltas.setdefault((old['username'], old['date']),
+                                          [0, 0])
+                delta[0] -= 1
+                delta[1] -= old['numObj']
+            delta = deltas.setdefault((member['username'], member['date']),
+                                      [0, 0])
+            delta[0] += 1
+            delta[1] += member['numObj']
+            member['year'] = moddate.year
+            member['month'] = moddate.month
+            member_ops.append(ReplaceOne({'_id': ws['ws']}, member,
+                                         upsert=True))
+
+        rollup_ops = [
+            UpdateOne({'username': username, 'date': date},
+                      {'$inc': {'ws_count': ws_count, 'numObj': num_obj},
+                       '$setOnInsert': {'year': date.year,
+                                        'month': date.month,
+                                        'day': date.day}},
+                      upsert=True)
+            for (username, date), (ws_count, num_obj) in deltas.items()
+            if ws_count or num_obj]
+        if rollup_ops:
+            mt_rollups.bulk_write(rollup_ops, ordered=False)
+            mt_rollups.delete_many({'ws_count': {'$lte': 0}})
+        if member_ops:
+            mt_members.bulk_write(member_ops, ordered=False)
+        return len(member_ops)
+
+    def aggr_workspace_rollups(self, userIds, minDate, maxDate,
+                               excluded_users=None):
+        """
+        aggr_workspace_rollups--the same counts as aggr_user_ws_monthly,
+        read from the daily rollups of the days from minDate up to (but
+        not including) maxDate
+        """
+        # excluded_users has to be an array for '$nin'
+        if excluded_users is None:
+            excluded_users = []
 
-        if userIds:
-            match_filter["owner"] = {"$in": userIds}
+        match_cond = {"date": {"$gte": minDate, "$lt": maxDate}}
+        if not userIds:
+            match_cond["username"] = {"$nin": excluded_users}
+        else:
+            match_cond["username"] = {"$in": userIds,
+                                      "$nin": excluded_users}
 
-        # Define the pipeline operations
         pipeline = [
-            {"$match": match_filter},
-            {"$project": {"year": {"$year": "$moddate"},
-                          "month": {"$month": "$moddate"},
-                          "date": {"$dayOfMonth": "$moddate"},
-                          "owner": 1, "ws_id": "$ws",
-                          "numObj": 1, "_id": 0}},
-            {"$group": {"_id": {"username": "$owner",
+            {"$match": match_cond},
+            {"$group": {"_id": {"username": "$username",
                                 "year": "$year",
                                 "month": "$month"},
-                        "count_user_numObjs": {"$sum": "$numObj"}}}
+                        "ws_count": {"$sum": "$ws_count"},
+                        "numObj": {"$sum": "$numObj"}}}
         ]
+        mt_rollups = self.metricsDBs['metrics'][
+            MongoMetricsDBI._MT_WS_ROLLUPS]
+        return list(mt_rollups.aggregate(pipeline))
+
+    def aggr_workspace_rollups_moved(self, userIds, minDate, maxDate, since,
+                                     excluded_users=None):
+        """
+        aggr_workspace_rollups_moved--the part of the counts of
+        aggr_workspace_rollups of the workspaces modified since the given
+        datetime, which are counted in the rollups of the day they were
+        modified on before that
+        """
+        # excluded_users has to be an array for '$nin'
+        if excluded_users is None:
+            excluded_users = []
 
-        # grab handle(s) to the database collection
         kbworkspaces = (self.metricsDBs['workspace']
                                        [MongoMetricsDBI._WS_WORKSPACES])
-        return list(kbworkspaces.aggregate(pipeline))
-
-    def aggr_user_ws(self, userIds, minTime, maxTime):
-        match_filter = {"moddate": {"$gte": minTime, "$lte": maxTime}}
-        match_filter["cloning"] = {"$exists": False}
+        ws_ids = [ws['ws'] for ws in kbworkspaces.find(
+            {"moddate": {"$gte": since}}, {'_id': 0, 'ws': 1})]
+        if not ws_ids:
+            return []
 
-        if userIds:
-            match_filter["owner"] = {"$in": userIds}
+        match_cond = {"_id": {"$in": ws_ids},
+                      "date": {"$gte": minDate, "$lt": maxDate}}
+        if not userIds:
+            match_cond["username"] = {"$nin": excluded_users}
+        else:
+            match_cond["username"] = {"$in": userIds,
+                                      "$nin": excluded_users}
 
-        # Define the pipeline operations
         pipeline = [
-            {"$match": match_filter},
-            {"$project": {"year": {"$year": "$moddate"},
-                          "month": {"$month": "$moddate"},
-                          "date": {"$dayOfMonth": "$moddate"},
-                          "owner": 1, "ws_id": "$ws", "_id": 0}},
-            {"$group": {"_id": {"username": "$owner",
+            {"$match": match_cond},
+            {"$group": {"_id": {"username": "$username",
                                 "year": "$year",
                                 "month": "$month"},
-                        "count_user_ws": {"$sum": 1}}}
+                        "ws_count": {"$sum": 1},
+                        "numObj": {"$sum": "$numObj"}}}
         ]
-
-        # grab handle(s) to the database collection
-        kbworkspaces = (self.metricsDBs['workspace']
-                                       [MongoMetricsDBI._WS_WORKSPACES])
-        return list(kbworkspaces.aggregate(pipeline))
+        mt_members = self.metricsDBs['metrics'][
+            MongoMetricsDBI._MT_WS_ROLLUP_MEMBERS]
+        return list(mt_members.aggregate(pipeline))
 
     # END putting the deleted functions back for reporting
 
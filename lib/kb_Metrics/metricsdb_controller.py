@@ -1,17 +1,52 @@
-import copy
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 import re
+import threading
 import time
 
+from pymongo.errors import OperationFailure
+
 from installed_clients.CatalogClient import Catalog
 from kb_Metrics.Util import (_unix_time_millis_from_datetime,
                              _unix_time_millis_from_datetime_trusted,
-                             _convert_to_datetime)
-from kb_Metrics.metrics_dbi import MongoMetricsDBI
-from kb_Metrics.NarrativeCache import NarrativeCache
+                             _convert_to_datetime, get_config_number)
+from kb_Metrics.metrics_dbi import (MongoMetricsDBI, get_pool_config,
+                                   UPDATE_CHUNK_SIZE)
+from kb_Metrics.NarrativeCache import NarrativeCache, get_config_bool
+from kb_Metrics.ClientGroupCache import ClientGroupCache
+from kb_Metrics.ResultCache import (ResultCache, ClosedBucketCache,
+                                    JobCountCache, CACHE_TTL,
+                                    CACHE_MAX_ENTRIES, JOB_COUNT_TTL,
+                                    JOB_COUNT_RECOUNT_INTERVAL)
 
 debug = False
 
+DAY_MILLIS = 86400000
+# Default days of changes between the checkpoints of incremental updates
+CHECKPOINT_DAYS = 1
+# Default threads for running the update_metrics stages in parallel
+UPDATE_MAX_WORKERS = 3
+# Watermark name of the last update of the workspace rollups
+WS_ROLLUPS = 'workspace_rollups'
+# Reports with closed month buckets
+SIGNUPS_REPORT = 'signups'
+FIRST_ACCESS_REPORT = 'ws_first_access'
+# Watermark name of metrics.job_states
+JOB_STATES = 'job_states'
+# Watermark name of the first complete sync of metrics.job_states, made by
+# update_metrics; until then query_jobs reads the live jobs
+JOB_STATES_BUILT = 'job_states_built'
+# Default seconds between the syncs of metrics.job_states made by query_jobs
+JOB_STATES_SYNC_INTERVAL = 10
+# The jobstate fields kept in metrics.job_states for query_ujs to filter
+# and sort on
+JOB_STATE_FIELDS = ('_id', 'user', 'created', 'started', 'updated',
+                    'status', 'complete', 'error')
+# The jobstate fields the job assembly renames or drops; the others are
+# passed through to the job
+UJS_ASSEMBLED_FIELDS = frozenset(('_id', 'started', 'created', 'updated',
+                                  'authparam', 'authstrat', 'desc'))
+
 
 def print_debug(msg):
     if not debug:
@@ -21,6 +56,15 @@ def print_debug(msg):
 
 
 class MetricsMongoDBController:
+    # Process state: when this process last synced metrics.job_states (and
+    # last tried to), the background thread syncing it, and whether
+    # update_metrics has completed a first sync of it
+    job_states_synced_at = None
+    job_states_attempted_at = 0
+    job_states_sync_error = None
+    job_states_syncer = None
+    job_states_syncer_lock = threading.Lock()
+    job_states_built = False
 
     def __init__(self, config):
         # grab config lists
@@ -36,22 +80,63 @@ class MetricsMongoDBController:
                 error_msg += ' of MetricsMongoDBController'
                 raise ValueError(error_msg)
 
-        # instantiate the mongo client
+        # Process state: the mongo clients (and their connection pools) are
+        # shared by all controllers in this process, so constructing a
+        # controller per request does not open new connections.
         self.metrics_dbi = MongoMetricsDBI(config.get('mongodb-host'),
                                            self.mongodb_dbList,
                                            config.get('mongodb-user', ''),
-                                           config.get('mongodb-pwd', ''))
+                                           config.get('mongodb-pwd', ''),
+                                           **get_pool_config(config))
 
         # for access to the Catalog API
         self.auth_service_url = config['auth-service-url']
         self.catalog_url = config['kbase-endpoint'] + '/catalog'
 
-        # commonly used data
-        self.kbstaff_list = None
-        self.ws_narratives = None
-        self.client_groups = None
-        self.cat_client = None
-        self.narrative_cache = NarrativeCache(config)
+        # A controller holds no per-request state: it is shared by the
+        # requests of the process, so whatever a request fetches is kept in
+        # the locals of its method, or in the process level caches below.
+        self.narrative_cache = NarrativeCache(config,
+                                              metrics_dbi=self.metrics_dbi)
+
+        # number of records written to the metrics db per round trip
+        self.update_chunk_size = get_config_number(
+            config, 'update-metrics-chunk-size', UPDATE_CHUNK_SIZE, int)
+        # days of changes processed between the checkpoints of an
+        # incremental update_metrics
+        self.checkpoint_days = get_config_number(
+            config, 'update-metrics-checkpoint-days', CHECKPOINT_DAYS, int)
+        # threads running the update_metrics stages in parallel
+        self.update_max_workers = get_config_number(
+            config, 'update-metrics-max-workers', UPDATE_MAX_WORKERS, int)
+        # results of the reporting methods, shared by all controllers
+        self.report_cache = ResultCache(
+            ttl=get_config_number(config, 'report-cache-ttl', CACHE_TTL,
+                                  int),
+            max_entries=get_config_number(
+                config, 'report-cache-max-entries', CACHE_MAX_ENTRIES, int))
+        # the members of past months of the reports, which do not change
+        self.closed_buckets = ClosedBucketCache(self.metrics_dbi)
+        # query_jobs reads the assembled jobs from metrics.job_states,
+        # synced in the background at most every job_states_sync_interval
+        # seconds
+        self.job_states_materialized = get_config_bool(
+            config, 'query-jobs-materialized')
+        self.job_states_sync_interval = get_config_number(
+            config, 'job-states-sync-interval', JOB_STATES_SYNC_INTERVAL)
+        # query_jobs joins the exec tasks to the jobs with a $lookup, when
+        # they are in the same database
+        self.query_jobs_lookup = get_config_bool(config, 'query-jobs-lookup')
+        # the Catalog client groups, shared by all requests
+        self.client_group_cache = ClientGroupCache(
+            config, self._fetch_client_groups)
+        # the total job counts of query_jobs and get_job_counts
+        self.job_counts = JobCountCache(
+            self.metrics_dbi,
+            ttl=get_config_number(config, 'job-count-ttl', JOB_COUNT_TTL),
+            recount_interval=get_config_number(
+                config, 'job-count-recount-interval',
+                JOB_COUNT_RECOUNT_INTERVAL))
 
     def get_config_list(self, config, config_key):
         list_str = config.get(config_key)
@@ -73,10 +158,8 @@ class MetricsMongoDBController:
         return username in kb_list
 
     def _get_kbstaff_list(self):
-        if self.kbstaff_list is None:
-            kbstaff = self.metrics_dbi.list_kbstaff_usernames()
-            self.kbstaff_list = [kbs['username'] for kbs in kbstaff]
-        return self.kbstaff_list
+        kbstaff = self.metrics_dbi.list_kbstaff_usernames()
+        return [kbs['username'] for kbs in kbstaff]
 
     def _convert_isodate_to_millis(self, src_list, dt_list):
         for src in src_list:
@@ -96,41 +179,77 @@ class MetricsMongoDBController:
             return job_input['method'].replace('/', '.')
         return ''
 
-    def _update_user_info(self, params, token):
+    def _update_user_info(self, params, token, counts=None,
+                          include_logins=False):
         """
         update user info
         If match not found, insert that record as new.
+        The upserted/modified counts are added to counts, if given.
+        With include_logins, the users who logged in during the time
+        period are updated along with those who signed up.
         """
         params = self._process_parameters(params)
         auth2_ret = self.metrics_dbi.aggr_user_details(
-            params['user_ids'], params['minTime'], params['maxTime'])
+            params['user_ids'], params['minTime'], params['maxTime'],
+            include_logins=include_logins)
         if not auth2_ret:
             print_debug("No user records returned for update!")
             return 0
 
-        up_dated = 0
-        up_serted = 0
         print_debug(f'Retrieved {len(auth2_ret)} user record(s) for update!')
         id_keys = ['username', 'email']
         data_keys = ['full_name', 'signup_at', 'last_signin_at', 'roles']
+        kb_list = set(self._get_kbstaff_list())
+        # how the signups report counts these users before the update
+        old_signups = {
+            (u_data.get('username'), u_data.get('email')):
+            self._signup_bucket(u_data)
+            for u_data in self.metrics_dbi.list_user_signups(
+                list({u_data['username'] for u_data in auth2_ret}))}
+        user_records = (({x: u_data[x] for x in id_keys},
+                         {x: u_data[x] for x in data_keys},
+                         u_data['username'] in kb_list)
+                        for u_data in auth2_ret)
+        upd_counts = self.metrics_dbi.bulk_update_user_records(
+            user_records, self.update_chunk_size)
+
+        # the closed months of the signups report that count a user
+        # differently now
+        now = datetime.datetime.utcnow()
+        current_month = (now.year, now.month)
+        changed_months = set()
         for u_data in auth2_ret:
-            id_data = {x: u_data[x] for x in id_keys}
-            user_data = {x: u_data[x] for x in data_keys}
-            is_kbstaff = True if self._is_kbstaff(
-                id_data['username']) else False
-            update_ret = self.metrics_dbi.update_user_records(
-                id_data, user_data, is_kbstaff)
-            if update_ret.raw_result['updatedExisting']:
-                up_dated += update_ret.raw_result['nModified']
-            elif update_ret.raw_result.get('upserted'):
-                up_serted += 1
-        print_debug(f'updated {up_dated} and upserted {up_serted} users.')
-        return up_dated + up_serted
-
-    def _update_daily_activities(self, params, token):
+            old = old_signups.get((u_data['username'], u_data['email']))
+            new = self._signup_bucket(u_data)
+            if old != new:
+                changed_months.update(
+                    bucket[0] for bucket in (old, new)
+                    if bucket is not None and bucket[0] < current_month)
+        if changed_months:
+            self.closed_buckets.drop(SIGNUPS_REPORT, sorted(changed_months))
+        return self._tally_updates('users', upd_counts, counts)
+
+    @staticmethod
+    def _signup_bucket(u_data):
+        """
+        _signup_bucket--((year, month), returning) of the user record as
+        aggr_signup_users_monthly counts it: by the month of its signup,
+        returning if it last signed in a day or more after that; None if
+        it is not counted
+        """
+        signup_at = u_data.get('signup_at')
+        last_signin_at = u_data.get('last_signin_at')
+        if not (isinstance(signup_at, datetime.datetime) and
+                isinstance(last_signin_at, datetime.datetime)):
+            return None
+        returning = last_signin_at - signup_at >= datetime.timedelta(days=1)
+        return (signup_at.year, signup_at.month), int(returning)
+
+    def _update_daily_activities(self, params, token, counts=None):
         """
         update user activities reported from Workspace.workspaceObjects.
         If match not found, insert that record as new.
+        The upserted/modified counts are added to counts, if given.
         """
         ws_ret = self._get_activities_from_wsobjs(params, token)
         act_list = ws_ret['metrics_result']
@@ -138,34 +257,25 @@ class MetricsMongoDBController:
             print_debug("No daily activity records returned for update!")
             return 0
 
-        up_dated = 0
-        up_serted = 0
         print_debug(
             f'Retrieved {len(act_list)} activity record(s) for update!')
         id_keys = ['_id']
         count_keys = ['obj_numModified']
-        for a_data in act_list:
-            id_data = {x: a_data[x] for x in id_keys}
-            count_data = {x: a_data[x] for x in count_keys}
-            update_ret = self.metrics_dbi.update_activity_records(
-                id_data, count_data)
-            if update_ret.raw_result['updatedExisting']:
-                up_dated += update_ret.raw_result['nModified']
-            elif update_ret.raw_result.get('upserted'):
-                up_serted += 1
-
-        print_debug(f'updated {up_dated} and upserted {up_serted} activities.')
-        return up_dated + up_serted
-
-    def _update_narratives(self, params, token):
+        activity_records = (({x: a_data[x] for x in id_keys},
+                             {x: a_data[x] for x in count_keys})
+                            for a_data in act_list)
+        upd_counts = self.metrics_dbi.bulk_update_activity_records(
+            activity_records, self.update_chunk_size)
+        return self._tally_updates('activities', upd_counts, counts)
+
+    def _update_narratives(self, params, token, counts=None):
         """
         update user narratives reported from Workspace.
         If match not found, insert that record as new.
+        The upserted/modified counts are added to counts, if given.
         """
         ws_ret = self._get_narratives_from_wsobjs(params, token)
         narr_list = ws_ret['metrics_result']
-        up_dated = 0
-        up_serted = 0
         if not narr_list:
             print_debug("No narrative records returned for update!")
             return 0
@@ -175,20 +285,135 @@ class MetricsMongoDBController:
         id_keys = ['object_id', 'object_version', 'workspace_id']
         other_keys = ['name', 'last_saved_at', 'last_saved_by', 'numObj',
                       'deleted', 'nice_name', 'desc']
-
-        for n_data in narr_list:
-            id_data = {x: n_data[x] for x in id_keys}
-            other_data = {x: n_data[x] for x in other_keys}
-            update_ret = self.metrics_dbi.update_narrative_records(
-                id_data, other_data)
-            if update_ret.raw_result['updatedExisting']:
-                up_dated += update_ret.raw_result['nModified']
-            elif update_ret.raw_result['upserted']:
-                up_serted += 1
-
-        print_debug(f'updated {up_dated} and upserted {up_serted} narratives.')
+        narrative_records = (({x: n_data[x] for x in id_keys},
+                              {x: n_data[x] for x in other_keys})
+                             for n_data in narr_list)
+        upd_counts = self.metrics_dbi.bulk_update_narrative_records(
+            narrative_records, self.update_chunk_size)
+        return self._tally_updates('narratives', upd_counts, counts)
+
+    def _tally_updates(self, stage, upd_counts, counts):
+        """
+        _tally_updates--report the counts of one update stage; returns the
+        number of documents upserted or modified, as the stages always have
+        """
+        up_dated = upd_counts['modified']
+        up_serted = upd_counts['upserted']
+        print_debug(f'updated {up_dated} and upserted {up_serted} {stage}.')
+        if counts is not None:
+            counts['upserted'] = counts.get('upserted', 0) + up_serted
+            counts['modified'] = counts.get('modified', 0) + up_dated
         return up_dated + up_serted
 
+    def sync_job_states(self, token, counts=None):
+        """
+        sync_job_states--bring metrics.job_states up to date: the jobs
+        updated since its watermark are assembled as query_jobs assembles
+        them and upserted along with the jobstate fields query_ujs filters
+        on, a page at a time, saving the watermark after each page.
+        Returns the number of jobs upserted or modified.
+        """
+        # through the cache, which refreshes them every ttl seconds
+        client_groups = self._get_client_groups(token)
+        self.metrics_dbi.create_job_states_indexes()
+
+        # the jobs updated at the watermark are synced again, in case
+        # others were updated at the same time after the last sync
+        from_time = self.metrics_dbi.get_watermark(JOB_STATES) or 0
+        after = None
+        upd_count = 0
+        while True:
+            ujs_jobs = self.metrics_dbi.list_ujs_updated(
+                from_time, after, self.update_chunk_size)
+            if not ujs_jobs:
+                break
+            after = (ujs_jobs[-1]['updated'], ujs_jobs[-1]['_id'])
+
+            ujs_fields = [{x: ujs_job[x] for x in JOB_STATE_FIELDS
+                           if x in ujs_job} for ujs_job in ujs_jobs]
+            exec_tasks = self.metrics_dbi.list_exec_tasks(
+                jobIDs=[str(ujs_job['_id']) for ujs_job in ujs_jobs])
+            ujs_jobs = self._convert_isodate_to_millis(
+                ujs_jobs, ['created', 'started', 'updated'])
+            jobs = self.join_jobs(exec_tasks, ujs_jobs, client_groups)
+
+            upd_counts = self.metrics_dbi.bulk_update_job_states(
+                zip(ujs_fields, jobs), self.update_chunk_size)
+            upd_count += self._tally_updates('job_states', upd_counts,
+                                             counts)
+            self.metrics_dbi.set_watermark(
+                JOB_STATES, _unix_time_millis_from_datetime(after[0]))
+            if len(ujs_jobs) < self.update_chunk_size:
+                break
+        return upd_count
+
+    def _build_job_states(self, token, counts=None):
+        """
+        _build_job_states--the update_metrics stage of metrics.job_states:
+        sync_job_states, after which the collection is marked as complete,
+        for query_jobs to read from it
+        """
+        upd_count = self.sync_job_states(token, counts)
+        self.metrics_dbi.set_watermark(JOB_STATES_BUILT,
+                                       round(time.time() * 1000))
+        MetricsMongoDBController.job_states_synced_at = time.time()
+        MetricsMongoDBController.job_states_built = True
+        return upd_count
+
+    def _sync_job_states_in_background(self, token):
+        cls = MetricsMongoDBController
+        try:
+            self.sync_job_states(token)
+            cls.job_states_synced_at = time.time()
+            cls.job_states_sync_error = None
+        except Exception as ex:
+            # query_jobs keeps serving the jobs as of the last sync
+            cls.job_states_sync_error = ex
+            print('Error syncing metrics.job_states: ' + str(ex))
+
+    def _start_job_states_sync(self, token):
+        """
+        _start_job_states_sync--sync metrics.job_states in a background
+        thread, unless this process tried less than job_states_sync_interval
+        seconds ago or is syncing it already; the token only reaches the
+        Catalog when the client group cache has none
+        """
+        cls = MetricsMongoDBController
+        with cls.job_states_syncer_lock:
+            if (cls.job_states_syncer is not None and
+                    cls.job_states_syncer.is_alive()):
+                return
+            if (time.time() - cls.job_states_attempted_at <
+                    self.job_states_sync_interval):
+                return
+            cls.job_states_attempted_at = time.time()
+            cls.job_states_syncer = threading.Thread(
+                target=self._sync_job_states_in_background, args=(token,),
+                name='JobStatesSyncer', daemon=True)
+            cls.job_states_syncer.start()
+
+    def _job_states_age(self):
+        """
+        _job_states_age--milliseconds since this process last synced
+        metrics.job_states, or None if it has not yet
+        """
+        synced_at = MetricsMongoDBController.job_states_synced_at
+        if synced_at is None:
+            return None
+        return round((time.time() - synced_at) * 1000)
+
+    def _job_states_ready(self):
+        """
+        _job_states_ready--whether update_metrics has completed a first
+        sync of metrics.job_states; a collection still being built holds
+        only part of the jobs
+        """
+        cls = MetricsMongoDBController
+        if not cls.job_states_built:
+            cls.job_states_built = (
+                self.metrics_dbi.get_watermark(JOB_STATES_BUILT) is not None)
+        return cls.job_states_built
+
     # End functions to write to the metrics database
 
     # functions to get the requested records from other dbs...
@@ -213,33 +438,54 @@ class MetricsMongoDBController:
         wsobjs = self.metrics_dbi.list_user_objects_from_wsobjs(
             params['minTime'], params['maxTime'], ws_ids)
 
+        ws_narrs1 = self._join_narrative_objects(ws_narrs, wsobjs)
+        narr_info_map = self.get_narrative_infos(
+            [wsn['workspace_id'] for wsn in ws_narrs1])
+        for wsn in ws_narrs1:
+            wsn['last_saved_by'] = wsn.pop('username')
+            ws_nm, wsn['nice_name'], wsn['n_ver'], is_deleted = \
+                narr_info_map[wsn['workspace_id']]
+            wsn.pop('narr_keys')
+            wsn.pop('narr_values')
+
+        return {'metrics_result': ws_narrs1}
+
+    @staticmethod
+    def _join_narrative_objects(ws_narrs, wsobjs):
+        """
+        _join_narrative_objects--set the object_id and object_version of
+        each narrative workspace from the first of its workspace objects
+        whose name is the workspace name or matches its timestamp part;
+        returns the narrative workspaces that have a narrative object.
+        The objects are indexed by workspace, so the cost is linear in the
+        number of workspaces and objects, not their product.
+        """
+        ws_objs = dict()
+        for obj in wsobjs:
+            ws_objs.setdefault(obj['workspace_id'], []).append(obj)
+
         ws_narrs1 = []
         for wsn in ws_narrs:
-            for obj in wsobjs:
-                if wsn['workspace_id'] == obj['workspace_id']:
-                    if wsn['name'] == obj['object_name']:
-                        wsn['object_id'] = obj['object_id']
-                        wsn['object_version'] = obj['object_version']
-                        break
-                    elif ':' in wsn['name']:
+            name_pattern = None
+            for obj in ws_objs.get(wsn['workspace_id'], []):
+                if wsn['name'] == obj['object_name']:
+                    wsn['object_id'] = obj['object_id']
+                    wsn['object_version'] = obj['object_version']
+                    break
+                elif ':' in wsn['name']:
+                    if name_pattern is None:
                         wts = wsn['name'].split(':')[1]
                         if '_' in wts:
                             wts = wts.split('_')[1]
-                        p = re.compile(wts, re.IGNORECASE)
-                        if p.search(obj['object_name']):
-                            wsn['object_id'] = obj['object_id']
-                            wsn['object_version'] = obj['object_version']
-                            break
+                        name_pattern = re.compile(wts, re.IGNORECASE)
+                    if name_pattern.search(obj['object_name']):
+                        wsn['object_id'] = obj['object_id']
+                        wsn['object_version'] = obj['object_version']
+                        break
 
             if wsn.get('object_id'):
-                wsn['last_saved_by'] = wsn.pop('username')
-                ws_nm, wsn['nice_name'], wsn['n_ver'], is_deleted = \
-                    self.get_narrative_info(wsn['workspace_id'])
-                wsn.pop('narr_keys')
-                wsn.pop('narr_values')
                 ws_narrs1.append(wsn)
-
-        return {'metrics_result': ws_narrs1}
+        return ws_narrs1
 
     def get_narrative_info(self, ws_id):
         """
@@ -309,22 +555,112 @@ class MetricsMongoDBController:
 
         return [str(wsinfo['ws']), wsinfo['name']]
 
+    def get_workspace_infos(self, ws_ids):
+        """
+        get_workspace_infos--batched get_workspace_info; returns a map of
+        {ws_id: [ws_id as str, ws_name]} for the distinct given ws ids (or
+        names), resolved with at most one query for ids and one for names
+        """
+        ws_infos = dict()
+        id_keys = dict()
+        names = []
+        for ws_id in set(ws_ids):
+            ws_infos[ws_id] = (None, None)
+            try:
+                id_keys.setdefault(int(ws_id), []).append(ws_id)
+            except ValueError:
+                names.append(ws_id)
+
+        if id_keys:
+            for wsinfo in self.metrics_dbi.get_workspace_info(
+                    wsid_list=list(id_keys)):
+                for ws_id in id_keys.get(wsinfo['ws'], []):
+                    if ws_infos[ws_id][0] is None:
+                        ws_infos[ws_id] = [str(wsinfo['ws']), wsinfo['name']]
+        if names:
+            for wsinfo in self.metrics_dbi.get_workspace_info(
+                    wsname_list=names):
+                ws_name = wsinfo['name']
+                if ws_name in ws_infos and ws_infos[ws_name][0] is None:
+                    ws_infos[ws_name] = [str(wsinfo['ws']), ws_name]
+        return ws_infos
+
+    def get_narrative_infos(self, ws_ids):
+        """
+        get_narrative_infos--batched get_narrative_info; returns a map of
+        {ws_id: (ws_nm, narr_nm, narr_ver, deleted)} for the distinct given
+        ws ids, looking up any workspace names with a single query
+        """
+        ws_ids = set(ws_ids)
+        if not ws_ids:
+            return dict()
+        narrative_name_map = self.narrative_cache.get()
+        narr_infos = dict()
+        names = []
+        for ws_id in ws_ids:
+            try:
+                workspace_id = int(ws_id)
+            except ValueError:
+                names.append(ws_id)
+                continue
+            narr_infos[ws_id] = narrative_name_map.get(
+                workspace_id, (None, None, None, None))
+
+        if names:
+            name_ids = dict()
+            for narr in self.metrics_dbi.list_narrative_info(
+                    wsname_list=names, include_temporary=True):
+                name_ids.setdefault(narr['name'], narr['ws'])
+            for ws_name in names:
+                if ws_name not in name_ids:
+                    narr_infos[ws_name] = (ws_name, ws_name, '1', False)
+                else:
+                    narr_infos[ws_name] = narrative_name_map.get(
+                        name_ids[ws_name], (None, None, None, None))
+        return narr_infos
+
+    def _job_wsid(self, ujs_job, exec_task_map):
+        """
+        _job_wsid--the workspace id the job assembly will resolve for the
+        given ujs job, used to gather the lookups for a page of jobs
+        """
+        if ujs_job.get('authstrat') == 'kbaseworkspace':
+            if ujs_job.get('authparam'):
+                return ujs_job['authparam']
+        exec_task = exec_task_map.get(str(ujs_job['_id']))
+        if exec_task is None or 'job_input' not in exec_task:
+            return None
+        job_input = exec_task['job_input']
+        if job_input.get('wsid'):
+            return job_input['wsid']
+        if 'params' in job_input and job_input['params']:
+            p_ws = job_input['params'][0]
+            if isinstance(p_ws, dict) and p_ws.get('ws_id'):
+                return p_ws['ws_id']
+        return None
+
     def _get_activities_from_wsobjs(self, params, token):
 
         params = self._process_parameters(params)
 
         wsobjs_act = self.metrics_dbi.aggr_activities_from_wsobjs(
             params['minTime'], params['maxTime'])
-        ws_owners = self.metrics_dbi.list_ws_owners()
-
-        for wo in ws_owners:
-            for obj in wsobjs_act:
-                if wo['ws_id'] == obj['_id']['ws_id']:
-                    obj['_id']['username'] = wo['username']
-                    break
+        if not wsobjs_act:
+            return {'metrics_result': wsobjs_act}
+
+        # only the owners of the workspaces active in the time period
+        ws_ids = {obj['_id']['ws_id'] for obj in wsobjs_act}
+        ws_owner_map = dict()
+        for wo in self.metrics_dbi.list_ws_owners(ws_ids):
+            ws_owner_map.setdefault(wo['ws_id'], wo['username'])
+
+        for obj in wsobjs_act:
+            ws_id = obj['_id']['ws_id']
+            if ws_id in ws_owner_map:
+                obj['_id']['username'] = ws_owner_map[ws_id]
         return {'metrics_result': wsobjs_act}
 
-    def _join_task_ujs(self, exec_tasks, ujs_jobs):
+    def _join_task_ujs(self, exec_tasks, ujs_jobs, client_groups=None):
         """
         combine/join exec_tasks with ujs_jobs list to get the final return data
         """
@@ -336,65 +672,94 @@ class MetricsMongoDBController:
         for exec_task in exec_tasks:
             exec_task_map[exec_task['ujs_job_id']] = exec_task
 
+        # resolve the narratives of all the jobs at once
+        ws_ids = [self._job_wsid(ujs_job, exec_task_map)
+                  for ujs_job in ujs_jobs]
+        narr_info_map = self.get_narrative_infos(
+            [ws_id for ws_id in ws_ids if ws_id])
+
         for ujs_job in ujs_jobs:
-            u_j_s = self._assemble_ujs_state(ujs_job, exec_task_map)
+            u_j_s = self._assemble_ujs_state(ujs_job, exec_task_map,
+                                             narr_info_map, client_groups)
             ujs_ret.append(u_j_s)
         return ujs_ret
 
-    def _assemble_ujs_state(self, ujs, exec_task_map):
-        u_j_s = copy.deepcopy(ujs)
-        u_j_s['job_id'] = str(u_j_s.pop('_id'))
+    def _lookup_narrative_info(self, ws_id, narr_info_map):
+        if narr_info_map is not None and ws_id in narr_info_map:
+            return narr_info_map[ws_id]
+        return self.get_narrative_info(ws_id)
+
+    @staticmethod
+    def _new_job(ujs_job):
+        """
+        _new_job--a new job dict for the jobstate document ujs_job, with
+        its passed through fields, job_id, creation_time,
+        modification_time, the wsid it is authorized by and the method of
+        its desc; ujs_job is not modified
+        """
+        job = {key: value for key, value in ujs_job.items()
+               if key not in UJS_ASSEMBLED_FIELDS}
+        job['job_id'] = str(ujs_job['_id'])
+        job['creation_time'] = ujs_job['created']
+        job['modification_time'] = ujs_job['updated']
+
+        authparam = ujs_job['authparam']
+        if ujs_job['authstrat'] == 'kbaseworkspace':
+            job['wsid'] = authparam
+
+        desc = ujs_job.get('desc')
+        if desc:
+            desc = desc.split()[-1]
+            if '.' in desc:
+                job['method'] = desc
+        elif 'desc' in ujs_job:
+            job['desc'] = desc
+        return job
+
+    def _assemble_ujs_state(self, ujs, exec_task_map, narr_info_map=None,
+                            client_groups=None):
+        u_j_s = self._new_job(ujs)
 
         # determine true job state
         job_state = None
-        if u_j_s.get('complete', False):
-            if u_j_s.get('error', False):
+        if ujs.get('complete', False):
+            if ujs.get('error', False):
                 # hmm, this does not seem reliable
                 # if u_j_s.get('status', None) == 'queued':
-                if u_j_s.get('started'):
+                if ujs.get('started'):
                     job_state = 'ERRORED_RUNNING'
                 else:
                     job_state = 'ERRORED_QUEUED'
             else:
-                if u_j_s.get('status', None) == 'done':
+                if ujs.get('status', None) == 'done':
                     job_state = 'FINISHED'
-                elif u_j_s.get('status', '').startswith('canceled'):
-                    if 'started' in u_j_s:
+                elif ujs.get('status', '').startswith('canceled'):
+                    if 'started' in ujs:
                         job_state = 'CANCELED_RUNNING'
                     else:
                         job_state = 'CANCELED_QUEUED'
-                elif u_j_s.get('status', None) == 'Unknown error':
-                    if u_j_s.get('started'):
+                elif ujs.get('status', None) == 'Unknown error':
+                    if ujs.get('started'):
                         job_state = 'ERRORED_RUNNING'
                     else:
                         job_state = 'ERRORED_QUEUED'
                 else:
                     job_state = 'ERRORED'
-                    if u_j_s.get('started'):
+                    if ujs.get('started'):
                         job_state = 'ERRORED_RUNNING'
                     else:
                         job_state = 'ERRORED_QUEUED'
         else:
-            if 'status' not in u_j_s or u_j_s.get('status', None) == 'queued':
+            if 'status' not in ujs or ujs.get('status', None) == 'queued':
                 job_state = 'QUEUED'
             else:
                 job_state = 'RUNNING'
         u_j_s['state'] = job_state
 
-        if u_j_s.get('started'):
-            u_j_s['exec_start_time'] = u_j_s.pop('started', None)
-        u_j_s['creation_time'] = u_j_s.pop('created')
-        u_j_s['modification_time'] = u_j_s.pop('updated')
-
-        authparam = u_j_s.pop('authparam')
-        authstrat = u_j_s.pop('authstrat')
-        if authstrat == 'kbaseworkspace':
-            u_j_s['wsid'] = authparam
-
-        if u_j_s.get('desc'):
-            desc = u_j_s.pop('desc').split()[-1]
-            if '.' in desc:
-                u_j_s['method'] = desc
+        if ujs.get('started'):
+            u_j_s['exec_start_time'] = ujs['started']
+        elif 'started' in ujs:
+            u_j_s['started'] = ujs['started']
 
         exec_task = exec_task_map.get(u_j_s['job_id'], None)
         if exec_task is not None and 'job_input' in exec_task:
@@ -414,7 +779,8 @@ class MetricsMongoDBController:
 
             # try to get workspace_name--first by wsid, then from 'job_input'
             if u_j_s.get('wsid') and not u_j_s.get('workspace_name'):
-                ws_name = self.get_narrative_info(u_j_s['wsid'])[0]
+                ws_name = self._lookup_narrative_info(
+                    u_j_s['wsid'], narr_info_map)[0]
                 u_j_s['workspace_name'] = ws_name
             if (not u_j_s.get('workspace_name') or
                     u_j_s['workspace_name'] == ''):
@@ -444,8 +810,8 @@ class MetricsMongoDBController:
         # get the narrative name and version via u_j_s['wsid']
         job_type = None
         if u_j_s.get('wsid'):
-            w_nm, n_name, n_ver, is_deleted = self.get_narrative_info(
-                u_j_s['wsid'])
+            w_nm, n_name, n_ver, is_deleted = self._lookup_narrative_info(
+                u_j_s['wsid'], narr_info_map)
             if w_nm is None:
                 # not found
                 job_type = 'workspace'
@@ -466,17 +832,11 @@ class MetricsMongoDBController:
         u_j_s['job_type'] = job_type
 
         # get the client groups
-        u_j_s['client_groups'] = ['njs']  # default client groups to 'njs'
-        if self.client_groups:
-            for clnt in self.client_groups:
-                clnt_id = clnt['app_id']
-                ujs_a_id = str(u_j_s.get('app_id'))
-                if str(clnt_id).lower() == ujs_a_id.lower():
-                    u_j_s['client_groups'] = clnt['client_groups']
-                    break
+        u_j_s['client_groups'] = self._app_client_groups(
+            u_j_s.get('app_id'), client_groups)
         return u_j_s
 
-    def join_jobs(self, exec_tasks, ujs_jobs):
+    def join_jobs(self, exec_tasks, ujs_jobs, client_groups=None):
         """
         combine/join exec_tasks with ujs_jobs list to get the final return data
         """
@@ -488,34 +848,47 @@ class MetricsMongoDBController:
         for exec_task in exec_tasks:
             exec_task_map[exec_task['ujs_job_id']] = exec_task
 
+        # resolve the workspaces of all the jobs at once, so the cost is
+        # per distinct workspace rather than per job.
+        ws_ids = [self._job_wsid(ujs_job, exec_task_map)
+                  for ujs_job in ujs_jobs]
+        ws_info_map = self.get_workspace_infos(
+            [ws_id for ws_id in ws_ids if ws_id])
+
         for ujs_job in ujs_jobs:
-            ujs = self.assemble_job(ujs_job, exec_task_map)
+            ujs = self.assemble_job(ujs_job, exec_task_map, ws_info_map,
+                                    client_groups)
             jobs.append(ujs)
 
         return jobs
 
-    def assemble_job(self, ujs_job, exec_task_map):
-        # TODO: clean this up by using a new dict, not doing a copy and
-        # popping and overwriting!!!
-        job = copy.deepcopy(ujs_job)
-        job['job_id'] = str(job.pop('_id'))
+    def assemble_job(self, ujs_job, exec_task_map, ws_info_map=None,
+                     client_groups=None):
+        """
+        assemble_job--the job of query_jobs for the jobstate document
+        ujs_job, merged with its exec task and the client groups of its app
+        in client_groups (see _get_client_groups); the job is a new dict and
+        ujs_job is not modified
+        """
+        job = self._new_job(ujs_job)
 
         # determine true job state
         job_state = None
-        if job.get('complete', False):
-            if job.get('error', False):
+        if ujs_job.get('complete', False):
+            if ujs_job.get('error', False):
                 job_state = 'error'
             else:
-                if job.get('status', None) == 'done':
+                if ujs_job.get('status', None) == 'done':
                     job_state = 'complete'
-                elif job.get('status', '').startswith('canceled'):
+                elif ujs_job.get('status', '').startswith('canceled'):
                     job_state = 'cancel'
-                elif job.get('status', None) == 'Unknown error':
+                elif ujs_job.get('status', None) == 'Unknown error':
                     job_state = 'error'
                 else:
                     job_state = 'error'
         else:
-            if 'status' not in job or job.get('status', None) == 'queue':
+            if ('status' not in ujs_job or
+                    ujs_job.get('status', None) == 'queue'):
                 job_state = 'queue'
             else:
                 job_state = 'run'
@@ -525,20 +898,9 @@ class MetricsMongoDBController:
         # TODO: I don't know what is happening here. This section needs lots of
         # docs to explain the workarounds.
         if job_state != 'error':
-            job['exec_start_time'] = job.pop('started', None)
-
-        job['creation_time'] = job.pop('created')
-        job['modification_time'] = job.pop('updated')
-
-        authparam = job.pop('authparam')
-        authstrat = job.pop('authstrat')
-        if authstrat == 'kbaseworkspace':
-            job['wsid'] = authparam
-
-        if job.get('desc'):
-            desc = job.pop('desc').split()[-1]
-            if '.' in desc:
-                job['method'] = desc
+            job['exec_start_time'] = ujs_job.get('started', None)
+        elif 'started' in ujs_job:
+            job['started'] = ujs_job['started']
 
         # Now merge in info from the exec_task, if available.
         exec_task = exec_task_map.get(job['job_id'], None)
@@ -562,7 +924,7 @@ class MetricsMongoDBController:
 
             if not job.get('wsid'):
                 if 'wsid' in job_input:
-                    job['wsid'] = job['wsid']
+                    job['wsid'] = job_input['wsid']
                 elif 'params' in job_input and job_input['params']:
                     p_ws = job_input['params'][0]
                     if isinstance(p_ws, dict) and 'ws_id' in p_ws:
@@ -570,7 +932,10 @@ class MetricsMongoDBController:
 
             # try to get workspace_name--first by wsid, then from 'job_input'
             if job.get('wsid') and not job.get('workspace_name'):
-                ws_id, ws_name = self.get_workspace_info(job['wsid'])
+                if ws_info_map is not None and job['wsid'] in ws_info_map:
+                    ws_id, ws_name = ws_info_map[job['wsid']]
+                else:
+                    ws_id, ws_name = self.get_workspace_info(job['wsid'])
                 job['workspace_name'] = ws_name
                 job['wsid'] = ws_id
 
@@ -606,14 +971,8 @@ class MetricsMongoDBController:
             job.pop('workspace_name')
 
         # get the client groups
-        job['client_groups'] = ['njs']  # default client groups to 'njs'
-        if self.client_groups:
-            for clnt in self.client_groups:
-                clnt_app_id = clnt['app_id']
-                ujs_app_id = str(job.get('app_id'))
-                if str(clnt_app_id).lower() == ujs_app_id.lower():
-                    job['client_groups'] = clnt['client_groups']
-                    break
+        job['client_groups'] = self._app_client_groups(job.get('app_id'),
+                                                       client_groups)
 
         return job
 
@@ -677,15 +1036,53 @@ class MetricsMongoDBController:
         }
         """
         # initialize client(s) for accessing other services
-        self.cat_client = Catalog(self.catalog_url,
-                                  auth_svc=self.auth_service_url, token=token)
+        cat_client = Catalog(self.catalog_url,
+                             auth_svc=self.auth_service_url, token=token)
         # Pull the data
-        client_groups = self.cat_client.get_client_groups({})
+        client_groups = cat_client.get_client_groups({})
 
         return [{'app_id': client_group.get('app_id'),
                  'client_groups': client_group.get('client_groups')}
                 for client_group in client_groups]
 
+    def _get_client_groups(self, token):
+        """
+        _get_client_groups--the Catalog client groups, indexed by app id
+        for the job assembly (see _index_client_groups), from the process
+        level client group cache
+        """
+        return self.client_group_cache.get(token)
+
+    def _fetch_client_groups(self, token):
+        return self._index_client_groups(
+            self._get_client_groups_from_cat(token))
+
+    @staticmethod
+    def _index_client_groups(client_groups):
+        """
+        _index_client_groups--{lowercased app_id: client_groups} of the
+        Catalog client groups; of app ids differing only by case, the
+        first one listed wins
+        """
+        cg_index = dict()
+        for client_group in client_groups:
+            cg_index.setdefault(str(client_group.get('app_id')).lower(),
+                                client_group.get('client_groups'))
+        return cg_index
+
+    @staticmethod
+    def _app_client_groups(app_id, client_groups):
+        """
+        _app_client_groups--the client groups of the app in the indexed
+        Catalog client_groups, matched case-insensitively; ['njs'] if the
+        app has none
+        """
+        if client_groups:
+            cg_key = str(app_id).lower()
+            if cg_key in client_groups:
+                return client_groups[cg_key]
+        return ['njs']  # default client groups to 'njs'
+
     def map_ws_narrative_names(self, requesting_user, ws_ids, token):
         """
         get_ws_narratives--Give the list of workspace ids, map ws_nm, narr_nm
@@ -725,23 +1122,27 @@ class MetricsMongoDBController:
         start = round(time.time() * 1000)
 
         # 1. get the client_groups data for lookups
-        if self.client_groups is None:
-            self.client_groups = self._get_client_groups_from_cat(token)
+        client_groups = self._get_client_groups(token)
 
         now = round(time.time() * 1000)
         perf['client_groups'] = now - start
+        perf['client_groups_age'] = self.client_group_cache.age()
         start = now
 
         # 2. query dbs to get lists of tasks and jobs
         params = self._process_parameters(params)
 
+        self._check_continuation_token(params)
         ujs_jobs, ujs_jobs_count = self.metrics_dbi.list_ujs_results(
             user_ids=params.get('user_ids', None),
             start_time=params['minTime'],
             end_time=params['maxTime'],
             offset=params.get('offset', None),
             limit=params.get('limit', None),
-            sort=params.get('sort', None))
+            sort=params.get('sort', None),
+            continuation_token=params.get('continuation_token', None))
+        next_token = self.metrics_dbi.ujs_results_continuation_token(
+            params.get('sort', None), ujs_jobs, params.get('limit', None))
 
         now = round(time.time() * 1000)
         perf['list_ujs_results'] = now - start
@@ -751,6 +1152,7 @@ class MetricsMongoDBController:
             return {
                 'job_states': [],
                 'total_count': ujs_jobs_count,
+                'continuation_token': next_token,
                 'stats': {
                     'perf': perf
                 }
@@ -773,18 +1175,63 @@ class MetricsMongoDBController:
         perf['_convert_isodate_to_millis'] = now - start
         start = now
 
-        job_states = self._join_task_ujs(exec_tasks, ujs_jobs)
+        job_states = self._join_task_ujs(exec_tasks, ujs_jobs, client_groups)
 
         now = round(time.time() * 1000)
         perf['_join_task_ujs'] = now - start
         start = now
+        perf['narrative_cache_age'] = self.narrative_cache.age()
 
         return {
             'job_states': job_states,
             'total_count': ujs_jobs_count,
+            'continuation_token': next_token,
             'stats': {'perf': perf}
         }
 
+    def _check_continuation_token(self, params):
+        """
+        _check_continuation_token--a continuation token replaces the
+        offset; the two cannot be combined
+        """
+        if (params.get('continuation_token') is not None and
+                params.get('offset')):
+            raise ValueError('A continuation_token and an offset cannot '
+                             'both be given.')
+
+    def _job_total_count(self, restrict_to_user, params):
+        """
+        _job_total_count--the cached total_count of query_jobs: the number
+        of jobs of restrict_to_user, or of all users; None if the counts
+        are skipped or not cached
+        """
+        if params.get('skip_counts') or not self.job_counts.enabled():
+            return None
+        if restrict_to_user:
+            user_counts, _ = self.job_counts.get([restrict_to_user])
+            return user_counts[restrict_to_user]
+        return self.job_counts.get()[1]
+
+    def get_job_counts(self, requesting_user, params, token):
+        """
+        get_job_counts--the number of jobs of each of the given users and
+        the total number of jobs, as of at most job_counts.ttl seconds ago;
+        a user who is not an admin can only count their own jobs, and
+        their total is the number of their jobs
+        """
+        user_ids = params.get('user_ids') or []
+        if not self._is_admin(requesting_user):
+            if any(user_id != requesting_user for user_id in user_ids):
+                raise ValueError('You do not have permisson to '
+                                 'invoke this action.')
+            user_counts, _ = self.job_counts.get([requesting_user])
+            return {'user_counts': {user_id: user_counts[user_id]
+                                    for user_id in user_ids},
+                    'total_count': user_counts[requesting_user]}
+
+        user_counts, total_count = self.job_counts.get(user_ids)
+        return {'user_counts': user_counts, 'total_count': total_count}
+
     def query_jobs_admin(self, requesting_user, params, token):
         """
         what it does
@@ -809,15 +1256,18 @@ class MetricsMongoDBController:
         --userjobstate.jobstate['_id']==exec_engine.exec_tasks['ujs_job_id']
         """
 
+        if self.job_states_materialized and self._job_states_ready():
+            return self._query_job_states(restrict_to_user, params, token)
+
         perf = dict()
         start = round(time.time() * 1000)
 
         # 1. get the client_groups data for lookups
-        if self.client_groups is None:
-            self.client_groups = self._get_client_groups_from_cat(token)
+        client_groups = self._get_client_groups(token)
 
         now = round(time.time() * 1000)
         perf['client_groups'] = now - start
+        perf['client_groups_age'] = self.client_group_cache.age()
         start = now
 
         # 2. query dbs to get lists of tasks and jobs
@@ -829,8 +1279,10 @@ class MetricsMongoDBController:
             start_time_param = None
             end_time_param = None
 
-        ujs_jobs, ujs_jobs_found_count, ujs_jobs_total_count = \
-            self.metrics_dbi.query_ujs(
+        self._check_continuation_token(params)
+
+        def query_ujs(lookup_exec_tasks):
+            return self.metrics_dbi.query_ujs(
                 restrict_user=restrict_to_user,
                 end_time=end_time_param,
                 start_time=start_time_param,
@@ -838,7 +1290,29 @@ class MetricsMongoDBController:
                 limit=params.get('limit', None),
                 filter=params.get('filter', None),
                 search=params.get('search', None),
-                sort=params.get('sort', None))
+                sort=params.get('sort', None),
+                continuation_token=params.get('continuation_token', None),
+                counts=not params.get('skip_counts'),
+                total_count=self._job_total_count(restrict_to_user, params),
+                lookup_exec_tasks=lookup_exec_tasks)
+
+        # join the exec tasks in the same aggregation, if mongo can
+        lookup = (self.query_jobs_lookup and
+                  self.metrics_dbi.exec_tasks_lookup_available())
+        try:
+            ujs_jobs, ujs_jobs_found_count, ujs_jobs_total_count, \
+                next_token = query_ujs(lookup)
+        except OperationFailure as ex:
+            if not lookup:
+                raise
+            # e.g. a server without $toString; do not try again
+            print('Error joining the exec tasks with $lookup: ' + str(ex))
+            self.metrics_dbi.disable_exec_tasks_lookup()
+            perf['join_lookup_error'] = str(ex)
+            lookup = False
+            ujs_jobs, ujs_jobs_found_count, ujs_jobs_total_count, \
+                next_token = query_ujs(lookup)
+        perf['join_mode'] = 'lookup' if lookup else 'two_queries'
 
         now = round(time.time() * 1000)
         perf['query_ujs_results'] = now - start
@@ -849,6 +1323,7 @@ class MetricsMongoDBController:
                 'job_states': [],
                 'found_count': ujs_jobs_found_count,
                 'total_count': ujs_jobs_total_count,
+                'continuation_token': next_token,
                 'stats': {
                     'perf': perf
                 }
@@ -856,9 +1331,12 @@ class MetricsMongoDBController:
 
         start = now
 
-        ujs_job_ids = list(map(lambda x: str(x['_id']), ujs_jobs))
-
-        exec_tasks = self.metrics_dbi.list_exec_tasks(jobIDs=ujs_job_ids)
+        if lookup:
+            exec_tasks = [exec_task for ujs_job in ujs_jobs
+                          for exec_task in ujs_job.pop('exec_tasks')]
+        else:
+            ujs_job_ids = list(map(lambda x: str(x['_id']), ujs_jobs))
+            exec_tasks = self.metrics_dbi.list_exec_tasks(jobIDs=ujs_job_ids)
 
         now = round(time.time() * 1000)
         perf['list_exec_tasks'] = now - start
@@ -871,16 +1349,64 @@ class MetricsMongoDBController:
         perf['_convert_isodate_to_millis'] = now - start
         start = now
 
-        job_states = self.join_jobs(exec_tasks, ujs_jobs)
+        job_states = self.join_jobs(exec_tasks, ujs_jobs, client_groups)
 
         now = round(time.time() * 1000)
         perf['join_jobs'] = now - start
         start = now
+        perf['narrative_cache_age'] = self.narrative_cache.age()
 
         return {
             'job_states': job_states,
             'found_count': ujs_jobs_found_count,
             'total_count': ujs_jobs_total_count,
+            'continuation_token': next_token,
+            'stats': {'perf': perf}
+        }
+
+    def _query_job_states(self, restrict_to_user, params, token):
+        """
+        _query_job_states--query_jobs from the assembled jobs of
+        metrics.job_states, once update_metrics has built it, with a single
+        find; the collection is kept up to date in the background (see
+        _start_job_states_sync), and a request never waits for a sync
+        """
+        perf = dict()
+        start = round(time.time() * 1000)
+
+        self._start_job_states_sync(token)
+        perf['job_states_age'] = self._job_states_age()
+
+        if 'epoch_range' in params:
+            start_time_param, end_time_param = params.get('epoch_range')
+        else:
+            start_time_param = None
+            end_time_param = None
+
+        self._check_continuation_token(params)
+        job_states, found_count, total_count, next_token = \
+            self.metrics_dbi.query_job_states(
+                restrict_user=restrict_to_user,
+                end_time=end_time_param,
+                start_time=start_time_param,
+                offset=params.get('offset', None),
+                limit=params.get('limit', None),
+                filter=params.get('filter', None),
+                search=params.get('search', None),
+                sort=params.get('sort', None),
+                continuation_token=params.get('continuation_token', None),
+                counts=not params.get('skip_counts'),
+                total_count=self._job_total_count(restrict_to_user, params))
+
+        now = round(time.time() * 1000)
+        perf['query_job_states'] = now - start
+        perf['query_job_states_count'] = found_count
+
+        return {
+            'job_states': job_states,
+            'found_count': found_count,
+            'total_count': total_count,
+            'continuation_token': next_token,
             'stats': {'perf': perf}
         }
 
@@ -905,11 +1431,11 @@ class MetricsMongoDBController:
             user_id = None
 
         # 1. get the client_groups data for lookups
-        if self.client_groups is None:
-            self.client_groups = self._get_client_groups_from_cat(token)
+        client_groups = self._get_client_groups(token)
 
         now = round(time.time() * 1000)
         perf['client_groups'] = now - start
+        perf['client_groups_age'] = self.client_group_cache.age()
         start = now
 
         # 2. query dbs to get lists of tasks and jobs
@@ -932,11 +1458,12 @@ class MetricsMongoDBController:
         ujs_jobs = self._convert_isodate_to_millis(
             [ujs_job], ['created', 'started', 'updated'])
 
-        job_states = self._join_task_ujs(exec_tasks, ujs_jobs)
+        job_states = self._join_task_ujs(exec_tasks, ujs_jobs, client_groups)
 
         now = round(time.time() * 1000)
         perf['_join_task_ujs'] = now - start
         start = now
+        perf['narrative_cache_age'] = self.narrative_cache.age()
 
         return {'job_state': job_states[0], 'stats': {'perf': perf}}
 
@@ -951,53 +1478,335 @@ class MetricsMongoDBController:
                              'invoke this action.')
 
         params = self._process_parameters(params)
-
-        # 1. get the narr_owners data for lookups
-        if exclude_kbstaff:
-            excludes = self._get_kbstaff_list()
-        else:
-            excludes = []
+        if not exclude_kbstaff:
             params['user_ids'] = []
 
-        narr_data = self.metrics_dbi.list_narrative_info(
-            owner_list=params['user_ids'],
-            excluded_users=excludes)
-        n_ws = [nd['ws'] for nd in narr_data]
+        def run_report():
+            # 1. get the narr_owners data for lookups
+            if exclude_kbstaff:
+                excludes = self._get_kbstaff_list()
+            else:
+                excludes = []
+
+            narr_data = self.metrics_dbi.list_narrative_info(
+                owner_list=params['user_ids'],
+                excluded_users=excludes)
+            n_ws = [nd['ws'] for nd in narr_data]
+
+            # 2. query db to get lists of narratives with ws_ids and
+            #    first_access_date
+            if params.get('bypass_cache'):
+                ws_firstAccs = self.metrics_dbi.list_ws_firstAccess(
+                    params['minTime'],
+                    params['maxTime'],
+                    ws_list=n_ws)
+            else:
+                ws_firstAccs = self._ws_firstAccess_by_month(
+                    params['minTime'], params['maxTime'], n_ws,
+                    refresh=params.get('refresh_cache'))
+
+            narr_stats = {}
+            # Futher counting the narratives by grouping into yyyy-mm
+            for narr in ws_firstAccs:
+                narr_stats[narr['yyyy-mm']] = narr['ws_count']
+            return narr_stats
 
-        # 2. query db to get lists of narratives with ws_ids and
-        #    first_access_date
-        ws_firstAccs = self.metrics_dbi.list_ws_firstAccess(
-            params['minTime'],
-            params['maxTime'],
-            ws_list=n_ws)
+        return self._cached_report('get_narrative_stats', params,
+                                   exclude_kbstaff, run_report)
 
-        narr_stats = {}
-        # Futher counting the narratives by grouping into yyyy-mm
-        for narr in ws_firstAccs:
-            narr_stats[narr['yyyy-mm']] = narr['ws_count']
+    def _split_closed_months(self, min_time, max_time):
+        """
+        _split_closed_months--split the time range (in milliseconds) into
+        the (year, month) of the whole months (UTC) in it which are over,
+        and the time ranges of the rest of it: the partial months at
+        either end and the current month
+        """
+        now = datetime.datetime.utcnow()
+        current_month = datetime.datetime(now.year, now.month, 1)
+        start = _convert_to_datetime(min_time)
+        month = datetime.datetime(start.year, start.month, 1)
+        if month < start:
+            month = self._next_month(month)
+        first_closed = month
+
+        closed_months = []
+        while True:
+            next_month = self._next_month(month)
+            if (next_month > current_month or
+                    _unix_time_millis_from_datetime(next_month) - 1 >
+                    max_time):
+                break
+            closed_months.append((month.year, month.month))
+            month = next_month
+        if not closed_months:
+            return [], [(min_time, max_time)]
+
+        live_ranges = []
+        closed_start = _unix_time_millis_from_datetime(first_closed)
+        closed_end = _unix_time_millis_from_datetime(month)
+        if min_time < closed_start:
+            live_ranges.append((min_time, closed_start - 1))
+        if closed_end <= max_time:
+            live_ranges.append((closed_end, max_time))
+        return closed_months, live_ranges
+
+    @staticmethod
+    def _next_month(month):
+        if month.month == 12:
+            return month.replace(year=month.year + 1, month=1)
+        return month.replace(month=month.month + 1)
+
+    def _closed_month_range(self, months):
+        """
+        _closed_month_range--the time range (in milliseconds) spanning
+        the given (year, month) months
+        """
+        first_year, first_month = min(months)
+        last_year, last_month = max(months)
+        return (_unix_time_millis_from_datetime(
+                    datetime.datetime(first_year, first_month, 1)),
+                _unix_time_millis_from_datetime(self._next_month(
+                    datetime.datetime(last_year, last_month, 1))) - 1)
+
+    def _signup_retn_users_by_month(self, user_ids, min_time, max_time,
+                                    excluded_users, refresh=False):
+        """
+        _signup_retn_users_by_month--aggr_signup_retn_users, with the
+        users who signed up in the past months of the time range counted
+        from the closed month buckets; only the rest of the range is
+        aggregated from the metrics db
+        """
+        closed_months, live_ranges = self._split_closed_months(min_time,
+                                                               max_time)
+
+        def build(months):
+            return {(u_month['_id']['year'], u_month['_id']['month']):
+                    u_month['users']
+                    for u_month in self.metrics_dbi.aggr_signup_users_monthly(
+                        *self._closed_month_range(months))}
+
+        signups = dict()
+        if closed_months:
+            user_set = set(user_ids)
+            excluded = set(excluded_users)
+            buckets = self.closed_buckets.get(SIGNUPS_REPORT, closed_months,
+                                              build, refresh=refresh)
+            for month, users in buckets.items():
+                counts = [0, 0]
+                for username, returning in users:
+                    if user_set and username not in user_set:
+                        continue
+                    if username in excluded:
+                        continue
+                    counts[0] += 1
+                    counts[1] += returning
+                if counts[0]:
+                    signups[month] = counts
+
+        for live_min, live_max in live_ranges:
+            for u_month in self.metrics_dbi.aggr_signup_retn_users(
+                    user_ids, live_min, live_max, excluded_users):
+                month = (u_month['_id']['year'], u_month['_id']['month'])
+                counts = signups.setdefault(month, [0, 0])
+                counts[0] += u_month['user_signups']
+                counts[1] += u_month['returning_user_count']
+
+        return [{'_id': {'year': year, 'month': month},
+                 'user_signups': counts[0],
+                 'returning_user_count': counts[1]}
+                for (year, month), counts in sorted(signups.items())]
+
+    def _ws_firstAccess_by_month(self, min_time, max_time, ws_list,
+                                 refresh=False):
+        """
+        _ws_firstAccess_by_month--list_ws_firstAccess, with the workspaces
+        first accessed in the past months of the time range counted from
+        the closed month buckets; only the rest of the range is aggregated
+        from the workspace db
+        """
+        closed_months, live_ranges = self._split_closed_months(min_time,
+                                                               max_time)
+
+        def build(months):
+            return {(ws_month['_id']['year'], ws_month['_id']['month']):
+                    ws_month['ws_ids']
+                    for ws_month in
+                    self.metrics_dbi.aggr_ws_firstAccess_monthly(
+                        *self._closed_month_range(months))}
+
+        ws_counts = dict()
+        if closed_months:
+            ws_set = set(ws_list)
+            buckets = self.closed_buckets.get(FIRST_ACCESS_REPORT,
+                                              closed_months, build,
+                                              refresh=refresh)
+            for (year, month), ws_ids in buckets.items():
+                # as in list_ws_firstAccess, no ws_list means all of them
+                ws_count = (sum(1 for ws_id in ws_ids if ws_id in ws_set)
+                            if ws_set else len(ws_ids))
+                if ws_count:
+                    ws_counts['{}-{}'.format(year, month)] = ws_count
+
+        for live_min, live_max in live_ranges:
+            for ws_month in self.metrics_dbi.list_ws_firstAccess(
+                    live_min, live_max, ws_list=ws_list):
+                ws_counts[ws_month['yyyy-mm']] = (
+                    ws_counts.get(ws_month['yyyy-mm'], 0) +
+                    ws_month['ws_count'])
+
+        return [{'yyyy-mm': yyyy_mm, 'ws_count': ws_count}
+                for yyyy_mm, ws_count in ws_counts.items()]
+
+    def _cached_report(self, method, params, exclude_kbstaff, run_report):
+        """
+        _cached_report--the result of the reporting method, as returned by
+        run_report(), served from the report cache when the same report
+        was run recently. Reports are keyed by the method, the set of
+        user_ids, the days (UTC) on which the time range starts and ends
+        and the kbstaff exclusion, so repeated dashboard requests over the
+        same days share one result until it expires. With bypass_cache the
+        report is run and the cache left alone; with refresh_cache it is
+        run and its cached result replaced.
+        """
+        key = (method, tuple(sorted(set(params['user_ids']))),
+               params['minTime'] // DAY_MILLIS,
+               params['maxTime'] // DAY_MILLIS, bool(exclude_kbstaff))
+
+        cached = None
+        if params.get('bypass_cache'):
+            status = 'bypass'
+        elif params.get('refresh_cache'):
+            status = 'refresh'
+        else:
+            cached = self.report_cache.get(key)
+            status = 'miss' if cached is None else 'hit'
+
+        if cached is None:
+            metrics_result = run_report()
+            age = None
+            if status != 'bypass':
+                self.report_cache.put(key, metrics_result)
+                age = 0
+        else:
+            metrics_result, age = cached
 
-        return {'metrics_result': narr_stats}
+        cache_stats = self.report_cache.stats()
+        cache_stats.update({'status': status, 'age': age})
+        return {'metrics_result': metrics_result,
+                'stats': {'cache': cache_stats}}
 
     # begin putting the deleted functions back
+    def _get_user_ws_monthly(self, user_ids, min_time, max_time,
+                             excluded_users=None):
+        """
+        _get_user_ws_monthly--the number of workspaces, and of their
+        objects, of each owner by the year and month of their last
+        modification, as {(username, year, month): (ws_count, numObj)}.
+        The whole days of the time range up to the last update of the
+        workspace rollups (by update_metrics) are read from the rollups,
+        less the workspaces modified since, which are counted with the
+        partial days at either end and the days since the update from the
+        workspaces. min_time and max_time are naive UTC datetimes, as are
+        the days of the rollups.
+        """
+        live_ranges = [(min_time, max_time)]
+        rollup_range = None
+        built_at = self.metrics_dbi.get_watermark(WS_ROLLUPS)
+        if built_at is not None:
+            one_day = datetime.timedelta(days=1)
+            one_milli = datetime.timedelta(milliseconds=1)
+            first_day = min_time.replace(hour=0, minute=0, second=0,
+                                         microsecond=0)
+            if first_day < min_time:
+                first_day += one_day
+            end_day = (max_time + one_milli).replace(hour=0, minute=0,
+                                                     second=0, microsecond=0)
+            built_day = _convert_to_datetime(
+                built_at - built_at % DAY_MILLIS)
+            end_day = min(end_day, built_day)
+            if first_day < end_day:
+                rollup_range = (first_day, end_day)
+                live_ranges = []
+                if min_time < first_day:
+                    live_ranges.append((min_time, first_day - one_milli))
+                if end_day <= max_time:
+                    live_ranges.append((end_day, max_time))
+
+        # (sign, counts) of each part of the time range
+        db_rets = [(1, self.metrics_dbi.aggr_user_ws_monthly(
+            user_ids, live_min, live_max, excluded_users))
+            for live_min, live_max in live_ranges]
+        if rollup_range is not None:
+            db_rets.append((1, self.metrics_dbi.aggr_workspace_rollups(
+                user_ids, rollup_range[0], rollup_range[1],
+                excluded_users)))
+            db_rets.append((-1, self.metrics_dbi.aggr_workspace_rollups_moved(
+                user_ids, rollup_range[0], rollup_range[1],
+                _convert_to_datetime(built_at), excluded_users)))
+
+        user_ws = dict()
+        for sign, db_ret in db_rets:
+            for u_ws in db_ret:
+                key = (u_ws['_id']['username'], u_ws['_id']['year'],
+                       u_ws['_id']['month'])
+                ws_count, num_objs = user_ws.get(key, (0, 0))
+                user_ws[key] = (ws_count + sign * u_ws['ws_count'],
+                                num_objs + sign * u_ws['numObj'])
+        return {key: counts for key, counts in user_ws.items()
+                if counts[0] > 0}
+
+    def _format_user_ws_monthly(self, user_ws, count_key, value_index):
+        """
+        _format_user_ws_monthly--list one of the counts of
+        _get_user_ws_monthly as the per user, year and month records of
+        the reporting methods, ordered by username, year and month
+        """
+        return [{'_id': {'username': username, 'year': year,
+                         'month': month},
+                 count_key: counts[value_index]}
+                for (username, year, month), counts in sorted(
+                    user_ws.items(), key=lambda u_ws: (
+                        str(u_ws[0][0]), u_ws[0][1], u_ws[0][2]))]
+
+    def _update_workspace_rollups(self):
+        """
+        _update_workspace_rollups--update the daily workspace rollups read
+        by the workspace reporting methods with the workspaces modified
+        since their last update, or build them if there is none; returns
+        the number of workspaces moved between rollups
+        """
+        built_at = _unix_time_millis_from_datetime(datetime.datetime.utcnow())
+        since = self.metrics_dbi.get_watermark(WS_ROLLUPS)
+        moved_count = self.metrics_dbi.update_workspace_rollups(
+            None if since is None else _convert_to_datetime(since),
+            self.update_chunk_size)
+        self.metrics_dbi.set_watermark(WS_ROLLUPS, built_at)
+        print_debug(f'moved {moved_count} workspaces between rollups.')
+        return moved_count
+
     def get_total_logins_from_ws(self, requesting_user, params, token,
                                  exclude_kbstaff=False):
         if not self._is_admin(requesting_user):
             raise ValueError('You do not have permisson to '
                              'invoke this action.')
         params = self._process_parameters(params)
-        params['minTime'] = datetime.datetime.fromtimestamp(
-            params['minTime'] / 1000)
-        params['maxTime'] = datetime.datetime.fromtimestamp(
-            params['maxTime'] / 1000)
-
-        if exclude_kbstaff:
-            kb_list = self._get_kbstaff_list()
-            db_ret = self.metrics_dbi.aggr_total_logins(
-                params['user_ids'], params['minTime'],
-                params['maxTime'], kb_list)
-        else:
-            db_ret = self.metrics_dbi.aggr_total_logins(
-                params['user_ids'], params['minTime'], params['maxTime'])
+        params['minTime'] = _convert_to_datetime(params['minTime'])
+        params['maxTime'] = _convert_to_datetime(params['maxTime'])
+
+        excluded_users = self._get_kbstaff_list() if exclude_kbstaff else None
+        user_ws = self._get_user_ws_monthly(
+            params['user_ids'], params['minTime'], params['maxTime'],
+            excluded_users)
+
+        total_logins = dict()
+        for (username, year, month), (ws_count, _) in user_ws.items():
+            total_logins[(year, month)] = \
+                total_logins.get((year, month), 0) + ws_count
+        # the most recent months first
+        db_ret = [{'_id': {'year': year, 'month': month},
+                   'year_mon_total_logins': logins}
+                  for (year, month), logins in sorted(total_logins.items(),
+                                                      reverse=True)]
 
         return {'metrics_result': db_ret}
 
@@ -1006,13 +1815,13 @@ class MetricsMongoDBController:
             raise ValueError('You do not have permisson to '
                              'invoke this action.')
         params = self._process_parameters(params)
-        params['minTime'] = datetime.datetime.fromtimestamp(
-            params['minTime'] / 1000)
-        params['maxTime'] = datetime.datetime.fromtimestamp(
-            params['maxTime'] / 1000)
+        params['minTime'] = _convert_to_datetime(params['minTime'])
+        params['maxTime'] = _convert_to_datetime(params['maxTime'])
 
-        db_ret = self.metrics_dbi.aggr_user_logins_from_ws(
+        user_ws = self._get_user_ws_monthly(
             params['user_ids'], params['minTime'], params['maxTime'])
+        db_ret = self._format_user_ws_monthly(
+            user_ws, 'year_mon_user_logins', 0)
         return {'metrics_result': db_ret}
 
     def get_user_numObjs_from_ws(self, requesting_user, params, token):
@@ -1021,13 +1830,13 @@ class MetricsMongoDBController:
                              'invoke this action.')
 
         params = self._process_parameters(params)
-        params['minTime'] = datetime.datetime.fromtimestamp(
-            params['minTime'] / 1000)
-        params['maxTime'] = datetime.datetime.fromtimestamp(
-            params['maxTime'] / 1000)
+        params['minTime'] = _convert_to_datetime(params['minTime'])
+        params['maxTime'] = _convert_to_datetime(params['maxTime'])
 
-        db_ret = self.metrics_dbi.aggr_user_numObjs(
+        user_ws = self._get_user_ws_monthly(
             params['user_ids'], params['minTime'], params['maxTime'])
+        db_ret = self._format_user_ws_monthly(
+            user_ws, 'count_user_numObjs', 1)
 
         return {'metrics_result': db_ret}
 
@@ -1037,13 +1846,39 @@ class MetricsMongoDBController:
                              'invoke this action.')
 
         params = self._process_parameters(params)
-        params['minTime'] = datetime.datetime.fromtimestamp(
-            params['minTime'] / 1000)
-        params['maxTime'] = datetime.datetime.fromtimestamp(
-            params['maxTime'] / 1000)
+        params['minTime'] = _convert_to_datetime(params['minTime'])
+        params['maxTime'] = _convert_to_datetime(params['maxTime'])
 
-        db_ret = self.metrics_dbi.aggr_user_ws(
+        user_ws = self._get_user_ws_monthly(
             params['user_ids'], params['minTime'], params['maxTime'])
+        db_ret = self._format_user_ws_monthly(user_ws, 'count_user_ws', 0)
+
+        return {'metrics_result': db_ret}
+
+    def get_user_ws_metrics(self, requesting_user, params, token):
+        """
+        get_user_ws_metrics--the records of get_user_login_stats_from_ws,
+        get_user_numObjs_from_ws and get_user_ws_stats combined, from a
+        single pass over the workspaces (or their rollups)
+        """
+        if not self._is_admin(requesting_user):
+            raise ValueError('You do not have permisson to '
+                             'invoke this action.')
+
+        params = self._process_parameters(params)
+        params['minTime'] = _convert_to_datetime(params['minTime'])
+        params['maxTime'] = _convert_to_datetime(params['maxTime'])
+
+        user_ws = self._get_user_ws_monthly(
+            params['user_ids'], params['minTime'], params['maxTime'])
+        db_ret = self._format_user_ws_monthly(
+            user_ws, 'year_mon_user_logins', 0)
+        for u_ws in db_ret:
+            ws_count, num_objs = user_ws[(u_ws['_id']['username'],
+                                          u_ws['_id']['year'],
+                                          u_ws['_id']['month'])]
+            u_ws['count_user_numObjs'] = num_objs
+            u_ws['count_user_ws'] = ws_count
 
         return {'metrics_result': db_ret}
 
@@ -1053,23 +1888,260 @@ class MetricsMongoDBController:
     def update_metrics(self, requesting_user, params, token):
         """
         update_metrics--updates the metrics db collections
+        With parallel, the user, activity and narrative stages run
+        concurrently; a stage that fails does not stop the others, its
+        updates are reported as None and its error under stage_errors.
         """
         if not self._is_metrics_admin(requesting_user):
             raise ValueError('You do not have permission to '
                              'invoke this action.')
 
-        # 1. update users
-        action_result1 = self._update_user_info(params, token)
+        update_counts = {'users': dict(), 'activities': dict(),
+                         'narratives': dict()}
+        if params.get('backfill_chunk_days'):
+            results = self._backfill_metrics(params, token, update_counts)
+            # the cached reports may be out of date now
+            self.report_cache.clear()
+            return {'metrics_result': results}
+
+        if self.job_states_materialized:
+            update_counts['job_states'] = dict()
+        results = {'update_counts': update_counts, 'stage_times': dict()}
+
+        if params.get('incremental'):
+            results['watermarks'] = dict()
+            stages = self._incremental_update_stages(
+                params, token, update_counts, results['watermarks'])
+        else:
+            # every stage covers the same time range
+            params = self._process_parameters(params)
+            stage_params = {'user_ids': params['user_ids'],
+                            'epoch_range': (params['minTime'],
+                                            params['maxTime'])}
+            stages = [
+                # 1. update users
+                ('users', 'user_updates',
+                 lambda: self._update_user_info(
+                     dict(stage_params), token, update_counts['users'])),
+                # 2. update activities
+                ('activities', 'activity_updates',
+                 lambda: self._update_daily_activities(
+                     dict(stage_params), token, update_counts['activities'])),
+                # 3. update narratives
+                ('narratives', 'narrative_updates',
+                 lambda: self._update_narratives(
+                     dict(stage_params), token, update_counts['narratives']))]
+        if self.job_states_materialized:
+            # bring the assembled jobs of query_jobs up to date
+            stages.append(('job_states', 'job_state_updates',
+                           lambda: self._build_job_states(
+                               token, update_counts['job_states'])))
+        # 4. rebuild the rollups read by the workspace reporting methods
+        stages.append(('workspace_rollups', 'workspace_rollups',
+                       self._update_workspace_rollups))
+
+        if params.get('parallel'):
+            self._run_update_stages_parallel(stages, results)
+        else:
+            for stage, result_key, run_stage in stages:
+                results[result_key], results['stage_times'][stage] = \
+                    self._run_timed(run_stage)
 
-        # 2. update activities
-        action_result2 = self._update_daily_activities(params, token)
+        # the cached reports may be out of date now
+        self.report_cache.clear()
+        return {'metrics_result': results}
 
-        # 3. update narratives
-        action_result3 = self._update_narratives(params, token)
+    def _run_timed(self, run_stage):
+        """
+        _run_timed--run the stage; returns its result and its run time
+        in milliseconds
+        """
+        start = time.time()
+        stage_ret = run_stage()
+        return stage_ret, round((time.time() - start) * 1000)
 
-        return {'metrics_result': {'user_updates': action_result1,
-                                   'activity_updates': action_result2,
-                                   'narrative_updates': action_result3}}
+    def _run_update_stages_parallel(self, stages, results):
+        """
+        _run_update_stages_parallel--run the update stages on a thread pool
+        of at most update_max_workers threads and collect their results,
+        times and errors into results
+        """
+        stage_errors = dict()
+        with ThreadPoolExecutor(max_workers=self.update_max_workers,
+                                thread_name_prefix='update_metrics') as pool:
+            futures = [(stage, result_key,
+                        pool.submit(self._run_timed, run_stage))
+                       for stage, result_key, run_stage in stages]
+            for stage, result_key, future in futures:
+                try:
+                    results[result_key], results['stage_times'][stage] = \
+                        future.result()
+                except Exception as ex:
+                    print('update_metrics stage {} failed: {}'.format(
+                        stage, ex))
+                    results[result_key] = None
+                    stage_errors[stage] = str(ex)
+        if stage_errors:
+            results['stage_errors'] = stage_errors
+
+    def _split_time_range(self, min_time, max_time, chunk_millis):
+        """
+        _split_time_range--split the time range (in milliseconds) into
+        consecutive, non-overlapping (start, end) windows of at most
+        chunk_millis each; the windows include both of their ends
+        """
+        windows = []
+        start = min_time
+        while start <= max_time:
+            end = min(start + chunk_millis - 1, max_time)
+            windows.append((start, end))
+            start = end + 1
+        return windows
+
+    def _backfill_metrics(self, params, token, update_counts):
+        """
+        _backfill_metrics--run the update stages over a long epoch_range
+        in chunks of backfill_chunk_days days, so that only the records of
+        the chunks being processed are held in memory at any time. Chunks
+        run one at a time or, with parallel, update_max_workers at a time;
+        a failed chunk does not stop the others and is reported with its
+        error so it can be run again. The progress and throughput of each
+        chunk is printed as it completes and returned under chunks.
+        """
+        if params.get('incremental'):
+            raise ValueError('A backfill cannot be incremental.')
+        chunk_days = int(params['backfill_chunk_days'])
+        if chunk_days < 1:
+            raise ValueError('backfill_chunk_days must be at least 1.')
+        params = self._process_parameters(params)
+        if params['minTime'] > params['maxTime']:
+            raise ValueError('Invalid epoch_range for a backfill: the start '
+                             'is after the end.')
+
+        # chunks start at midnight UTC so that no day's activity counts
+        # are split between two chunks
+        first_day = params['minTime'] - params['minTime'] % DAY_MILLIS
+        chunks = self._split_time_range(first_day, params['maxTime'],
+                                        chunk_days * DAY_MILLIS)
+        chunks[0] = (params['minTime'], chunks[0][1])
+
+        def run_chunk(chunk):
+            chunk_params = {'user_ids': params['user_ids'],
+                            'epoch_range': chunk}
+            chunk_counts = {stage: dict() for stage in update_counts}
+            start = time.time()
+            chunk_ret = {
+                'epoch_range': list(chunk),
+                'user_updates': self._update_user_info(
+                    dict(chunk_params), token, chunk_counts['users']),
+                'activity_updates': self._update_daily_activities(
+                    dict(chunk_params), token, chunk_counts['activities']),
+                'narrative_updates': self._update_narratives(
+                    dict(chunk_params), token, chunk_counts['narratives'])}
+            elapsed = time.time() - start
+            upd_count = (chunk_ret['user_updates'] +
+                         chunk_ret['activity_updates'] +
+                         chunk_ret['narrative_updates'])
+            chunk_ret['time_ms'] = round(elapsed * 1000)
+            chunk_ret['updates_per_second'] = round(
+                upd_count / elapsed if elapsed > 0 else 0, 1)
+            return chunk_ret, chunk_counts
+
+        results = {'user_updates': 0, 'activity_updates': 0,
+                   'narrative_updates': 0, 'update_counts': update_counts,
+                   'chunks': [None] * len(chunks)}
+        max_workers = self.update_max_workers if params.get('parallel') else 1
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix='backfill') as pool:
+            futures = {pool.submit(run_chunk, chunk): i
+                       for i, chunk in enumerate(chunks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                try:
+                    chunk_ret, chunk_counts = future.result()
+                except Exception as ex:
+                    chunk_ret = {'epoch_range': list(chunks[i]),
+                                 'error': str(ex)}
+                    print('update_metrics backfill: chunk {}/{} {} '
+                          'failed: {}'.format(done, len(chunks),
+                                              chunks[i], ex))
+                else:
+                    for result_key in ('user_updates', 'activity_updates',
+                                       'narrative_updates'):
+                        results[result_key] += chunk_ret[result_key]
+                    for stage, counts in chunk_counts.items():
+                        for count_key, count in counts.items():
+                            update_counts[stage][count_key] = \
+                                update_counts[stage].get(count_key, 0) + count
+                    print('update_metrics backfill: chunk {}/{} {} done '
+                          'in {}ms, {} updates/s'.format(
+                              done, len(chunks), chunks[i],
+                              chunk_ret['time_ms'],
+                              chunk_ret['updates_per_second']))
+                results['chunks'][i] = chunk_ret
+        results['workspace_rollups'] = self._update_workspace_rollups()
+        return results
+
+    def _incremental_update_stages(self, params, token, update_counts,
+                                   watermarks):
+        """
+        _incremental_update_stages--the update stages, each running over
+        only what changed since the watermark it saved on its last run:
+        new signups and logins (auth2 create/login), modified workspace
+        objects (workspaceObjects moddate) and saved narratives (workspaces
+        moddate). A stage works through its range one checkpoint window
+        at a time and saves its watermark after each, so an interrupted
+        run resumes from the last completed window. The final watermark of
+        each stage is put in watermarks.
+        """
+        if params.get('user_ids'):
+            raise ValueError('Incremental updates cover all users; '
+                             'user_ids cannot be given.')
+        params = self._process_parameters(params)
+        window_millis = self.checkpoint_days * DAY_MILLIS
+
+        def incremental(stage, update_stage):
+            def run_stage():
+                # a stage without a watermark starts from the epoch_range
+                # start (by default, 48 hours ago)
+                watermark = self.metrics_dbi.get_watermark(stage)
+                if watermark is None:
+                    start = params['minTime']
+                else:
+                    start = watermark + 1
+                if stage == 'activities':
+                    # activities are counted per day, so a day is always
+                    # processed (and its counts replaced) as a whole
+                    start -= start % DAY_MILLIS
+
+                upd_count = 0
+                for w_start, w_end in self._split_time_range(
+                        start, params['maxTime'], window_millis):
+                    upd_count += update_stage(
+                        {'user_ids': [], 'epoch_range': (w_start, w_end)},
+                        update_counts[stage])
+                    self.metrics_dbi.set_watermark(stage, w_end)
+                    watermark = w_end
+                watermarks[stage] = watermark
+                return upd_count
+            return run_stage
+
+        def update_users(stage_params, counts):
+            return self._update_user_info(stage_params, token, counts,
+                                          include_logins=True)
+
+        def update_activities(stage_params, counts):
+            return self._update_daily_activities(stage_params, token, counts)
+
+        def update_narratives(stage_params, counts):
+            return self._update_narratives(stage_params, token, counts)
+
+        return [('users', 'user_updates',
+                 incremental('users', update_users)),
+                ('activities', 'activity_updates',
+                 incremental('activities', update_activities)),
+                ('narratives', 'narrative_updates',
+                 incremental('narratives', update_narratives))]
 
     # functions to get the requested records from metrics db...
     def get_active_users_counts(self, requesting_user,
@@ -1082,21 +2154,25 @@ class MetricsMongoDBController:
             raise ValueError('You do not have permisson to '
                              'invoke this action.')
 
-        kb_list = self._get_kbstaff_list()
-
         params = self._process_parameters(params)
+        # the user counts are of all users
+        params['user_ids'] = []
+
+        def run_report():
+            if exclude_kbstaff:
+                mt_ret = self.metrics_dbi.aggr_unique_users_per_day(
+                    params['minTime'], params['maxTime'],
+                    self._get_kbstaff_list())
+            else:
+                mt_ret = self.metrics_dbi.aggr_unique_users_per_day(
+                    params['minTime'], params['maxTime'], [])
 
-        if exclude_kbstaff:
-            mt_ret = self.metrics_dbi.aggr_unique_users_per_day(
-                params['minTime'], params['maxTime'], kb_list)
-        else:
-            mt_ret = self.metrics_dbi.aggr_unique_users_per_day(
-                params['minTime'], params['maxTime'], [])
-
-        if not mt_ret:
-            print("No active user count records returned!")
+            if not mt_ret:
+                print("No active user count records returned!")
+            return mt_ret
 
-        return {'metrics_result': mt_ret}
+        return self._cached_report('get_active_users_counts', params,
+                                   exclude_kbstaff, run_report)
 
     def get_user_details(self, requesting_user, params, token,
                          exclude_kbstaff=False):
@@ -1130,16 +2206,26 @@ class MetricsMongoDBController:
                              'invoke this action.')
 
         params = self._process_parameters(params)
-        if exclude_kbstaff:
-            kb_list = self._get_kbstaff_list()
-            mt_ret = self.metrics_dbi.aggr_signup_retn_users(
-                params['user_ids'], params['minTime'],
-                params['maxTime'], kb_list)
-        else:
-            mt_ret = self.metrics_dbi.aggr_signup_retn_users(
-                params['user_ids'], params['minTime'], params['maxTime'])
 
-        if not mt_ret:
-            print("No signup/returning user records returned!")
-        return {'metrics_result': mt_ret}
+        def run_report():
+            if exclude_kbstaff:
+                kb_list = self._get_kbstaff_list()
+            else:
+                kb_list = []
+            if params.get('bypass_cache'):
+                mt_ret = self.metrics_dbi.aggr_signup_retn_users(
+                    params['user_ids'], params['minTime'],
+                    params['maxTime'], kb_list)
+            else:
+                mt_ret = self._signup_retn_users_by_month(
+                    params['user_ids'], params['minTime'],
+                    params['maxTime'], kb_list,
+                    refresh=params.get('refresh_cache'))
+
+            if not mt_ret:
+                print("No signup/returning user records returned!")
+            return mt_ret
+
+        return self._cached_report('get_signup_retn_users', params,
+                                   exclude_kbstaff, run_report)
     # End functions to get the requested records from metrics db
@@ -0,0 +1,83 @@
+"""
+Compare the original per-job scan of the Catalog client groups (as in
+assemble_job), which lowercases every app id it compares, with the lookup
+in the client groups indexed by MetricsMongoDBController._index_client_groups,
+over a growing number of Catalog apps.
+
+    PYTHONPATH=lib python test/benchmarks/client_group_lookup.py [jobs]
+"""
+import random
+import sys
+import time
+
+from kb_Metrics.metricsdb_controller import MetricsMongoDBController
+
+
+def scan_client_groups(client_groups, app_id):
+    # the client group loop of assemble_job before the index
+    job_client_groups = ['njs']  # default client groups to 'njs'
+    if client_groups:
+        for clnt in client_groups:
+            clnt_app_id = clnt['app_id']
+            ujs_app_id = str(app_id)
+            if str(clnt_app_id).lower() == ujs_app_id.lower():
+                job_client_groups = clnt['client_groups']
+                break
+    return job_client_groups
+
+
+def synthetic_catalog(app_count, job_count):
+    rnd = random.Random(42)
+    client_groups = []
+    for i in range(app_count):
+        app_id = 'Module{}/run_App_{}'.format(i % 97, i)
+        client_groups.append({'app_id': app_id,
+                              'client_groups': [rnd.choice(
+                                  ['njs', 'bigmem', 'kb_upload'])]})
+        if i % 50 == 0:
+            # app ids differing only by case: the first one wins
+            client_groups.append({'app_id': app_id.upper(),
+                                  'client_groups': ['bigmemlong']})
+    client_groups.append({'app_id': None, 'client_groups': ['none']})
+
+    app_ids = []
+    for _ in range(job_count):
+        roll = rnd.random()
+        if roll < 0.8:
+            app_id = rnd.choice(client_groups)['app_id']
+            app_ids.append(app_id.lower() if app_id and roll < 0.4
+                           else app_id)
+        elif roll < 0.9:
+            app_ids.append('Unknown/app_{}'.format(rnd.randint(0, 100)))
+        else:
+            app_ids.append(None)
+    return client_groups, app_ids
+
+
+def main(job_count):
+    print('jobs: {}'.format(job_count))
+    print('{:>8} {:>10} {:>12} {:>10}'.format('apps', 'scan (s)',
+                                              'index (s)', 'speedup'))
+    for app_count in (100, 1000, 5000):
+        client_groups, app_ids = synthetic_catalog(app_count, job_count)
+
+        start = time.perf_counter()
+        expected = [scan_client_groups(client_groups, app_id)
+                    for app_id in app_ids]
+        scan_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cg_index = MetricsMongoDBController._index_client_groups(
+            client_groups)
+        found = [MetricsMongoDBController._app_client_groups(app_id,
+                                                             cg_index)
+                 for app_id in app_ids]
+        index_time = time.perf_counter() - start
+
+        assert found == expected
+        print('{:>8} {:>10.3f} {:>12.4f} {:>9.0f}x'.format(
+            app_count, scan_time, index_time, scan_time / index_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,121 @@
+"""
+Compare the exec tasks list_exec_tasks fetched with all of their job input
+with those projected by MongoMetricsDBI._EXEC_TASK_PROJECTION, over
+synthetic tasks with large params: the bytes mongo sends, the time to
+decode them, and the jobs assembled from them, which must be identical.
+The projection is applied here as mongo applies it.
+
+    PYTHONPATH=lib python test/benchmarks/exec_task_projection.py [count]
+"""
+import datetime
+import random
+import sys
+import time
+
+import bson
+from bson.objectid import ObjectId
+
+from kb_Metrics.metrics_dbi import MongoMetricsDBI
+from kb_Metrics.metricsdb_controller import MetricsMongoDBController
+
+
+def project(doc, projection):
+    # an inclusion projection of dotted paths, with {'$slice': n} on arrays
+    projected = dict()
+    for path, spec in projection.items():
+        if not spec:
+            continue
+        src, dest = doc, projected
+        fields = path.split('.')
+        for field in fields[:-1]:
+            src = src.get(field)
+            if not isinstance(src, dict):
+                break
+            dest = dest.setdefault(field, dict())
+        else:
+            if fields[-1] in src:
+                value = src[fields[-1]]
+                if isinstance(spec, dict) and isinstance(value, list):
+                    value = value[:spec['$slice']]
+                dest[fields[-1]] = value
+    return projected
+
+
+def synthetic_tasks(count, params_size):
+    rnd = random.Random(42)
+    ujs_jobs = []
+    exec_tasks = []
+    for i in range(count):
+        job_id = ObjectId('{:024x}'.format(0x5a0000000000000000000000 + i))
+        created = datetime.datetime(2018, 1, 1) + datetime.timedelta(hours=i)
+        ujs_jobs.append({'_id': job_id, 'user': 'user{}'.format(i % 100),
+                         'created': created, 'updated': created,
+                         'complete': True, 'error': False, 'status': 'done',
+                         'authstrat': 'DEFAULT', 'authparam': 'DEFAULT',
+                         'desc': ''})
+        params = [{'workspace': 'ws_{}'.format(i % 500),
+                   'ws_id': i % 500 + 1,
+                   'reads': ['read_{}_{}'.format(i, j)
+                             for j in range(params_size)]}]
+        # the other params of a job are never read by the assembly
+        params.extend({'options': 'x' * params_size * 10,
+                       'values': list(range(params_size))}
+                      for _ in range(rnd.randint(1, 3)))
+        job_input = {'app_id': 'Module/app_{}'.format(i % 30),
+                     'method': 'Module.method_{}'.format(i % 20),
+                     'service_ver': 'dev', 'params': params,
+                     'meta': {'tag': 'release', 'cell_id': str(i),
+                              'run_id': 'run_{}'.format(i)},
+                     'requested_release': None}
+        if rnd.random() < 0.5:
+            job_input['wsid'] = i % 500 + 1
+        exec_tasks.append({'_id': ObjectId(), 'app_job_id': str(i),
+                           'ujs_job_id': str(job_id),
+                           'creation_time': i, 'job_input': job_input,
+                           'job_output': {'result': ['x' * 100]}})
+    return ujs_jobs, exec_tasks
+
+
+def assemble(ujs_jobs, exec_tasks):
+    controller = MetricsMongoDBController.__new__(MetricsMongoDBController)
+    ws_info_map = {ws_id: (ws_id, 'ws_{}'.format(ws_id))
+                   for ws_id in range(1, 501)}
+    exec_task_map = {exec_task['ujs_job_id']: exec_task
+                     for exec_task in exec_tasks}
+    return [controller.assemble_job(ujs_job, exec_task_map, ws_info_map)
+            for ujs_job in ujs_jobs]
+
+
+def timed_decode(encoded):
+    start = time.perf_counter()
+    decoded = [bson.decode(data) for data in encoded]
+    return decoded, time.perf_counter() - start
+
+
+def main(count):
+    full_projection = {'_id': 0, 'app_job_id': 1, 'ujs_job_id': 1,
+                       'creation_time': 1, 'job_input': 1}
+    print('exec tasks: {}'.format(count))
+    print('{:>7} {:>12} {:>12} {:>11} {:>11}'.format(
+        'params', 'full (MB)', 'projected', 'full (s)', 'projected'))
+    for params_size in (10, 100, 1000):
+        ujs_jobs, exec_tasks = synthetic_tasks(count, params_size)
+        full = [bson.encode(project(task, full_projection))
+                for task in exec_tasks]
+        projected = [bson.encode(project(
+            task, MongoMetricsDBI._EXEC_TASK_PROJECTION))
+            for task in exec_tasks]
+
+        full_tasks, full_time = timed_decode(full)
+        projected_tasks, projected_time = timed_decode(projected)
+        assert (assemble(ujs_jobs, projected_tasks) ==
+                assemble(ujs_jobs, full_tasks))
+
+        mb = 1024.0 * 1024.0
+        print('{:>7} {:>12.2f} {:>12.2f} {:>11.3f} {:>11.3f}'.format(
+            params_size, sum(map(len, full)) / mb,
+            sum(map(len, projected)) / mb, full_time, projected_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
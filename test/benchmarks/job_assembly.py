@@ -0,0 +1,392 @@
+"""
+Compare the job assembly of query_jobs and get_jobs as it was, a deep copy
+of each jobstate document popped and overwritten in place, with the
+copy-free MetricsMongoDBController.assemble_job and _assemble_ujs_state,
+which build each job as a new dict, over synthetic jobstate documents and
+exec tasks. The assembled jobs must be identical.
+
+    PYTHONPATH=lib python test/benchmarks/job_assembly.py [count ...]
+"""
+import copy
+import datetime
+import random
+import sys
+import time
+
+from bson.objectid import ObjectId
+
+from kb_Metrics.metricsdb_controller import MetricsMongoDBController
+
+
+def deepcopy_assemble_ujs_state(self, ujs, exec_task_map,
+                                narr_info_map=None):
+    # _assemble_ujs_state before the copy-free assembly
+    u_j_s = copy.deepcopy(ujs)
+    u_j_s['job_id'] = str(u_j_s.pop('_id'))
+
+    # determine true job state
+    job_state = None
+    if u_j_s.get('complete', False):
+        if u_j_s.get('error', False):
+            # hmm, this does not seem reliable
+            # if u_j_s.get('status', None) == 'queued':
+            if u_j_s.get('started'):
+                job_state = 'ERRORED_RUNNING'
+            else:
+                job_state = 'ERRORED_QUEUED'
+        else:
+            if u_j_s.get('status', None) == 'done':
+                job_state = 'FINISHED'
+            elif u_j_s.get('status', '').startswith('canceled'):
+                if 'started' in u_j_s:
+                    job_state = 'CANCELED_RUNNING'
+                else:
+                    job_state = 'CANCELED_QUEUED'
+            elif u_j_s.get('status', None) == 'Unknown error':
+                if u_j_s.get('started'):
+                    job_state = 'ERRORED_RUNNING'
+                else:
+                    job_state = 'ERRORED_QUEUED'
+            else:
+                job_state = 'ERRORED'
+                if u_j_s.get('started'):
+                    job_state = 'ERRORED_RUNNING'
+                else:
+                    job_state = 'ERRORED_QUEUED'
+    else:
+        if 'status' not in u_j_s or u_j_s.get('status', None) == 'queued':
+            job_state = 'QUEUED'
+        else:
+            job_state = 'RUNNING'
+    u_j_s['state'] = job_state
+
+    if u_j_s.get('started'):
+        u_j_s['exec_start_time'] = u_j_s.pop('started', None)
+    u_j_s['creation_time'] = u_j_s.pop('created')
+    u_j_s['modification_time'] = u_j_s.pop('updated')
+
+    authparam = u_j_s.pop('authparam')
+    authstrat = u_j_s.pop('authstrat')
+    if authstrat == 'kbaseworkspace':
+        u_j_s['wsid'] = authparam
+
+    if u_j_s.get('desc'):
+        desc = u_j_s.pop('desc').split()[-1]
+        if '.' in desc:
+            u_j_s['method'] = desc
+
+    exec_task = exec_task_map.get(u_j_s['job_id'], None)
+    if exec_task is not None and 'job_input' in exec_task:
+        job_input = exec_task['job_input']
+
+        u_j_s['app_id'] = self._parse_app_id(job_input)
+        if not u_j_s.get('method'):
+            u_j_s['method'] = self._parse_method(job_input)
+
+        if not u_j_s.get('wsid'):
+            if 'wsid' in job_input:
+                u_j_s['wsid'] = job_input['wsid']
+            elif 'params' in job_input and job_input['params']:
+                p_ws = job_input['params'][0]
+                if isinstance(p_ws, dict) and 'ws_id' in p_ws:
+                    u_j_s['wsid'] = p_ws['ws_id']
+
+        # try to get workspace_name--first by wsid, then from 'job_input'
+        if u_j_s.get('wsid') and not u_j_s.get('workspace_name'):
+            ws_name = self._lookup_narrative_info(
+                u_j_s['wsid'], narr_info_map)[0]
+            u_j_s['workspace_name'] = ws_name
+        if (not u_j_s.get('workspace_name') or
+                u_j_s['workspace_name'] == ''):
+            if 'params' in job_input and job_input['params']:
+                p_ws = job_input['params'][0]
+                if isinstance(p_ws, dict):
+                    if 'workspace' in p_ws:
+                        u_j_s['workspace_name'] = p_ws['workspace']
+                    elif 'workspace_name' in p_ws:
+                        u_j_s['workspace_name'] = p_ws['workspace_name']
+
+    if not u_j_s.get('app_id') and u_j_s.get('method'):
+        u_j_s['app_id'] = u_j_s['method'].replace('.', '/')
+
+    # hmm, is finish_time sometimes populated and sometimes not?
+    # It should be present for any non-running job state -
+    # success, error, canceled
+    if (not u_j_s.get('finish_time') and
+            u_j_s.get('complete')):
+        u_j_s['finish_time'] = u_j_s.pop('modification_time')
+
+    # remove None u_j_s['workspace_name']
+    if ('workspace_name' in u_j_s and (u_j_s['workspace_name'] is None
+                                       or u_j_s['workspace_name'] == '')):
+        u_j_s.pop('workspace_name')
+
+    # get the narrative name and version via u_j_s['wsid']
+    job_type = None
+    if u_j_s.get('wsid'):
+        w_nm, n_name, n_ver, is_deleted = self._lookup_narrative_info(
+            u_j_s['wsid'], narr_info_map)
+        if w_nm is None:
+            # not found
+            job_type = 'workspace'
+        else:
+            job_type = 'narrative'
+            u_j_s['narrative_is_deleted'] = is_deleted
+            u_j_s['narrative_name'] = n_name
+            u_j_s['narrative_objNo'] = n_ver
+    else:
+        if 'app_id' in u_j_s:
+            if 'export' in u_j_s['app_id']:
+                job_type = 'export'
+                u_j_s['narrative_name'] = \
+                    'Narrative Unknown for Export Job'
+            else:
+                job_type = 'unknown'
+
+    u_j_s['job_type'] = job_type
+
+    # get the client groups
+    u_j_s['client_groups'] = ['njs']  # default client groups to 'njs'
+    if self.client_groups:
+        for clnt in self.client_groups:
+            clnt_id = clnt['app_id']
+            ujs_a_id = str(u_j_s.get('app_id'))
+            if str(clnt_id).lower() == ujs_a_id.lower():
+                u_j_s['client_groups'] = clnt['client_groups']
+                break
+    return u_j_s
+
+
+def deepcopy_assemble_job(self, ujs_job, exec_task_map, ws_info_map=None):
+    # assemble_job before the copy-free assembly, with its wsid fix
+    job = copy.deepcopy(ujs_job)
+    job['job_id'] = str(job.pop('_id'))
+
+    # determine true job state
+    job_state = None
+    if job.get('complete', False):
+        if job.get('error', False):
+            job_state = 'error'
+        else:
+            if job.get('status', None) == 'done':
+                job_state = 'complete'
+            elif job.get('status', '').startswith('canceled'):
+                job_state = 'cancel'
+            elif job.get('status', None) == 'Unknown error':
+                job_state = 'error'
+            else:
+                job_state = 'error'
+    else:
+        if 'status' not in job or job.get('status', None) == 'queue':
+            job_state = 'queue'
+        else:
+            job_state = 'run'
+
+    job['state'] = job_state
+
+    # TODO: I don't know what is happening here. This section needs lots of
+    # docs to explain the workarounds.
+    if job_state != 'error':
+        job['exec_start_time'] = job.pop('started', None)
+
+    job['creation_time'] = job.pop('created')
+    job['modification_time'] = job.pop('updated')
+
+    authparam = job.pop('authparam')
+    authstrat = job.pop('authstrat')
+    if authstrat == 'kbaseworkspace':
+        job['wsid'] = authparam
+
+    if job.get('desc'):
+        desc = job.pop('desc').split()[-1]
+        if '.' in desc:
+            job['method'] = desc
+
+    # Now merge in info from the exec_task, if available.
+    exec_task = exec_task_map.get(job['job_id'], None)
+    if exec_task is not None and 'job_input' in exec_task:
+        job_input = exec_task['job_input']
+
+        # Attempt to extract the app id from the job input.
+        job['app_id'] = self._parse_app_id(job_input)
+
+        # The app tag used is stored mysteriously in the 'meta' property.
+        meta = job_input.get('meta')
+
+        if meta:
+            job['app_tag'] = meta.get('tag')
+        else:
+            job['app_tag'] = None
+
+        # Attempt to get the method from the job input.
+        if not job.get('method'):
+            job['method'] = self._parse_method(job_input)
+
+        if not job.get('wsid'):
+            if 'wsid' in job_input:
+                job['wsid'] = job_input['wsid']
+            elif 'params' in job_input and job_input['params']:
+                p_ws = job_input['params'][0]
+                if isinstance(p_ws, dict) and 'ws_id' in p_ws:
+                    job['wsid'] = p_ws['ws_id']
+
+        # try to get workspace_name--first by wsid, then from 'job_input'
+        if job.get('wsid') and not job.get('workspace_name'):
+            if ws_info_map is not None and job['wsid'] in ws_info_map:
+                ws_id, ws_name = ws_info_map[job['wsid']]
+            else:
+                ws_id, ws_name = self.get_workspace_info(job['wsid'])
+            job['workspace_name'] = ws_name
+            job['wsid'] = ws_id
+
+        # If we _still_ don't have a workspace name (due to not having a
+        # wsid??) get it out of the params.
+        if not job.get('workspace_name') or job['workspace_name'] == '':
+            if 'params' in job_input and job_input['params']:
+                p_ws = job_input['params'][0]
+                if isinstance(p_ws, dict):
+                    if 'workspace' in p_ws:
+                        job['workspace_name'] = p_ws['workspace']
+                    elif 'workspace_name' in p_ws:
+                        job['workspace_name'] = p_ws['workspace_name']
+    else:
+        job['app_tag'] = None
+
+    # If we don't have an app id but we do have a method, we munge the
+    # method into the app id.
+    # TODO: not sure this is safe.
+    if not job.get('app_id') and job.get('method'):
+        job['app_id'] = job['method'].replace('.', '/')
+
+    # hmm, is finish_time sometimes populated and sometimes not?
+    # It should be present for any non-running job state -
+    # success, error, canceled
+    if (not job.get('finish_time') and
+            job.get('complete')):
+        job['finish_time'] = job.pop('modification_time')
+
+    # remove empty workspace name in job['workspace_name']
+    if ('workspace_name' in job and (job['workspace_name'] is None
+                                     or job['workspace_name'] == '')):
+        job.pop('workspace_name')
+
+    # get the client groups
+    job['client_groups'] = ['njs']  # default client groups to 'njs'
+    if self.client_groups:
+        for clnt in self.client_groups:
+            clnt_app_id = clnt['app_id']
+            ujs_app_id = str(job.get('app_id'))
+            if str(clnt_app_id).lower() == ujs_app_id.lower():
+                job['client_groups'] = clnt['client_groups']
+                break
+
+    return job
+
+
+def synthetic_jobs(count):
+    rnd = random.Random(42)
+    start = datetime.datetime(2018, 1, 1)
+    statuses = ['done', 'queued', 'running', 'canceled by user',
+                'Unknown error', 'an error occurred']
+    ujs_jobs = []
+    exec_tasks = []
+    for i in range(count):
+        job_id = ObjectId('{:024x}'.format(0x5a0000000000000000000000 + i))
+        created = start + datetime.timedelta(minutes=i)
+        ujs_job = {'_id': job_id, 'user': 'user{}'.format(i % 100),
+                   'created': created,
+                   'updated': created + datetime.timedelta(minutes=5),
+                   'status': rnd.choice(statuses),
+                   'complete': rnd.random() < 0.8,
+                   'error': rnd.random() < 0.1,
+                   'authstrat': 'DEFAULT', 'authparam': 'DEFAULT',
+                   'desc': 'Execution engine job for Module.method_{}'.format(
+                       i % 20)}
+        if rnd.random() < 0.7:
+            ujs_job['started'] = created + datetime.timedelta(minutes=1)
+        if rnd.random() < 0.5:
+            ujs_job['authstrat'] = 'kbaseworkspace'
+            ujs_job['authparam'] = str(i % 500 + 1)
+        ujs_jobs.append(ujs_job)
+
+        if rnd.random() < 0.9:
+            job_input = {'app_id': 'Module/app_{}'.format(i % 30),
+                         'method': 'Module/method_{}'.format(i % 20),
+                         'meta': {'tag': rnd.choice(['release', 'beta'])},
+                         'params': [{'workspace': 'ws_{}'.format(i % 500),
+                                     'ws_id': i % 500 + 1,
+                                     'reads': ['r{}'.format(j)
+                                               for j in range(10)]}]}
+            if rnd.random() < 0.3:
+                job_input['wsid'] = i % 500 + 1
+            exec_tasks.append({'ujs_job_id': str(job_id),
+                               'job_input': job_input})
+    return ujs_jobs, exec_tasks
+
+
+def synthetic_controllers():
+    # the deep copy assembly scans the Catalog client groups of the
+    # controller, the new one looks them up in their index, which it is
+    # given along with each job
+    client_groups = [
+        {'app_id': 'module/app_{}'.format(i),
+         'client_groups': ['njs', 'bigmem'] if i % 3 else ['kb_upload']}
+        for i in range(30)]
+    old_controller = MetricsMongoDBController.__new__(
+        MetricsMongoDBController)
+    old_controller.client_groups = client_groups
+    controller = MetricsMongoDBController.__new__(MetricsMongoDBController)
+    cg_index = MetricsMongoDBController._index_client_groups(client_groups)
+    return old_controller, controller, cg_index
+
+
+def with_client_groups(assemble, client_groups):
+    def assemble_with(self, ujs_job, exec_task_map, info_map):
+        return assemble(self, ujs_job, exec_task_map, info_map,
+                        client_groups)
+    return assemble_with
+
+
+def timed(assemble, controller, ujs_jobs, exec_task_map, info_map):
+    start = time.perf_counter()
+    jobs = [assemble(controller, ujs_job, exec_task_map, info_map)
+            for ujs_job in ujs_jobs]
+    return jobs, time.perf_counter() - start
+
+
+def main(counts):
+    old_controller, controller, cg_index = synthetic_controllers()
+    ws_info_map = {ws_id: (ws_id, 'ws_{}'.format(ws_id))
+                   for ws_id in list(range(1, 501)) +
+                   [str(ws_id) for ws_id in range(1, 501)]}
+    narr_info_map = {ws_id: ('ws_{}'.format(ws_id), 'Narrative {}'.format(
+        ws_id), '1', False) for ws_id in ws_info_map}
+    assemblies = [
+        ('assemble_job', deepcopy_assemble_job,
+         with_client_groups(MetricsMongoDBController.assemble_job, cg_index),
+         ws_info_map),
+        ('_assemble_ujs_state', deepcopy_assemble_ujs_state,
+         with_client_groups(MetricsMongoDBController._assemble_ujs_state,
+                            cg_index),
+         narr_info_map)]
+
+    print('{:>20} {:>8} {:>12} {:>12} {:>8}'.format(
+        'assembly', 'jobs', 'deepcopy (s)', 'new (s)', 'speedup'))
+    for count in counts:
+        ujs_jobs, exec_tasks = synthetic_jobs(count)
+        exec_task_map = {exec_task['ujs_job_id']: exec_task
+                         for exec_task in exec_tasks}
+        for name, old_assemble, new_assemble, info_map in assemblies:
+            expected, old_time = timed(old_assemble, old_controller,
+                                       ujs_jobs, exec_task_map, info_map)
+            before = copy.deepcopy(ujs_jobs)
+            jobs, new_time = timed(new_assemble, controller, ujs_jobs,
+                                   exec_task_map, info_map)
+            assert jobs == expected
+            assert ujs_jobs == before
+            print('{:>20} {:>8} {:>12.3f} {:>12.3f} {:>7.1f}x'.format(
+                name, count, old_time, new_time, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,77 @@
+"""
+Compare the memory use and lookup time of the narrative map held as a
+dict of tuples (the original NarrativeCache representation) and as a
+PackedNarrativeMap, over synthetic workspaces.
+
+    PYTHONPATH=lib python test/benchmarks/narrative_map_memory.py [count]
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+from kb_Metrics.PackedNarrativeMap import PackedNarrativeMap, pack_narratives
+
+
+def synthetic_narratives(count):
+    rnd = random.Random(42)
+    users = ['user{}'.format(i) for i in range(count // 20 + 1)]
+    narratives = dict()
+    for ws_id in range(1, count + 1):
+        user = rnd.choice(users)
+        ws_nm = '{}:narrative_{}'.format(user, 1500000000000 + ws_id)
+        if rnd.random() < 0.3:
+            narr_nm = 'Untitled'
+        else:
+            narr_nm = 'Narrative {} of {}'.format(ws_id, user)
+        narr_ver = str(rnd.choice([1, 1, 1, 2, 5, 17, 45]))
+        narratives[ws_id * 3] = (ws_nm, narr_nm, narr_ver,
+                                 rnd.random() < 0.1)
+    return narratives
+
+
+def measure(build):
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def time_lookups(narrative_map, keys):
+    start = time.perf_counter()
+    for key in keys:
+        narrative_map.get(key)
+    return time.perf_counter() - start
+
+
+def main(count):
+    # build the source data outside of the measurement, with fresh string
+    # objects so the dict does not share them with the source
+    source = synthetic_narratives(count)
+    items = sorted(source.items())
+
+    as_dict, dict_size = measure(lambda: {
+        ws_id: tuple(''.join(v) if isinstance(v, str) else v
+                     for v in narr_info)
+        for ws_id, narr_info in items})
+    packed, packed_size = measure(
+        lambda: PackedNarrativeMap(pack_narratives(items, 0)))
+
+    assert dict(packed) == as_dict
+
+    keys = [random.randrange(count * 3) for _ in range(200000)]
+    dict_time = time_lookups(as_dict, keys)
+    packed_time = time_lookups(packed, keys)
+
+    print('narratives: {}'.format(count))
+    print('dict:   {:8.1f} MB  {:5.0f} bytes/entry  lookup {:.2f} us'.format(
+        dict_size / 1e6, dict_size / count, dict_time / len(keys) * 1e6))
+    print('packed: {:8.1f} MB  {:5.0f} bytes/entry  lookup {:.2f} us'.format(
+        packed_size / 1e6, packed_size / count,
+        packed_time / len(keys) * 1e6))
+    print('memory ratio: {:.1f}x'.format(dict_size / packed_size))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300000)
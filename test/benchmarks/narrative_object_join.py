@@ -0,0 +1,93 @@
+"""
+Compare the original nested-loop matching of narrative workspaces to their
+narrative objects (as in _get_narratives_from_wsobjs) with the indexed join
+MetricsMongoDBController._join_narrative_objects, over synthetic workspaces
+and a growing number of workspace objects.
+
+    PYTHONPATH=lib python test/benchmarks/narrative_object_join.py [count]
+"""
+import copy
+import random
+import re
+import sys
+import time
+
+from kb_Metrics.metricsdb_controller import MetricsMongoDBController
+
+
+def nested_loop_join(ws_narrs, wsobjs):
+    # the matching loop of _get_narratives_from_wsobjs before the join
+    ws_narrs1 = []
+    for wsn in ws_narrs:
+        for obj in wsobjs:
+            if wsn['workspace_id'] == obj['workspace_id']:
+                if wsn['name'] == obj['object_name']:
+                    wsn['object_id'] = obj['object_id']
+                    wsn['object_version'] = obj['object_version']
+                    break
+                elif ':' in wsn['name']:
+                    wts = wsn['name'].split(':')[1]
+                    if '_' in wts:
+                        wts = wts.split('_')[1]
+                    p = re.compile(wts, re.IGNORECASE)
+                    if p.search(obj['object_name']):
+                        wsn['object_id'] = obj['object_id']
+                        wsn['object_version'] = obj['object_version']
+                        break
+        if wsn.get('object_id'):
+            ws_narrs1.append(wsn)
+    return ws_narrs1
+
+
+def synthetic_workspaces(ws_count, obj_count):
+    rnd = random.Random(42)
+    ws_narrs = []
+    for ws_id in range(1, ws_count + 1):
+        if rnd.random() < 0.1:
+            name = 'user{}:{}'.format(ws_id % 50, 1468000000000 + ws_id)
+        else:
+            name = 'user{}:narrative_{}'.format(ws_id % 50,
+                                                1500000000000 + ws_id)
+        ws_narrs.append({'workspace_id': ws_id, 'name': name})
+
+    wsobjs = []
+    for obj_id in range(1, obj_count + 1):
+        wsn = rnd.choice(ws_narrs)
+        roll = rnd.random()
+        if roll < 0.05:
+            obj_name = wsn['name']
+        elif roll < 0.15:
+            obj_name = 'Narrative.' + wsn['name'].split('_')[-1]
+        else:
+            obj_name = 'genome_{}'.format(obj_id)
+        wsobjs.append({'workspace_id': wsn['workspace_id'],
+                       'object_id': obj_id, 'object_name': obj_name,
+                       'object_version': rnd.randint(1, 20)})
+    return ws_narrs, wsobjs
+
+
+def timed(join, ws_narrs, wsobjs):
+    ws_narrs = copy.deepcopy(ws_narrs)
+    start = time.perf_counter()
+    joined = join(ws_narrs, wsobjs)
+    return joined, time.perf_counter() - start
+
+
+def main(ws_count):
+    print('narrative workspaces: {}'.format(ws_count))
+    print('{:>8} {:>12} {:>12} {:>8}'.format('objects', 'nested (s)',
+                                             'indexed (s)', 'speedup'))
+    for obj_count in (ws_count, ws_count * 4, ws_count * 16):
+        ws_narrs, wsobjs = synthetic_workspaces(ws_count, obj_count)
+        expected, nested_time = timed(nested_loop_join, ws_narrs, wsobjs)
+        joined, indexed_time = timed(
+            MetricsMongoDBController._join_narrative_objects,
+            ws_narrs, wsobjs)
+        assert joined == expected
+        print('{:>8} {:>12.3f} {:>12.3f} {:>7.0f}x'.format(
+            obj_count, nested_time, indexed_time,
+            nested_time / indexed_time))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
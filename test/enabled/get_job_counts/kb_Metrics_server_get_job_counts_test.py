@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import json  # noqa: F401
+import os  # noqa: F401
+import threading
+from kb_Metrics.ResultCache import JobCountCache
+from kb_Metrics.Test import Test
+
+TOTAL_COUNT = 48
+
+
+class kb_Metrics_get_job_counts_Test(Test):
+
+    def get_job_counts(self, params):
+        ret = self.getImpl().get_job_counts(self.getContext(), params)
+        self.assertEqual(len(ret), 1)
+        self.assertIsInstance(ret[0], dict)
+        return ret[0]
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_get_job_counts")
+    def test_run_MetricsImpl_get_job_counts(self):
+        result = self.get_job_counts({})
+        self.assertEqual(result, {'user_counts': {},
+                                  'total_count': TOTAL_COUNT})
+
+        result = self.get_job_counts(
+            {'user_ids': ['psdehal', 'eapearson', 'nobody']})
+        self.assertEqual(result['user_counts'],
+                         {'psdehal': 1, 'eapearson': 11, 'nobody': 0})
+        self.assertEqual(result['total_count'], TOTAL_COUNT)
+
+        # the counts agree with those of query_jobs_admin
+        ret = self.getImpl().query_jobs_admin(self.getContext(), {
+            'filter': {'user_id': ['eapearson']}, 'skip_counts': 1})
+        self.assertIsNone(ret[0]['total_count'])
+        self.assertEqual(len(ret[0]['job_states']), 11)
+        ret = self.getImpl().query_jobs_admin(self.getContext(), {})
+        self.assertEqual(ret[0]['total_count'], TOTAL_COUNT)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_get_job_counts_not_admin")  # noqa E501
+    def test_run_MetricsImpl_get_job_counts_not_admin(self):
+        # a user who is not an admin counts only their own jobs
+        token = self.getContext()['token']
+        result = self.db_controller.get_job_counts('user_joe', {}, token)
+        self.assertEqual(result, {'user_counts': {}, 'total_count': 0})
+        result = self.db_controller.get_job_counts(
+            'user_joe', {'user_ids': ['user_joe']}, token)
+        self.assertEqual(result, {'user_counts': {'user_joe': 0},
+                                  'total_count': 0})
+
+        err_msg = 'You do not have permisson to invoke this action.'
+        with self.assertRaisesRegex(ValueError, err_msg):
+            self.db_controller.get_job_counts(
+                'user_joe', {'user_ids': ['psdehal']}, token)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_JobCountCache_single_flight")
+    def test_JobCountCache_single_flight(self):
+        # while one request recounts, the others are served the previous
+        # counts without waiting for it
+        class SlowCounts:
+            def __init__(self):
+                self.started = threading.Event()
+                self.release = threading.Event()
+                self.calls = 0
+
+            def aggr_ujs_user_counts(self, after_id=None):
+                self.calls += 1
+                if self.calls > 1:
+                    self.started.set()
+                    self.release.wait(10)
+                return {'psdehal': self.calls}, self.calls
+
+        dbi = SlowCounts()
+        job_counts = JobCountCache(dbi, ttl=1, recount_interval=0)
+        self.assertEqual(job_counts.get(['psdehal']), ({'psdehal': 1}, 1))
+
+        results = []
+        recount = threading.Thread(
+            target=lambda: results.append(job_counts.get(['psdehal'])))
+        recount.start()
+        try:
+            self.assertTrue(dbi.started.wait(10))
+            self.assertEqual(job_counts.get(['psdehal']),
+                             ({'psdehal': 1}, 1))
+        finally:
+            dbi.release.set()
+            recount.join(10)
+        self.assertEqual(results, [({'psdehal': 2}, 2)])
+        self.assertEqual(dbi.calls, 2)
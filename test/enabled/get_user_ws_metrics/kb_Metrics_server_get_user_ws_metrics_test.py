@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json  # noqa: F401
+import os  # noqa: F401
+from kb_Metrics.Test import Test
+
+
+class kb_Metrics_get_user_ws_metrics_Test(Test):
+
+    def get_user_ws_metrics(self, params):
+        ret = self.getImpl().get_user_ws_metrics(self.getContext(), params)
+        self.assertEqual(len(ret), 1)
+        self.assertIsInstance(ret[0], dict)
+        self.assertIn('metrics_result', ret[0])
+        return ret[0]['metrics_result']
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_get_user_ws_metrics")
+    def test_run_MetricsImpl_get_user_ws_metrics(self):
+        m_params = {
+            'epoch_range': (datetime.datetime(2016, 1, 1),
+                            datetime.datetime(2018, 4, 30))}
+        usr_metrics = self.get_user_ws_metrics(m_params)
+        self.assertEqual(len(usr_metrics), 16)
+        for um in usr_metrics:
+            if um['_id'] == {'username': 'pranjan77',
+                             'year': 2016, 'month': 7}:
+                self.assertEqual(um['count_user_ws'], 6)
+                self.assertEqual(um['year_mon_user_logins'], 6)
+                self.assertEqual(um['count_user_numObjs'], 124)
+            if um['_id'] == {'username': 'eapearson',
+                             'year': 2016, 'month': 7}:
+                self.assertEqual(um['count_user_ws'], 2)
+                self.assertEqual(um['count_user_numObjs'], 258)
+
+        # testing with given parameter values with user_ids given
+        m_params['user_ids'] = ['vkumar', 'psdehal', 'wjriehl', 'qzhang']
+        usr_metrics = self.get_user_ws_metrics(m_params)
+        self.assertEqual(usr_metrics, [
+            {'_id': {'username': 'psdehal', 'year': 2018, 'month': 1},
+             'year_mon_user_logins': 1, 'count_user_numObjs': 4,
+             'count_user_ws': 1},
+            {'_id': {'username': 'vkumar', 'year': 2016, 'month': 7},
+             'year_mon_user_logins': 2, 'count_user_numObjs': 69,
+             'count_user_ws': 2},
+            {'_id': {'username': 'wjriehl', 'year': 2016, 'month': 7},
+             'year_mon_user_logins': 3, 'count_user_numObjs': 48,
+             'count_user_ws': 3}])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_get_user_ws_metrics_matches") # noqa E501
+    def test_run_MetricsImpl_get_user_ws_metrics_matches(self):
+        # the combined records agree with the three separate methods
+        m_params = {
+            'epoch_range': (datetime.datetime(2016, 7, 15, 12),
+                            datetime.datetime(2018, 2, 1))}
+        usr_metrics = self.get_user_ws_metrics(dict(m_params))
+        separate = [
+            (self.getImpl().get_user_logins, 'year_mon_user_logins'),
+            (self.getImpl().get_user_numObjs, 'count_user_numObjs'),
+            (self.getImpl().get_user_ws_stats, 'count_user_ws')]
+        for method, count_key in separate:
+            ret = method(self.getContext(), dict(m_params))
+            self.assertEqual(ret[0]['metrics_result'],
+                             [{'_id': um['_id'], count_key: um[count_key]}
+                              for um in usr_metrics])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_get_user_ws_metrics_not_admin") # noqa E501
+    def test_run_MetricsImpl_get_user_ws_metrics_not_admin(self):
+        err_msg = 'You do not have permisson to invoke this action.'
+        with self.assertRaisesRegex(ValueError, err_msg):
+            self.db_controller.get_user_ws_metrics(
+                'user_joe', {}, self.getContext()['token'])
@@ -12,6 +12,11 @@ from bson.objectid import ObjectId
 from kb_Metrics.Util import _unix_time_millis_from_datetime
 from kb_Metrics.metrics_dbi import MongoMetricsDBI
 from kb_Metrics.metricsdb_controller import MetricsMongoDBController
+from kb_Metrics.PackedNarrativeMap import (PackedNarrativeMap,
+                                           pack_narratives)
+from kb_Metrics.ResultCache import ResultCache
+from kb_Metrics.ClientGroupCache import ClientGroupCache
+from kb_Metrics.NarrativeCache import NarrativeCache
 from kb_Metrics.Test import Test, print_debug
 
 # class Mockit:
@@ -85,6 +90,15 @@ class kb_Metrics_Main_Test(Test):
                          '5968e5fde4b08b65f9ff5d7d')
         self.assertEqual(sorted_exec_tasks[2]['job_input']['wsid'], 23165)
 
+        # only the job input the job assembly reads is fetched
+        for exec_task in exec_tasks:
+            job_input = exec_task['job_input']
+            self.assertLessEqual(set(job_input),
+                                 {'app_id', 'method', 'meta', 'wsid',
+                                  'params'})
+            self.assertLessEqual(set(job_input.get('meta', {})), {'tag'})
+            self.assertLessEqual(len(job_input.get('params', [])), 1)
+
     # Uncomment to skip this test
     # @unittest.skip("skipped MetricsMongoDBs_list_user_objects_from_wsobjs")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -153,6 +167,12 @@ class kb_Metrics_Main_Test(Test):
         self.assertIn(ws_owners[1]['username'], 'jplfaria')
         self.assertIn(ws_owners[1]['name'], 'jplfaria:1464632279763')
 
+        # testing the ws_ids filter
+        ws_owners = dbi.list_ws_owners([7645, 8768, 1])
+        self.assertEqual(sorted(wo['ws_id'] for wo in ws_owners),
+                         [7645, 8768])
+        self.assertEqual(dbi.list_ws_owners([]), [])
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_MetricsMongoDBs_aggr_user_details")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -274,346 +294,6 @@ class kb_Metrics_Main_Test(Test):
             }
         ])
 
-    # Uncomment to skip this test
-    # @unittest.skip("skipped test_run_MetricsMongoDBs_aggr_total_logins")
-    @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_run_MetricsMongoDBs_aggr_total_logins(self):
-        dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
-        start_time = datetime.datetime(2015, 1, 1)
-        end_time = datetime.datetime(2018, 4, 30)
-        user_list = []
-        users_coll = self.client.metrics.users
-        kbstaff_in_coll = list(users_coll.find(
-            {'kbase_staff': {'$in': [1, True]}},
-            {'username': 1, '_id': 0}))
-        excl_usrs = [usr['username'] for usr in kbstaff_in_coll]
-
-        # testing with time range when there are login records
-        tot_logins = dbi.aggr_total_logins(user_list, start_time, end_time)
-        self.assertCountEqual(tot_logins, [{'_id': {'year': 2018, 'month': 1},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2018, 'month': 2},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2017, 'month': 5},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2016, 'month': 7},
-                                            'year_mon_total_logins': 26},
-                                           ])
-
-        # testing with excluded user list
-        tot_logins = dbi.aggr_total_logins(user_list, start_time, end_time,
-                                           excluded_users=excl_usrs)
-        self.assertCountEqual(tot_logins, [{'_id': {'year': 2018, 'month': 2},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2017, 'month': 5},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2016, 'month': 7},
-                                            'year_mon_total_logins': 23},
-                                           ])
-
-        # testing with time range when there is fewer login records
-        start_time = datetime.datetime(2015, 1, 1)
-        end_time = datetime.datetime(2017, 9, 20)
-        tot_logins = dbi.aggr_total_logins(user_list, start_time, end_time)
-        self.assertCountEqual(tot_logins, [{'_id': {'year': 2017, 'month': 5},
-                                            'year_mon_total_logins': 1},
-                                           {'_id': {'year': 2016, 'month': 7},
-                                            'year_mon_total_logins': 26},
-                                           ])
-
-        # testing with time range when there is even fewer login records
-        start_time = datetime.datetime(2016, 9, 30)
-        end_time = datetime.datetime(2017, 6, 30)
-        tot_logins = dbi.aggr_total_logins(user_list, start_time, end_time)
-        self.assertEqual(len(tot_logins), 1)
-        self.assertEqual(tot_logins[0]['_id'], {'year': 2017, 'month': 5})
-        self.assertEqual(tot_logins[0]['year_mon_total_logins'], 1)
-
-    # Uncomment to skip this test
-    # @unittest.skip("skipped test_MetricsMongoDBs_aggr_user_logins_from_ws")
-    @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_MetricsMongoDBs_aggr_user_logins_from_ws(self):
-        dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
-        start_time = datetime.datetime(2016, 1, 1)
-        end_time = datetime.datetime(2018, 4, 30)
-        user_list0 = []
-        user_list1 = ['vkumar', 'psdehal', 'wjriehl', 'qzhang']
-        user_list2 = ['shahmaneshb', 'laramyenders', 'allmon', 'bsadkhin']
-
-        # testing aggr_user_logins_from_ws returned data structure and values
-        usr_logins = dbi.aggr_user_logins_from_ws(
-            user_list0, start_time, end_time)
-        self.assertEqual(len(usr_logins), 16)
-
-        self.assertIn({
-            '_id': {
-                'username': 'bsadkhin',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-        self.assertIn({
-            '_id': {
-                'username': 'fangfang',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 2
-        }, usr_logins)
-        self.assertIn({
-            '_id': {
-                'username': 'fakeusr',
-                'year': 2017,
-                'month': 5
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-
-        # with time range when there are fewer user login records
-        start_time = datetime.datetime(2016, 1, 1)
-        end_time = datetime.datetime(2017, 9, 30)
-        usr_logins = dbi.aggr_user_logins_from_ws(
-            user_list0, start_time, end_time)
-        self.assertEqual(len(usr_logins), 14)
-        self.assertIn({
-            '_id': {
-                'username': 'jplfaria',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-        self.assertIn({
-            '_id': {
-                'username': 'rsutormin',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-
-        # with time range when there are even fewer user login records
-        start_time = datetime.datetime(2015, 1, 1)
-        end_time = datetime.datetime(2017, 9, 20)
-        usr_logins = dbi.aggr_user_logins_from_ws(
-            user_list0, start_time, end_time)
-        self.assertEqual(len(usr_logins), 14)
-        self.assertIn({
-            '_id': {
-                'username': 'jplfaria',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-        self.assertIn({
-            '_id': {
-                'username': 'rsutormin',
-                'year': 2016,
-                'month': 7
-            },
-            'year_mon_user_logins': 1
-        }, usr_logins)
-
-        start_time = datetime.datetime(2017, 9, 30)
-        end_time = datetime.datetime(2018, 4, 30)
-        usr_logins = dbi.aggr_user_logins_from_ws(
-            user_list0, start_time, end_time)
-        self.assertCountEqual(usr_logins, [{
-            '_id': {
-                'username': 'joedoe',
-                'year': 2018,
-                'month': 2
-            },
-            'year_mon_user_logins': 1
-        },
-            {
-            '_id': {
-                'username': 'psdehal',
-                'year': 2018,
-                'month': 1
-            },
-            'year_mon_user_logins': 1
-        }])
-
-        # testing with given parameter values with user_ids given
-        usr_logins1 = dbi.aggr_user_logins_from_ws(
-            user_list1, start_time, end_time)
-        self.assertEqual(len(usr_logins1), 1)
-        self.assertEqual(usr_logins1[0]['_id'],
-                         {'username': 'psdehal', 'year': 2018, 'month': 1})
-        self.assertEqual(usr_logins1[0]['year_mon_user_logins'], 1)
-
-        usr_logins2 = dbi.aggr_user_logins_from_ws(
-            user_list2, start_time, end_time)
-        self.assertEqual(len(usr_logins2), 0)
-
-    # Uncomment to skip this test
-    # @unittest.skip("skipped test_run_MetricsMongoDBs_aggr_user_numObjs")
-    @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_run_MetricsMongoDBs_aggr_user_numObjs(self):
-        dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
-        start_time = datetime.datetime(2016, 1, 1)
-        end_time = datetime.datetime(2018, 4, 30)
-        user_list0 = []
-        user_list1 = ['vkumar', 'psdehal', 'wjriehl', 'qzhang']
-        user_list2 = ['shahmaneshb', 'laramyenders', 'allmon', 'bsadkhin']
-
-        # testing with time range only
-        usr_objNum = dbi.aggr_user_numObjs(user_list0, start_time, end_time)
-        self.assertEqual(len(usr_objNum), 16)
-        self.assertCountEqual(usr_objNum[0],
-                              {'_id': {'username': 'eapearson',
-                                       'year': 2016, 'month': 7},
-                               'count_user_numObjs': 258})
-        self.assertCountEqual(usr_objNum[1],
-                              {'_id': {'username': 'fangfang',
-                                       'year': 2016, 'month': 7},
-                               'count_user_numObjs': 2})
-        self.assertCountEqual(usr_objNum[3],
-                              {'_id': {'username': 'joedoe',
-                                       'year': 2018, 'month': 1},
-                               'count_user_numObjs': 100})
-        self.assertCountEqual(usr_objNum[6],
-                              {'_id': {'username': 'pranjan77',
-                                       'year': 2016, 'month': 7},
-                               'count_user_numObjs': 124})
-        self.assertCountEqual(usr_objNum[7],
-                              {'_id': {'username': 'psdehal',
-                                       'year': 2018, 'month': 1},
-                               'count_user_numObjs': 4})
-        self.assertCountEqual(usr_objNum[13],
-                              {'_id': {'username': 'wjriehl',
-                                       'year': 2016, 'month': 7},
-                               'count_user_numObjs': 48})
-
-        # testing with given parameter values with user_ids given
-        usr_objNum = dbi.aggr_user_numObjs(user_list1, start_time, end_time)
-        self.assertEqual(len(usr_objNum), 3)
-        self.assertEqual(usr_objNum[0]['_id'],
-                         {'username': 'psdehal', 'year': 2018, 'month': 1}),
-        self.assertEqual(usr_objNum[0]['count_user_numObjs'], 4)
-        self.assertEqual(usr_objNum[1]['_id'],
-                         {'username': 'vkumar', 'year': 2016, 'month': 7}),
-        self.assertEqual(usr_objNum[1]['count_user_numObjs'], 69)
-        self.assertEqual(usr_objNum[2]['_id'],
-                         {'username': 'wjriehl', 'year': 2016, 'month': 7}),
-        self.assertEqual(usr_objNum[2]['count_user_numObjs'], 48)
-
-        # testing with given parameter values with user_ids given
-        usr_objNum = dbi.aggr_user_numObjs(user_list2, start_time, end_time)
-        self.assertEqual(len(usr_objNum), 1)
-        self.assertEqual(usr_objNum[0]['_id'], {
-                         'username': 'bsadkhin', 'year': 2016, 'month': 7})
-        self.assertEqual(usr_objNum[0]['count_user_numObjs'], 105)
-
-    # Uncomment to skip this test
-    # @unittest.skip("skipped test_run_MetricsMongoDBs_aggr_user_ws")
-    @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_run_MetricsMongoDBs_aggr_user_ws(self):
-        dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
-        start_time = datetime.datetime(2016, 1, 1)
-        end_time = datetime.datetime(2018, 4, 30)
-        user_list0 = []
-        user_list1 = ['vkumar', 'psdehal', 'wjriehl', 'qzhang']
-        user_list2 = ['shahmaneshb', 'laramyenders', 'allmon', 'bsadkhin']
-
-        # testing with given parameter values without user_ids
-        usr_ws = dbi.aggr_user_ws(user_list0, start_time, end_time)
-        self.assertEqual(len(usr_ws), 16)
-        for uw in usr_ws:
-            if uw['_id'] == {
-                'username': 'eapearson',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 2)
-            if uw['_id'] == {
-                'username': 'fangfang',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 2)
-            if uw['_id'] == {
-                'username': 'janakakbase',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'joedoe',
-                'year': 2018,
-                    'month': 1}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'jplfaria',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'nconrad',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'pranjan77',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 6)
-            if uw['_id'] == {
-                'username': 'rsutormin',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'psdehal',
-                'year': 2018,
-                    'month': 1}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'sjyoo',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 1)
-            if uw['_id'] == {
-                'username': 'srividya22',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 2)
-            if uw['_id'] == {
-                'username': 'sunita',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 3)
-            if uw['_id'] == {
-                'username': 'vkumar',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 2)
-            if uw['_id'] == {
-                'username': 'wjriehl',
-                'year': 2016,
-                    'month': 7}:
-                self.assertEqual(uw['count_user_ws'], 3)
-
-        # testing with given parameter values with user_ids given
-        usr_ws = dbi.aggr_user_ws(user_list1, start_time, end_time)
-        self.assertEqual(len(usr_ws), 3)
-        self.assertEqual(usr_ws[0]['_id'],
-                         {'username': 'psdehal', 'year': 2018, 'month': 1})
-        self.assertEqual(usr_ws[0]['count_user_ws'], 1)
-        self.assertEqual(usr_ws[1]['_id'],
-                         {'username': 'vkumar', 'year': 2016, 'month': 7})
-        self.assertEqual(usr_ws[1]['count_user_ws'], 2)
-        self.assertEqual(usr_ws[2]['_id'],
-                         {'username': 'wjriehl', 'year': 2016, 'month': 7})
-        self.assertEqual(usr_ws[2]['count_user_ws'], 3)
-
-        # testing with given parameter values with another user_ids
-        usr_ws = dbi.aggr_user_ws(user_list2, start_time, end_time)
-        self.assertEqual(len(usr_ws), 1)
-        self.assertEqual(usr_ws[0]['_id'],
-                         {'username': 'bsadkhin', 'year': 2016, 'month': 7})
-        self.assertEqual(usr_ws[0]['count_user_ws'], 1)
-
     # Uncomment to skip this test
     # @unittest.skip("skipped test_MetricsMongoDBs_aggr_unique_users_per_day")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -634,10 +314,11 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(users[3]['numOfUsers'], 9)
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_update_user_records_WriteError")
+    # @unittest.skip("skipped test_bulk_update_user_records_WriteError")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    @patch('pymongo.collection.Collection.update_one')
-    def test_MetricsMongoDBs_update_user_records_WriteError(self, mock_upd):
+    @patch('pymongo.collection.Collection.bulk_write')
+    def test_MetricsMongoDBs_bulk_update_user_records_WriteError(self,
+                                                                 mock_upd):
         err_msg = 'user write error thrown from mock'
         mock_upd.side_effect = WriteError(err_msg, 99999)
 
@@ -650,14 +331,14 @@ class kb_Metrics_Main_Test(Test):
 
         dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
         with self.assertRaises(WriteError) as context_manager:
-            dbi.update_user_records(upd_filter_set,
-                                    upd_data_set, isKBstaff)
+            dbi.bulk_update_user_records(
+                [(upd_filter_set, upd_data_set, isKBstaff)])
             self.assertEqual(err_msg, str(context_manager.exception.message))
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_MetricsMongoDBs_update_user_records")
+    # @unittest.skip("skipped test_MetricsMongoDBs_bulk_update_user_records")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_MetricsMongoDBs_update_user_records(self):
+    def test_MetricsMongoDBs_bulk_update_user_records(self):
         dt1 = datetime.datetime(2018, 3, 12, 1, 13, 30)
         dt2 = datetime.datetime(2018, 3, 12, 1, 35, 30)
         upd_filter_set = {'username': 'test_u1', 'email': 'test_e1'}
@@ -671,13 +352,10 @@ class kb_Metrics_Main_Test(Test):
 
         dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
         # testing freshly upserted result
-        upd_ret = dbi.update_user_records(upd_filter_set,
-                                          upd_data_set, isKBstaff)
-
-        self.assertTrue(upd_ret.raw_result.get('upserted'))
-        self.assertFalse(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_user_records(
+            [(upd_filter_set, upd_data_set, isKBstaff)])
+        self.assertEqual(upd_ret, {'matched': 0, 'modified': 0,
+                                   'upserted': 1})
 
         murecord = db_mu.find_one({'username': 'test_u1',
                                    'email': 'test_e1'})
@@ -692,13 +370,10 @@ class kb_Metrics_Main_Test(Test):
         upd_data_set = {'full_name': 'test_nm1', 'roles': [],
                         'signup_at': dt1, 'last_signin_at': dt2}
 
-        upd_ret = dbi.update_user_records(upd_filter_set,
-                                          upd_data_set, isKBstaff)
-
-        self.assertFalse(upd_ret.raw_result.get('upserted'))
-        self.assertTrue(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_user_records(
+            [(upd_filter_set, upd_data_set, isKBstaff)])
+        self.assertEqual(upd_ret, {'matched': 1, 'modified': 1,
+                                   'upserted': 0})
 
         murecord = db_mu.find_one({'username': 'test_u1',
                                    'email': 'test_e1'})
@@ -830,10 +505,10 @@ class kb_Metrics_Main_Test(Test):
             self.assertEqual(mdarecord['obj_numModified'], 100)
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_update_activity_records_WriteError")
+    # @unittest.skip("skipped test_bulk_update_activity_records_WriteError")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    @patch('pymongo.collection.Collection.update_one')
-    def test_MetricsMongoDBs_update_activity_records_WriteError(
+    @patch('pymongo.collection.Collection.bulk_write')
+    def test_MetricsMongoDBs_bulk_update_activity_records_WriteError(
             self, mock_upd):
         err_msg = 'activity write error thrown from mock'
         mock_upd.side_effect = WriteError(err_msg, 99999)
@@ -847,13 +522,14 @@ class kb_Metrics_Main_Test(Test):
 
         dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
         with self.assertRaises(WriteError) as context_manager:
-            dbi.update_activity_records(upd_filter_set, upd_data_set)
+            dbi.bulk_update_activity_records(
+                [(upd_filter_set, upd_data_set)])
             self.assertEqual(err_msg, str(context_manager.exception.message))
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_MetricsMongoDBs_update_activity_records")
+    # @unittest.skip("skipped test_MetricsMongoDBs_bulk_update_activity_records") # noqa E501
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_MetricsMongoDBs_update_activity_records(self):
+    def test_MetricsMongoDBs_bulk_update_activity_records(self):
         # Fake data
         upd_filter_set1 = {'_id.username': 'qz',
                            '_id.year_mod': 2019,
@@ -876,16 +552,14 @@ class kb_Metrics_Main_Test(Test):
 
         dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
         # testing freshly upserted result
-        upd_ret = dbi.update_activity_records(upd_filter_set1,
-                                              upd_data_set1)
-        self.assertTrue(upd_ret.raw_result.get('upserted'))
-        self.assertFalse(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_activity_records(
+            [(upd_filter_set1, upd_data_set1)])
+        self.assertEqual(upd_ret, {'matched': 0, 'modified': 0,
+                                   'upserted': 1})
         self.assertEqual(len(list(db_mda.find(upd_filter_set1))), 1)
 
-        upd_ret = dbi.update_activity_records(upd_filter_set2,
-                                              upd_data_set2)
+        upd_ret = dbi.bulk_update_activity_records(
+            [(upd_filter_set2, upd_data_set2)])
         self.assertEqual(len(list(db_mda.find(upd_filter_set2))), 1)
 
         self.assertEqual(db_mda.find_one(
@@ -894,21 +568,19 @@ class kb_Metrics_Main_Test(Test):
             upd_filter_set2)['obj_numModified'], 92)
 
         # testing updating existing record
-        upd_ret = dbi.update_activity_records(upd_filter_set2,
-                                              upd_data_set3)
-        self.assertFalse(upd_ret.raw_result.get('upserted'))
-        self.assertTrue(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_activity_records(
+            [(upd_filter_set2, upd_data_set3)])
+        self.assertEqual(upd_ret, {'matched': 1, 'modified': 1,
+                                   'upserted': 0})
         self.assertEqual(db_mda.find_one(
             upd_filter_set2)['obj_numModified'], 93)
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_update_narrative_records_WriteError")
+    # @unittest.skip("skipped test_bulk_update_narrative_records_WriteError")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    @patch('pymongo.collection.Collection.update_one')
-    def test_MetricsMongoDBs_update_narrative_records_WriteError(self,
-                                                                 mock_upd):
+    @patch('pymongo.collection.Collection.bulk_write')
+    def test_MetricsMongoDBs_bulk_update_narrative_records_WriteError(
+            self, mock_upd):
         err_msg = 'narrative write error thrown from mock'
         mock_upd.side_effect = WriteError(err_msg, 99999)
 
@@ -922,15 +594,16 @@ class kb_Metrics_Main_Test(Test):
         print_debug('DB NAMES')
         print_debug(self.db_names)
         with self.assertRaises(WriteError) as context_manager:
-            dbi.update_narrative_records(upd_narr_filter, upd_narr_data)
+            dbi.bulk_update_narrative_records(
+                [(upd_narr_filter, upd_narr_data)])
             print('WRITE ERROR')
             print(str(context_manager.exception.message))
             self.assertEqual(err_msg, str(context_manager.exception.message))
 
     # Uncomment to skip this test
-    # @unittest.skip("skipped test_MetricsMongoDBs_update_narrative_records")
+    # @unittest.skip("skipped test_MetricsMongoDBs_bulk_update_narrative_records") # noqa E501
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
-    def test_MetricsMongoDBs_update_narrative_records(self):
+    def test_MetricsMongoDBs_bulk_update_narrative_records(self):
         # Fake data
         upd_filter_set1 = {'object_id': 1,
                            'object_version': 1,
@@ -965,16 +638,14 @@ class kb_Metrics_Main_Test(Test):
 
         dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
         # testing freshly upserted result
-        upd_ret = dbi.update_narrative_records(upd_filter_set1,
-                                               upd_data_set1)
-        self.assertTrue(upd_ret.raw_result.get('upserted'))
-        self.assertFalse(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_narrative_records(
+            [(upd_filter_set1, upd_data_set1)])
+        self.assertEqual(upd_ret, {'matched': 0, 'modified': 0,
+                                   'upserted': 1})
         self.assertEqual(len(list(db_mn.find(upd_filter_set1))), 1)
 
-        upd_ret = dbi.update_narrative_records(upd_filter_set2,
-                                               upd_data_set2)
+        upd_ret = dbi.bulk_update_narrative_records(
+            [(upd_filter_set2, upd_data_set2)])
         self.assertEqual(len(list(db_mn.find(upd_filter_set2))), 1)
 
         mnrecord = db_mn.find_one(upd_filter_set1)
@@ -986,18 +657,61 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(mnrecord['numObj'], 5)
 
         # testing updating existing record
-        upd_ret = dbi.update_narrative_records(upd_filter_set2,
-                                               upd_data_set3)
-        self.assertFalse(upd_ret.raw_result.get('upserted'))
-        self.assertTrue(upd_ret.raw_result.get('updatedExisting'))
-        self.assertTrue(upd_ret.raw_result.get('ok'))
-        self.assertEqual(upd_ret.raw_result.get('n'), 1)
+        upd_ret = dbi.bulk_update_narrative_records(
+            [(upd_filter_set2, upd_data_set3)])
+        self.assertEqual(upd_ret, {'matched': 1, 'modified': 1,
+                                   'upserted': 0})
 
         mnrecord = db_mn.find_one(upd_filter_set2)
         self.assertEqual(mnrecord['last_saved_at'],
                          datetime.datetime(2019, 1, 24, 19, 35, 48, 1000))
         self.assertEqual(mnrecord['numObj'], 7)
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_MetricsMongoDBs_bulk_update_records")
+    @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
+    def test_MetricsMongoDBs_bulk_update_records(self):
+        narr_records = [({'object_id': 1, 'object_version': 1,
+                          'workspace_id': 20199981 + i},
+                         {'name': 'qz1:narrative_154835854200' + str(i),
+                          'last_saved_at': datetime.datetime(
+                              2019, 1, 24, 19, 35, 42),
+                          'numObj': i})
+                         for i in range(5)]
+        db_mn = self.client.metrics.narratives
+        n_narrs = db_mn.count_documents({})
+
+        dbi = MongoMetricsDBI('', self.db_names, 'admin', 'password')
+        # chunks smaller than the number of records
+        counts = dbi.bulk_update_narrative_records(narr_records, 2)
+        self.assertEqual(counts, {'matched': 0, 'modified': 0,
+                                  'upserted': 5})
+        # no stray documents from the access_count pass
+        self.assertEqual(db_mn.count_documents({}), n_narrs + 5)
+        for upd_filter, upd_data in narr_records:
+            mnrecord = db_mn.find_one(upd_filter)
+            self.assertEqual(mnrecord['numObj'], upd_data['numObj'])
+            self.assertEqual(mnrecord['access_count'], 1)
+            self.assertEqual(mnrecord['first_access'],
+                             upd_data['last_saved_at'])
+
+        counts = dbi.bulk_update_narrative_records(narr_records[:3])
+        self.assertEqual(counts, {'matched': 3, 'modified': 3,
+                                  'upserted': 0})
+        self.assertEqual(db_mn.count_documents({}), n_narrs + 5)
+        self.assertEqual(db_mn.find_one(
+            narr_records[0][0])['access_count'], 2)
+
+        act_records = [({'_id': {'username': 'qz', 'year_mod': 2019,
+                                 'month_mod': 2, 'day_mod': 1,
+                                 'ws_id': 20199981}},
+                        {'obj_numModified': 3})]
+        counts = dbi.bulk_update_activity_records(act_records, 1)
+        self.assertEqual(counts['upserted'], 1)
+        counts = dbi.bulk_update_activity_records([])
+        self.assertEqual(counts, {'matched': 0, 'modified': 0,
+                                  'upserted': 0})
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_MetricsMongoDBs_get_user_info")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -1208,6 +922,23 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(job['status'], 'queued')
         self.assertEqual(str(job['_id']), '544ade14e4b0d82af0eaf31d')
 
+        # continuation tokens page only the sorts by created, updated or
+        # user, which every job has
+        job_id_sort = [{'field': 'job_id', 'direction': 'ascending'}]
+        self.assertIsNone(dbi.ujs_results_continuation_token(
+            job_id_sort, ujs[:10], 10))
+        created_sort = [{'field': 'created', 'direction': 'ascending'}]
+        ujs, count = dbi.list_ujs_results([], start_time=start_time,
+                                          end_time=end_time, limit=10,
+                                          sort=created_sort)
+        token = dbi.ujs_results_continuation_token(created_sort, ujs, 10)
+        self.assertIsNotNone(token)
+        with self.assertRaisesRegex(ValueError,
+                                    'created, updated or user'):
+            dbi.list_ujs_results([], start_time=start_time,
+                                 end_time=end_time, limit=10,
+                                 sort=job_id_sort, continuation_token=token)
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_MetricsMongoDBs_list_narrative_info")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -1348,6 +1079,17 @@ class kb_Metrics_Main_Test(Test):
         self.assertCountEqual(self.db_controller.mongodb_dbList,
                               expected_db_list)
 
+    # Uncomment to skip this test
+    # @unittest.skip("test_MetricsMongoDBController_shared_mongo_clients")
+    def test_MetricsMongoDBController_shared_mongo_clients(self):
+        # a second controller must reuse the pooled clients of the first
+        controller = MetricsMongoDBController(self.cfg)
+        for m_db in controller.mongodb_dbList:
+            self.assertIs(controller.metrics_dbi.mongo_clients[m_db],
+                          self.db_controller.metrics_dbi.mongo_clients[m_db])
+        self.assertIs(controller.narrative_cache.metrics_dbi,
+                      controller.metrics_dbi)
+
     # Uncomment to skip this test
     # @unittest.skip("skipped MetricsMongoDBController_config_str_to_list")
     def test_MetricsMongoDBController_config_str_to_list(self):
@@ -2009,6 +1751,74 @@ class kb_Metrics_Main_Test(Test):
             for client_group in client_groups:
                 self.assertIsInstance(client_group, str)
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped_shared_controller_state")
+    def test_db_controller_shared_state(self):
+        # the Impl's controller is shared by the requests, which leave no
+        # state on it
+        impl = self.getImpl()
+        controller = impl.mdb_controller
+        before = dict(vars(controller))
+        impl.get_jobs(self.getContext(), {'epoch_range': [0, 1536000000000]})
+        impl.query_jobs_admin(self.getContext(), {'limit': 5})
+        impl.get_job_counts(self.getContext(), {})
+        impl.get_user_details(self.getContext(), {
+            'epoch_range': [0, 1536000000000]})
+        self.assertEqual(vars(controller), before)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped_client_group_cache")
+    def test_db_controller_client_group_cache(self):
+        fetched = []
+
+        def fetch(token):
+            fetched.append(token)
+            if token == 'bad_token':
+                raise ValueError('Catalog is down')
+            return {'app/one': ['njs', 'bigmem'],
+                    'token': [token]}
+
+        cache_file = os.path.join(self.cfg['scratch'],
+                                  'client_groups_test.json')
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        cache = ClientGroupCache({'client-groups-ttl': 0.2,
+                                  'client-groups-file': cache_file}, fetch)
+        ClientGroupCache.clear()
+        try:
+            # a cold process fails without the Catalog or a saved copy
+            with self.assertRaisesRegex(ValueError, 'Catalog is down'):
+                cache.get('bad_token')
+            self.assertIsNone(cache.age())
+
+            # fetched once, then shared
+            self.assertEqual(cache.get('token_1')['token'], ['token_1'])
+            self.assertEqual(cache.get('token_2')['token'], ['token_1'])
+            self.assertEqual(fetched, ['bad_token', 'token_1'])
+            self.assertTrue(os.path.isfile(cache_file))
+
+            # stale client groups are served while they are refreshed
+            time.sleep(0.3)
+            self.assertEqual(cache.get('token_3')['token'], ['token_1'])
+            ClientGroupCache.refresher.join()
+            self.assertEqual(cache.get('token_4')['token'], ['token_3'])
+
+            # a failed refresh keeps the stale client groups
+            time.sleep(0.3)
+            self.assertEqual(cache.get('bad_token')['token'], ['token_3'])
+            ClientGroupCache.refresher.join()
+            self.assertEqual(cache.get('token_5')['token'], ['token_3'])
+            self.assertIsNotNone(ClientGroupCache.refresh_error)
+
+            # a restarted process falls back on the saved copy
+            ClientGroupCache.clear()
+            self.assertEqual(cache.get('bad_token')['token'], ['token_3'])
+            self.assertGreaterEqual(cache.age(), 250)
+        finally:
+            ClientGroupCache.clear()
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+
     # Uncomment to skip this test
     # @unittest.skip("skipped_get_activities_from_wsobjs")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -2033,6 +1843,11 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(user_acts[1]['_id']['day_mod'], 15)
         self.assertEqual(user_acts[1]['obj_numModified'], 21)
 
+        # every activity of an owned workspace has the owner's username
+        for act in user_acts:
+            if act['_id']['ws_id'] == 8768:
+                self.assertEqual(act['_id']['username'], 'vkumar')
+
     # Uncomment to skip this test
     # @unittest.skip("skipped get_narratives_from_wsobjs")
     @patch.object(MongoMetricsDBI, '__init__', new=mock_MongoMetricsDBI)
@@ -2130,6 +1945,61 @@ class kb_Metrics_Main_Test(Test):
         self.assertTrue(wnarr_map.get(15206) is None)
         self.assertTrue(wnarr_map.get(23165) is None)
 
+        # the map is served from a published snapshot; its age is reported
+        self.assertIsNotNone(self.narrative_cache.age())
+        self.assertGreaterEqual(self.narrative_cache.age(), 0)
+        self.assertIs(self.narrative_cache.get(), wnarr_map)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped narrative_cache_refreshed_snapshot")
+    def test_NarrativeCache_refreshed_snapshot(self):
+        # the Impl's controller lives as long as the process, and sees each
+        # snapshot published after its first lookup
+        controller = self.db_controller
+        none_info = (None, None, None, None)
+        new_info = ('fake:1', 'Created Later', '1', False)
+        self.assertEqual(controller.get_narrative_infos([99999]),
+                         {99999: none_info})
+        snapshot = NarrativeCache.snapshot
+        narrative_map = snapshot.narrative_map
+        try:
+            NarrativeCache.snapshot = snapshot._replace(
+                narrative_map=PackedNarrativeMap(narrative_map.merged(
+                    {99999: new_info}, narrative_map.max_time)))
+            self.assertEqual(controller.get_narrative_infos([99999]),
+                             {99999: new_info})
+            self.assertEqual(
+                controller.map_ws_narrative_names(
+                    'qzhang', [99999], self.getContext()['token']),
+                [{'ws_id': 99999, 'narr_name_map': new_info}])
+        finally:
+            NarrativeCache.snapshot = snapshot
+        self.assertEqual(controller.get_narrative_infos([99999]),
+                         {99999: none_info})
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped PackedNarrativeMap_pack_and_merge")
+    def test_PackedNarrativeMap_pack_and_merge(self):
+        wnarr_map = dict(self.narrative_cache.get())
+        packed = PackedNarrativeMap(
+            pack_narratives(sorted(wnarr_map.items()), 1000))
+        self.assertEqual(len(packed), 30)
+        self.assertEqual(packed.max_time, 1000)
+        self.assertEqual(dict(packed), wnarr_map)
+        self.assertIsNone(packed.get(15206))
+        self.assertIsNone(packed.get('8781'))
+
+        # merging replaces existing entries and adds new ones in order
+        merged = PackedNarrativeMap(packed.merged({
+            8781: ('vkumar:1468639677500', 'Renamed', '46', True),
+            1: ('fake:1', 'First', '1', False)}, 2000))
+        self.assertEqual(len(merged), 31)
+        self.assertEqual(merged.max_time, 2000)
+        self.assertEqual(list(merged)[0], 1)
+        self.assertEqual(merged[8781],
+                         ('vkumar:1468639677500', 'Renamed', '46', True))
+        self.assertEqual(merged[27834], wnarr_map[27834])
+
     # Uncomment to skip this test
     # @unittest.skip("skipped map_ws_narrative_names")
     def test_MetricsMongoDBController_map_ws_narrative_names(self):
@@ -2238,6 +2108,27 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(n_ver, '1')
         self.assertEqual(is_deleted, True)
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped get_narrative_infos")
+    def test_MetricsMongoDBController_get_narrative_infos(self):
+        # the batched lookups agree with the one at a time lookups
+        ws_ids = [8781, 27834, 8736, 8748, 'bsadkhin:1468518477765', 15206,
+                  23165, 'qz:12345678', 33473, 8739, 99999, 8781]
+        narr_infos = self.db_controller.get_narrative_infos(ws_ids)
+        self.assertEqual(len(narr_infos), len(set(ws_ids)))
+        for ws_id in ws_ids:
+            self.assertEqual(narr_infos[ws_id],
+                             self.db_controller.get_narrative_info(ws_id))
+
+        ws_infos = self.db_controller.get_workspace_infos(ws_ids)
+        self.assertEqual(len(ws_infos), len(set(ws_ids)))
+        for ws_id in ws_ids:
+            self.assertEqual(ws_infos[ws_id],
+                             self.db_controller.get_workspace_info(ws_id))
+
+        self.assertEqual(self.db_controller.get_narrative_infos([]), {})
+        self.assertEqual(self.db_controller.get_workspace_infos([]), {})
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_MetricsMongoDBController_update_user_info")
 
@@ -2777,6 +2668,173 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(users[2]['numOfUsers'], 6)
         self.assertEqual(users[3]['numOfUsers'], 9)
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_MetricsMongoDBController_report_cache")
+    def test_MetricsMongoDBController_report_cache(self):
+        user = self.getContext()['user_id']
+        token = self.getContext()['token']
+        params = {'user_ids': ['wjriehl', 'psdehal'],
+                  'epoch_range': (datetime.datetime(2016, 1, 1),
+                                  datetime.datetime(2018, 4, 30))}
+
+        ret = self.db_controller.get_signup_retn_users(
+            user, dict(params), token)
+        cache_stats = ret['stats']['cache']
+        self.assertEqual(cache_stats['status'], 'miss')
+        self.assertEqual(cache_stats['age'], 0)
+        self.assertEqual(cache_stats['entries'], 1)
+
+        # the same user_ids in another order and a range starting and
+        # ending on the same days share the cached result
+        same_days = {'user_ids': ['psdehal', 'wjriehl', 'psdehal'],
+                     'epoch_range': (datetime.datetime(2016, 1, 1, 8),
+                                     datetime.datetime(2018, 4, 30, 20))}
+        with patch.object(MongoMetricsDBI,
+                          'aggr_signup_retn_users') as mock_aggr:
+            ret1 = self.db_controller.get_signup_retn_users(
+                user, dict(same_days), token)
+            mock_aggr.assert_not_called()
+        self.assertEqual(ret1['stats']['cache']['status'], 'hit')
+        self.assertEqual(ret1['stats']['cache']['hits'],
+                         cache_stats['hits'] + 1)
+        self.assertEqual(ret1['metrics_result'], ret['metrics_result'])
+
+        # another method, or the kbstaff excluded, is another report
+        ret2 = self.db_controller.get_signup_retn_users(
+            user, dict(params), token, exclude_kbstaff=True)
+        self.assertEqual(ret2['stats']['cache']['status'], 'miss')
+        ret2 = self.db_controller.get_narrative_stats(
+            user, dict(params), token)
+        self.assertEqual(ret2['stats']['cache']['status'], 'miss')
+        self.assertEqual(ret2['stats']['cache']['entries'], 3)
+
+        # bypass_cache and refresh_cache run the report
+        for flag, status in (('bypass_cache', 'bypass'),
+                             ('refresh_cache', 'refresh')):
+            flag_params = dict(params)
+            flag_params[flag] = True
+            ret3 = self.db_controller.get_signup_retn_users(
+                user, flag_params, token)
+            self.assertEqual(ret3['stats']['cache']['status'], status)
+            self.assertEqual(ret3['metrics_result'], ret['metrics_result'])
+        self.assertEqual(ret3['stats']['cache']['entries'], 3)
+
+        # updating the metrics drops the cached reports
+        self.db_controller.update_metrics(
+            user, {'user_ids': [], 'epoch_range': (
+                datetime.datetime(2018, 1, 1), datetime.datetime(2018, 1, 2))},
+            token)
+        ret4 = self.db_controller.get_signup_retn_users(
+            user, dict(params), token)
+        self.assertEqual(ret4['stats']['cache']['status'], 'miss')
+
+        # expired and least recently used results are evicted
+        cache = ResultCache(ttl=0.1, max_entries=2)
+        ResultCache.clear()
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a')[0], 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c')[0], 3)
+        time.sleep(0.2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_MetricsMongoDBController_closed_buckets") # noqa E501
+    def test_MetricsMongoDBController_closed_buckets(self):
+        user = self.getContext()['user_id']
+        token = self.getContext()['token']
+        dbi = self.db_controller.metrics_dbi
+
+        # whole past months are closed, the partial ones are queried
+        min_time = _unix_time_millis_from_datetime(
+            datetime.datetime(2018, 1, 15))
+        max_time = _unix_time_millis_from_datetime(
+            datetime.datetime(2018, 4, 30))
+        self.assertEqual(
+            self.db_controller._split_closed_months(min_time, max_time),
+            ([(2018, 2), (2018, 3)],
+             [(min_time, _unix_time_millis_from_datetime(
+                 datetime.datetime(2018, 2, 1)) - 1),
+              (_unix_time_millis_from_datetime(
+                  datetime.datetime(2018, 4, 1)), max_time)]))
+        now = _unix_time_millis_from_datetime(datetime.datetime.utcnow())
+        self.assertEqual(
+            self.db_controller._split_closed_months(now - 1000, now),
+            ([], [(now - 1000, now)]))
+
+        # the reports from the closed buckets are those of the live queries
+        ranges = [(datetime.datetime(2016, 1, 1),
+                   datetime.datetime(2018, 4, 30)),
+                  (datetime.datetime(2016, 7, 15, 12),
+                   datetime.datetime(2018, 2, 1))]
+        for epoch_range in ranges:
+            for user_ids in ([], ['wjriehl', 'psdehal', 'qzhang']):
+                params = {'user_ids': user_ids, 'epoch_range': epoch_range,
+                          'bypass_cache': True}
+                live = self.db_controller.get_signup_retn_users(
+                    user, dict(params), token,
+                    exclude_kbstaff=True)['metrics_result']
+                del params['bypass_cache']
+                cached = self.db_controller.get_signup_retn_users(
+                    user, dict(params), token,
+                    exclude_kbstaff=True)['metrics_result']
+                self.assertEqual(cached, sorted(
+                    live, key=lambda u: (u['_id']['year'],
+                                         u['_id']['month'])))
+            for exclude_kbstaff in (True, False):
+                params = {'epoch_range': epoch_range, 'bypass_cache': True}
+                live = self.db_controller.get_narrative_stats(
+                    user, dict(params), token,
+                    exclude_kbstaff)['metrics_result']
+                del params['bypass_cache']
+                ResultCache.clear()
+                cached = self.db_controller.get_narrative_stats(
+                    user, dict(params), token,
+                    exclude_kbstaff)['metrics_result']
+                self.assertEqual(cached, live)
+
+        # the closed buckets are saved, and not built again
+        saved = dbi.get_report_buckets('signups', [(2018, 2), (2018, 3)])
+        self.assertEqual(sorted(saved), [(2018, 2), (2018, 3)])
+        ResultCache.clear()
+        with patch.object(MongoMetricsDBI,
+                          'aggr_signup_users_monthly') as mock_aggr:
+            self.db_controller.get_signup_retn_users(
+                user, {'epoch_range': ranges[0]}, token)
+            mock_aggr.assert_not_called()
+
+        # updating a user drops the bucket of the user's signup month only
+        # if the user is counted differently in it
+        signup_at = dbi.metricsDBs['auth2']['users'].find_one(
+            {'user': 'qzhang'})['create']
+        signup_month = (signup_at.year, signup_at.month)
+        update_params = {'user_ids': ['qzhang'], 'epoch_range': (
+            datetime.datetime(2012, 1, 1), datetime.datetime(2018, 4, 30))}
+        self.db_controller._update_user_info(dict(update_params), token)
+        ResultCache.clear()
+        self.db_controller.get_signup_retn_users(
+            user, {'epoch_range': (datetime.datetime(2012, 1, 1),
+                                   datetime.datetime(2018, 4, 30))}, token)
+        self.assertIn(signup_month,
+                      dbi.get_report_buckets('signups', [signup_month]))
+        generation = dbi.get_report_generation('signups')
+        self.db_controller._update_user_info(dict(update_params), token)
+        self.assertEqual(dbi.get_report_generation('signups'), generation)
+        self.assertIn(signup_month,
+                      dbi.get_report_buckets('signups', [signup_month]))
+
+        dbi.metricsDBs['metrics']['users'].update_one(
+            {'username': 'qzhang'},
+            {'$set': {'signup_at': datetime.datetime(2011, 1, 1)}})
+        self.db_controller._update_user_info(dict(update_params), token)
+        self.assertEqual(dbi.get_report_generation('signups'),
+                         generation + 1)
+        self.assertEqual(
+            dbi.get_report_buckets('signups', [signup_month]), {})
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_run_MetricsMongoDBController_get_user_ws_stats") # noqa E501
     def test_run_MetricsMongoDBController_get_user_ws_stats(self):
@@ -2877,6 +2935,65 @@ class kb_Metrics_Main_Test(Test):
                                         'count_user_ws': 3},
                                        ])
 
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_MetricsMongoDBController_workspace_rollups")
+    def test_MetricsMongoDBController_workspace_rollups(self):
+        user = self.getContext()['user_id']
+        token = self.getContext()['token']
+        ranges = [(datetime.datetime(2016, 1, 1),
+                   datetime.datetime(2018, 4, 30)),
+                  (1420083768000, 1505876263000),
+                  (datetime.datetime(2016, 7, 15, 12),
+                   datetime.datetime(2018, 1, 24, 19, 35, 30))]
+        methods = [self.db_controller.get_user_login_stats_from_ws,
+                   self.db_controller.get_user_numObjs_from_ws,
+                   self.db_controller.get_user_ws_stats,
+                   self.db_controller.get_total_logins_from_ws]
+
+        # counted from the workspaces only
+        self.client.metrics.update_watermarks.delete_many(
+            {'_id': 'workspace_rollups'})
+        live_rets = [method(user, {'epoch_range': epoch_range}, token)
+                     for epoch_range in ranges for method in methods]
+
+        # counted from the rollups, except for the partial days
+        rollup_count = self.db_controller._update_workspace_rollups()
+        self.assertGreater(rollup_count, 0)
+        rollup_rets = [method(user, {'epoch_range': epoch_range}, token)
+                       for epoch_range in ranges for method in methods]
+        self.assertEqual(rollup_rets, live_rets)
+
+        # a workspace modified since the rollups were updated is counted
+        # once, on its new moddate, before and after the next update
+        workspaces = self.client.workspace.workspaces
+        ws = workspaces.find_one({
+            'moddate': {'$gte': datetime.datetime(2016, 7, 16),
+                        '$lt': datetime.datetime(2018, 1, 24)},
+            'cloning': {'$exists': False}})
+        try:
+            workspaces.update_one({'_id': ws['_id']}, {'$set': {
+                'moddate': datetime.datetime.utcnow(),
+                'numObj': ws.get('numObj', 0) + 5}})
+            moved_rets = [method(user, {'epoch_range': epoch_range}, token)
+                          for epoch_range in ranges for method in methods]
+            self.assertNotEqual(moved_rets, rollup_rets)
+            self.assertEqual(self.db_controller._update_workspace_rollups(),
+                             1)
+            updated_rets = [
+                method(user, {'epoch_range': epoch_range}, token)
+                for epoch_range in ranges for method in methods]
+            self.client.metrics.update_watermarks.delete_many(
+                {'_id': 'workspace_rollups'})
+            moved_live_rets = [
+                method(user, {'epoch_range': epoch_range}, token)
+                for epoch_range in ranges for method in methods]
+        finally:
+            workspaces.replace_one({'_id': ws['_id']}, ws)
+            self.client.metrics.update_watermarks.delete_many(
+                {'_id': 'workspace_rollups'})
+        self.assertEqual(moved_rets, moved_live_rets)
+        self.assertEqual(updated_rets, moved_live_rets)
+
     # Uncomment to skip this test
     # @unittest.skip("skipped test_run_MetricsMongoDBController_get_narrative_stats") # noqa E501
     def test_run_MetricsMongoDBController_get_narrative_stats(self):
@@ -3578,6 +3695,115 @@ class kb_Metrics_Main_Test(Test):
         self.assertEqual(upds['user_updates'], 37)
         self.assertEqual(upds['activity_updates'], 8)
         self.assertEqual(upds['narrative_updates'], 1)
+        counts = upds['update_counts']
+        self.assertEqual(counts['users']['upserted'] +
+                         counts['users']['modified'], 37)
+        self.assertEqual(counts['activities']['upserted'] +
+                         counts['activities']['modified'], 8)
+        self.assertEqual(counts['narratives']['upserted'] +
+                         counts['narratives']['modified'], 1)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_update_metrics_parallel")
+    @patch.object(MetricsMongoDBController, '_update_narratives')
+    def test_run_MetricsImpl_update_metrics_parallel(self, mock_narrs):
+        err_msg = 'narrative update error thrown from mock'
+        mock_narrs.side_effect = ValueError(err_msg)
+        m_params = {
+            'user_ids': [],
+            'epoch_range': (datetime.datetime(2018, 1, 1),
+                            datetime.datetime(2018, 3, 31)),
+            'parallel': 1
+        }
+
+        ret = self.getImpl().update_metrics(self.getContext(), m_params)
+        upds = ret[0]['metrics_result']
+        # the failed stage did not stop the others
+        self.assertEqual(upds['user_updates'], 37)
+        self.assertEqual(upds['activity_updates'], 8)
+        self.assertIsNone(upds['narrative_updates'])
+        self.assertEqual(upds['stage_errors'], {'narratives': err_msg})
+        self.assertEqual(sorted(upds['stage_times']),
+                         ['activities', 'users', 'workspace_rollups'])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_update_metrics_backfill")
+    def test_run_MetricsImpl_update_metrics_backfill(self):
+        m_params = {
+            'user_ids': [],
+            'epoch_range': (datetime.datetime(2018, 1, 1),
+                            datetime.datetime(2018, 3, 31)),
+            'backfill_chunk_days': 7,
+            'parallel': 1
+        }
+
+        ret = self.getImpl().update_metrics(self.getContext(), m_params)
+        upds = ret[0]['metrics_result']
+        # the chunks together cover the same records as a single run
+        self.assertEqual(upds['user_updates'], 37)
+        self.assertEqual(upds['activity_updates'], 8)
+        self.assertEqual(upds['narrative_updates'], 1)
+
+        chunks = upds['chunks']
+        self.assertEqual(len(chunks), 13)
+        self.assertEqual(chunks[0]['epoch_range'][0],
+                         _unix_time_millis_from_datetime(
+                             datetime.datetime(2018, 1, 1)))
+        self.assertEqual(chunks[-1]['epoch_range'][1],
+                         _unix_time_millis_from_datetime(
+                             datetime.datetime(2018, 3, 31)))
+        for prev, chunk in zip(chunks, chunks[1:]):
+            self.assertEqual(chunk['epoch_range'][0],
+                             prev['epoch_range'][1] + 1)
+        for chunk in chunks:
+            self.assertNotIn('error', chunk)
+            self.assertIn('time_ms', chunk)
+            self.assertIn('updates_per_second', chunk)
+
+        with self.assertRaisesRegex(ValueError, 'cannot be incremental'):
+            self.getImpl().update_metrics(self.getContext(), {
+                'backfill_chunk_days': 7, 'incremental': 1})
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_MetricsMongoDBController_split_time_range")
+    def test_MetricsMongoDBController_split_time_range(self):
+        split = self.db_controller._split_time_range
+        self.assertEqual(split(0, 9, 5), [(0, 4), (5, 9)])
+        self.assertEqual(split(0, 10, 5), [(0, 4), (5, 9), (10, 10)])
+        self.assertEqual(split(3, 4, 5), [(3, 4)])
+        self.assertEqual(split(5, 4, 5), [])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_update_metrics_incremental")
+    def test_run_MetricsImpl_update_metrics_incremental(self):
+        start = _unix_time_millis_from_datetime(datetime.datetime(2018, 1, 1))
+        end = _unix_time_millis_from_datetime(datetime.datetime(2018, 3, 31))
+        m_params = {'epoch_range': (start, end), 'incremental': 1}
+        # start without any saved watermarks
+        self.client.metrics.update_watermarks.delete_many({})
+
+        with self.assertRaisesRegex(ValueError, 'user_ids cannot be given'):
+            self.getImpl().update_metrics(
+                self.getContext(), {'user_ids': ['qzhang'],
+                                    'incremental': 1})
+
+        ret = self.getImpl().update_metrics(self.getContext(), m_params)
+        upds = ret[0]['metrics_result']
+        self.assertEqual(upds['watermarks'],
+                         {'users': end, 'activities': end,
+                          'narratives': end})
+        self.assertGreaterEqual(upds['user_updates'], 37)
+        self.assertEqual(upds['narrative_updates'], 1)
+
+        # nothing has changed since the watermarks
+        ret = self.getImpl().update_metrics(self.getContext(), m_params)
+        upds = ret[0]['metrics_result']
+        self.assertEqual(upds['user_updates'], 0)
+        self.assertEqual(upds['activity_updates'], 0)
+        self.assertEqual(upds['narrative_updates'], 0)
+        self.assertEqual(upds['watermarks'],
+                         {'users': end, 'activities': end,
+                          'narratives': end})
 
     # Uncomment to skip this test
     # @unittest.skip("skipped test_run_MetricsImpl_is_admin")
@@ -2,6 +2,7 @@
 import json  # noqa: F401
 import os  # noqa: F401
 import time
+from kb_Metrics.metrics_dbi import MongoMetricsDBI
 from kb_Metrics.Test import Test
 
 debug = False
@@ -416,3 +417,202 @@ class kb_Metrics_query_jobs_admin_Test(Test):
         self.assertIn('job_states', result)
         self.assertIn('found_count', result)
         self.assertEqual(result['found_count'], 1)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_query_jobs_materialized") # noqa E501
+    def test_run_MetricsImpl_query_jobs_materialized(self):
+        # query_jobs from metrics.job_states returns the jobs of the live
+        # userjobstate/exec_tasks join
+        controller = self.db_controller
+        user = self.getContext()['user_id']
+        token = self.getContext()['token']
+        now = int(round(time.time() * 1000))
+        queries = [
+            {},
+            {'epoch_range': [0, now], 'offset': 5, 'limit': 5,
+             'sort': [{'field': 'created', 'direction': 'descending'}]},
+            {'filter': {'user_id': ['psdehal']}},
+            {'filter': {'status': ['queue', 'run']}},
+            {'filter': {'status': ['error', 'terminate']},
+             'sort': [{'field': 'updated', 'direction': 'ascending'}]},
+            {'search': [{'term': 'psdehal', 'type': 'exact'}]}]
+        live_rets = [controller.query_jobs_admin(user, dict(query), token)
+                     for query in queries]
+
+        controller.job_states_materialized = True
+        controller.__class__.job_states_synced_at = None
+        controller.__class__.job_states_attempted_at = 0
+        controller.__class__.job_states_built = False
+        controller.metrics_dbi.metricsDBs['metrics'][
+            'update_watermarks'].delete_one({'_id': 'job_states_built'})
+        try:
+            # the live jobs are served until update_metrics builds the
+            # collection
+            ret = controller.query_jobs_admin(user, {}, token)
+            self.assertNotIn('job_states_age', ret['stats']['perf'])
+            self.assertIn('join_mode', ret['stats']['perf'])
+            self.assertEqual(controller._build_job_states(token),
+                             TOTAL_COUNT)
+            rets = [controller.query_jobs_admin(user, dict(query), token)
+                    for query in queries]
+        finally:
+            controller.job_states_materialized = False
+        # the requests only read the collection; the first one started a
+        # background sync of it
+        self.assertGreaterEqual(rets[0]['stats']['perf']['job_states_age'],
+                                0)
+        syncer = controller.__class__.job_states_syncer
+        self.assertIsNotNone(syncer)
+        syncer.join(timeout=60)
+        self.assertFalse(syncer.is_alive())
+        self.assertIsNone(controller.__class__.job_states_sync_error)
+        for query, ret, live_ret in zip(queries, rets, live_rets):
+            for key in ('found_count', 'total_count'):
+                self.assertEqual(ret[key], live_ret[key])
+            if 'sort' in query:
+                self.assertEqual(ret['job_states'], live_ret['job_states'])
+            else:
+                self.assertCountEqual(ret['job_states'],
+                                      live_ret['job_states'])
+
+        # a second sync finds only the jobs updated at the watermark
+        self.assertLess(controller.sync_job_states(token), TOTAL_COUNT)
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_query_jobs_continuation_token") # noqa E501
+    def test_run_MetricsImpl_query_jobs_continuation_token(self):
+        # paging with the continuation tokens visits the jobs in the order
+        # of the offset pages
+        for field in ('created', 'updated', 'user_id'):
+            sort = [{'field': field, 'direction': 'descending'}]
+            ret = self.getImpl().query_jobs_admin(self.getContext(), {
+                'sort': sort})
+            all_jobs = ret[0]['job_states']
+            self.assertEqual(len(all_jobs), TOTAL_COUNT)
+
+            jobs = []
+            token = None
+            while True:
+                params = {'sort': sort, 'limit': 10}
+                if token:
+                    params['continuation_token'] = token
+                result = self.getImpl().query_jobs_admin(
+                    self.getContext(), params)[0]
+                self.assertEqual(result['found_count'], TOTAL_COUNT)
+                self.assertEqual(result['total_count'], TOTAL_COUNT)
+                jobs.extend(result['job_states'])
+                token = result['continuation_token']
+                if token is None:
+                    break
+            self.assertEqual([j['job_id'] for j in jobs],
+                             [j['job_id'] for j in all_jobs])
+
+        # a token is not valid for another sort, nor with an offset
+        ret = self.getImpl().query_jobs_admin(self.getContext(), {
+            'sort': [{'field': 'created', 'direction': 'ascending'}],
+            'limit': 5})
+        token = ret[0]['continuation_token']
+        self.assertIsNotNone(token)
+        err_msg = 'The continuation token does not match the sort.'
+        with self.assertRaisesRegex(ValueError, err_msg):
+            self.getImpl().query_jobs_admin(self.getContext(), {
+                'sort': [{'field': 'updated', 'direction': 'ascending'}],
+                'limit': 5, 'continuation_token': token})
+        with self.assertRaisesRegex(ValueError, 'offset'):
+            self.getImpl().query_jobs_admin(self.getContext(), {
+                'sort': [{'field': 'created', 'direction': 'ascending'}],
+                'offset': 5, 'limit': 5, 'continuation_token': token})
+        with self.assertRaisesRegex(ValueError, 'Invalid continuation token.'):
+            self.getImpl().query_jobs_admin(self.getContext(), {
+                'sort': [{'field': 'created', 'direction': 'ascending'}],
+                'limit': 5, 'continuation_token': 'not-a-token'})
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_query_jobs_skip_counts")
+    def test_run_MetricsImpl_query_jobs_skip_counts(self):
+        # a limited page has the jobs and counts of the whole query, with
+        # or without the counts
+        query = {'filter': {'status': ['error', 'terminate']},
+                 'sort': [{'field': 'created', 'direction': 'ascending'}]}
+        result = self.getImpl().query_jobs_admin(
+            self.getContext(), dict(query))[0]
+        self.assertEqual(result['found_count'], 15)
+        self.assertEqual(result['total_count'], TOTAL_COUNT)
+        all_jobs = result['job_states']
+
+        page = self.getImpl().query_jobs_admin(
+            self.getContext(), dict(query, offset=5, limit=5))[0]
+        self.assertEqual(page['found_count'], 15)
+        self.assertEqual(page['total_count'], TOTAL_COUNT)
+        self.assertEqual(page['job_states'], all_jobs[5:10])
+
+        page = self.getImpl().query_jobs_admin(
+            self.getContext(),
+            dict(query, offset=5, limit=5, skip_counts=1))[0]
+        self.assertIsNone(page['found_count'])
+        self.assertIsNone(page['total_count'])
+        self.assertEqual(page['job_states'], all_jobs[5:10])
+
+    # Uncomment to skip this test
+    # @unittest.skip("skipped test_run_MetricsImpl_query_jobs_lookup")
+    def test_run_MetricsImpl_query_jobs_lookup(self):
+        # joining the exec tasks with a $lookup returns the jobs of the two
+        # queries
+        controller = self.db_controller
+        user = self.getContext()['user_id']
+        token = self.getContext()['token']
+        queries = [
+            {},
+            {'offset': 5, 'limit': 5,
+             'sort': [{'field': 'created', 'direction': 'descending'}]},
+            {'filter': {'status': ['error', 'terminate']}, 'limit': 10,
+             'sort': [{'field': 'updated', 'direction': 'ascending'}]},
+            {'search': [{'term': 'psdehal', 'type': 'exact'}]}]
+        live_rets = [controller.query_jobs_admin(user, dict(query), token)
+                     for query in queries]
+        for live_ret in live_rets:
+            self.assertEqual(live_ret['stats']['perf']['join_mode'],
+                             'two_queries')
+
+        # mongo only joins collections of the same database
+        exec_tasks = list(self.client['exec_engine']['exec_tasks'].find())
+        ujs_exec_tasks = self.client['userjobstate']['exec_tasks']
+        controller.query_jobs_lookup = True
+        MongoMetricsDBI._exec_tasks_lookup.clear()
+        try:
+            ret = controller.query_jobs_admin(user, {}, token)
+            self.assertEqual(ret['stats']['perf']['join_mode'],
+                             'two_queries')
+
+            ujs_exec_tasks.insert_many(exec_tasks)
+            MongoMetricsDBI._exec_tasks_lookup.clear()
+            rets = [controller.query_jobs_admin(user, dict(query), token)
+                    for query in queries]
+            # keyed by the configured hosts, without selecting a server
+            dbi = controller.metrics_dbi
+            self.assertTrue(MongoMetricsDBI._exec_tasks_lookup[
+                (dbi.mongo_hosts, 'userjobstate')])
+            # the joined exec tasks are projected as list_exec_tasks
+            # projects them
+            jobs = dbi.query_ujs(
+                limit=5, sort=[{'field': 'created',
+                                'direction': 'ascending'}],
+                lookup_exec_tasks=True)[0]
+            self.assertEqual(len(jobs), 5)
+            for job in jobs:
+                self.assertCountEqual(
+                    job['exec_tasks'],
+                    dbi.list_exec_tasks(jobIDs=[str(job['_id'])]))
+        finally:
+            controller.query_jobs_lookup = False
+            MongoMetricsDBI._exec_tasks_lookup.clear()
+            ujs_exec_tasks.drop()
+        for query, ret, live_ret in zip(queries, rets, live_rets):
+            self.assertEqual(ret['stats']['perf']['join_mode'], 'lookup')
+            for key in ('found_count', 'total_count'):
+                self.assertEqual(ret[key], live_ret[key])
+            if 'sort' in query:
+                self.assertEqual(ret['job_states'], live_ret['job_states'])
+            else:
+                self.assertCountEqual(ret['job_states'],
+                                      live_ret['job_states'])